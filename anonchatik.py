@@ -164,10 +164,18 @@ def chat_handler(message):
         if message.text and message.text.startswith('/'): return # Ignore other commands
         bot.send_message(user_id, "Вы не в диалоге. Нажмите /next для поиска.")
 
-if __name__ == '__main__':
+def run_polling():
     while True:
         try:
             bot.polling(non_stop=True)
+            # polling returns normally only after bot.stop_polling()
+            break
         except Exception as e:
             logging.error(f"Polling error: {e}")
             time.sleep(5)
+
+def main():
+    run_polling()
+
+if __name__ == '__main__':
+    main()
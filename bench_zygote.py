@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта дочернего бота: `python script.py <id>` против fork из bot_zygote.py.
+
+Меряется время от запроса на запуск до обработки первого обновления. Бенчмарк
+генерирует синтетический скрипт бота: те же импорты, что у настоящих ботов,
+TeleBot с обработчиком сообщений и N КБ мертвого кода (по умолчанию 400 КБ,
+как dicelite_bot.py). Обработчик первого обновления пишет время в файл-маркер.
+Сеть не нужна: обновление подается через process_new_updates.
+
+    python bench_zygote.py --runs 10 --pad-kb 400
+"""
+
+import argparse
+import json
+import os
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_BOT_TEMPLATE = '''
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import requests
+import telebot
+from telebot import types
+try:
+    from aiocryptopay import AioCryptoPay
+except ImportError:
+    AioCryptoPay = None
+
+MARKER_PATH = os.environ["BENCH_MARKER"]
+bot = telebot.TeleBot("123456:bench", threaded=False)
+
+
+@bot.message_handler(func=lambda message: True)
+def on_first_update(message):
+    with open(MARKER_PATH, "w") as f:
+        f.write(repr(time.time()))
+
+
+update = types.Update.de_json({
+    "update_id": 1,
+    "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "bench"}, "text": "/start"},
+})
+bot.process_new_updates([update])
+'''
+
+
+def build_script(directory, pad_kb):
+    lines = [BENCH_BOT_TEMPLATE]
+    index = 0
+    while sum(len(line) for line in lines) < pad_kb * 1024:
+        lines.append(f"\ndef _padding_{index}(value):\n    result = value * {index} + {index}\n    return str(result).upper()\n")
+        index += 1
+    path = os.path.join(directory, 'bench_bot.py')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return path
+
+
+def wait_marker(path, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with open(path) as f:
+                content = f.read()
+            if content:
+                return float(content)
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.002)
+    raise TimeoutError(f"маркер {path} не появился за {timeout} сек.")
+
+
+def run_popen(script, marker, log_path):
+    env = dict(os.environ, BENCH_MARKER=marker)
+    started = time.time()
+    with open(log_path, 'a') as log_file:
+        process = subprocess.Popen([sys.executable, script, '1'], stdout=log_file, stderr=log_file, env=env)
+    handled = wait_marker(marker)
+    process.wait()
+    return handled - started
+
+
+class ZygoteClient:
+    def __init__(self, zygote_path, log_path):
+        self.log_file = open(log_path, 'a')
+        self.process = subprocess.Popen(
+            [sys.executable, zygote_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=self.log_file, text=True, bufsize=1
+        )
+
+    def request(self, payload, timeout=120):
+        self.process.stdin.write(json.dumps(payload) + "\n")
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f"зигота не ответила на {payload['cmd']}")
+        return json.loads(self.process.stdout.readline())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(timeout=10)
+        self.log_file.close()
+
+
+def run_zygote(client, script, marker, log_path):
+    env = dict(os.environ, BENCH_MARKER=marker)
+    started = time.time()
+    response = client.request({'cmd': 'spawn', 'bot_id': 1, 'script': script, 'env': env, 'log': log_path})
+    if not response.get('ok'):
+        raise RuntimeError(response)
+    return wait_marker(marker) - started
+
+
+def summary(name, samples):
+    ordered = sorted(samples)
+    p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+    return (f"{name:<8} n={len(samples):<3} median={statistics.median(samples) * 1000:8.1f} мс  "
+            f"p90={p90 * 1000:8.1f} мс  min={ordered[0] * 1000:8.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время до первого обновления: Popen против зиготы")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--pad-kb', type=int, default=400, help="размер мертвого кода в скрипте, КБ")
+    args = parser.parse_args()
+
+    zygote_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_zygote.py')
+    with tempfile.TemporaryDirectory() as directory:
+        script = build_script(directory, args.pad_kb)
+        log_path = os.path.join(directory, 'bench.log')
+        results = {'popen': [], 'zygote': []}
+
+        for i in range(args.runs):
+            results['popen'].append(run_popen(script, os.path.join(directory, f'popen_{i}.marker'), log_path))
+
+        client = ZygoteClient(zygote_path, log_path)
+        try:
+            # Прогрев зиготы — разовая цена, которую конструктор платит при старте
+            warmup_started = time.time()
+            client.request({'cmd': 'preload', 'script': script})
+            warmup = time.time() - warmup_started
+            for i in range(args.runs):
+                results['zygote'].append(run_zygote(client, script, os.path.join(directory, f'zygote_{i}.marker'), log_path))
+        finally:
+            client.close()
+
+    print(f"Скрипт: {args.pad_kb} КБ мертвого кода, прогонов: {args.runs}")
+    print(summary('popen', results['popen']))
+    print(summary('zygote', results['zygote']))
+    print(f"Прогрев зиготы (разово): {warmup * 1000:.1f} мс")
+    speedup = statistics.median(results['popen']) / statistics.median(results['zygote'])
+    print(f"Ускорение по медиане: x{speedup:.1f}")
+
+
+if __name__ == '__main__':
+    main()
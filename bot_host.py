@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Хост дочерних ботов конструктора.
+
+Один долгоживущий процесс держит несколько дочерних ботов (cashlait/dicelite/
+exchange/anonchat) как изолированных тенантов: каждый скрипт бота загружается
+отдельным модулем со своим окружением, своей БД и своим экземпляром TeleBot.
+
+Управление идет от конструктора построчным JSON через stdin, ответы уходят
+в исходный stdout. Все остальное (print, логи тенантов) пишется в лог хоста.
+Поле "id" команды возвращается в ответе без изменений — по нему конструктор
+отличает ответ на текущую команду от запоздавшего ответа на предыдущую.
+
+Команды:
+    {"id": 7, "cmd": "start", "bot_id": 1, "script": "/abs/path.py", "env": {...}}
+    {"id": 8, "cmd": "stop", "bot_id": 1}
+    {"id": 9, "cmd": "status"}
+    {"id": 10, "cmd": "ping"}
+
+Снимки конфигурации тенантов (env BOT_CONFIG_PATH) отслеживаются здесь же одним
+потоком: при смене mtime новая версия передается в apply_config_snapshot модуля.
+
+Если конструктор работает в режиме вебхуков, тенант получает WEBHOOK_PULL_URL и
+вместо long-poll в Telegram забирает свою очередь с единого входа конструктора.
+
+Точки входа скрипта бота: start_background() — фоновые потоки (планировщики,
+обновление курсов), run_polling() — прием обновлений из Telegram, stop_background() —
+остановка фоновых потоков. Режим вебхуков заменяет только run_polling. Скрипты без
+этих функций запускаются через main() (или bot.infinity_polling).
+
+Модуль остановленного тенанта из памяти не выгружается, поэтому stop_background()
+должен освобождать и то, что модуль создал при импорте (пулы потоков, HTTP-сессии).
+Остальное ограничивает конструктор: хост после BOT_HOST_MAX_TENANT_STARTS запусков
+перезапускается, как только опустеет.
+"""
+
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+HOST_ID = sys.argv[1] if len(sys.argv) > 1 else '0'
+
+# Канал ответов конструктору — копия исходного stdout. Сам stdout переводим
+# в лог хоста (stderr), чтобы print() тенантов не ломал протокол.
+_control_out = os.fdopen(os.dup(1), 'w', encoding='utf-8', buffering=1)
+os.dup2(2, 1)
+sys.stdout = os.fdopen(1, 'w', encoding='utf-8', buffering=1)
+
+logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - host{HOST_ID} - %(levelname)s - %(message)s')
+
+STOP_JOIN_TIMEOUT = 15
+CONFIG_WATCH_INTERVAL = 2
+WEBHOOK_PULL_TIMEOUT = 10
+WEBHOOK_PULL_RETRY_DELAY = 3
+
+tenants = {}
+tenants_lock = threading.Lock()
+# os.environ и sys.argv общие для процесса, поэтому импорт тенантов идет строго по одному
+import_lock = threading.Lock()
+
+
+class Tenant:
+    def __init__(self, bot_id, module, env):
+        self.bot_id = bot_id
+        self.module = module
+        self.config_path = env.get('BOT_CONFIG_PATH')
+        self.config_mtime = None
+        self.pull_url = env.get('WEBHOOK_PULL_URL')
+        self.webhook_secret = env.get('WEBHOOK_SECRET', '')
+        self.thread = None
+        self.started_at = int(time.time())
+        self.stopping = False
+        self.error = None
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+def load_tenant_module(bot_id, script_path, env):
+    """Загружает скрипт бота как отдельный модуль с окружением тенанта.
+
+    Скрипты читают настройки через os.getenv на уровне модуля, поэтому на время
+    импорта окружение и argv процесса подменяются значениями тенанта.
+    """
+    module_name = f"tenant_{bot_id}_{int(time.time() * 1000)}"
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    with import_lock:
+        saved_env = os.environ.copy()
+        saved_argv = sys.argv[:]
+        root_logger = logging.getLogger()
+        saved_handlers = root_logger.handlers[:]
+        saved_level = root_logger.level
+        try:
+            os.environ.update(env)
+            sys.argv = [script_path, str(bot_id)]
+            spec.loader.exec_module(module)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+            sys.argv = saved_argv
+            # Скрипты зовут logging.basicConfig(force=True) — возвращаем логгер хоста
+            root_logger.handlers = saved_handlers
+            root_logger.setLevel(saved_level)
+    return module
+
+
+def pull_updates(tenant):
+    """Режим вебхуков: обновления забираются с входа конструктора, offset подтверждает
+    обработанную пачку так же, как в getUpdates."""
+    from telebot import types as telebot_types
+    offset = 0
+    while not tenant.stopping:
+        request = urllib.request.Request(
+            f"{tenant.pull_url}?timeout={WEBHOOK_PULL_TIMEOUT}&offset={offset}",
+            headers={'X-Telegram-Bot-Api-Secret-Token': tenant.webhook_secret},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=WEBHOOK_PULL_TIMEOUT + 5) as response:
+                updates = json.loads(response.read().decode('utf-8'))
+        except Exception as e:
+            logging.warning(f"Тенант {tenant.bot_id}: вход вебхуков недоступен: {e}")
+            time.sleep(WEBHOOK_PULL_RETRY_DELAY)
+            continue
+        if not updates:
+            continue
+        tenant.module.bot.process_new_updates([telebot_types.Update.de_json(update) for update in updates])
+        offset = max(update.get('update_id', 0) for update in updates) + 1
+
+
+def run_tenant(tenant):
+    start_background = getattr(tenant.module, 'start_background', None)
+    run_polling = getattr(tenant.module, 'run_polling', None)
+    entry = getattr(tenant.module, 'main', None)
+    try:
+        if callable(start_background):
+            start_background()
+        if tenant.pull_url:
+            pull_updates(tenant)
+        elif callable(run_polling):
+            run_polling()
+        elif callable(entry):
+            entry()
+        else:
+            tenant.module.bot.infinity_polling(skip_pending=True)
+    except BaseException as e:
+        tenant.error = str(e)
+        logging.error(f"Тенант {tenant.bot_id} завершился с ошибкой: {e}", exc_info=True)
+    if not tenant.stopping:
+        logging.warning(f"Тенант {tenant.bot_id} остановился сам.")
+
+
+def start_tenant(bot_id, script_path, env):
+    with tenants_lock:
+        current = tenants.get(bot_id)
+        if current and current.is_alive():
+            return {'ok': False, 'error': 'already_running'}
+    try:
+        module = load_tenant_module(bot_id, script_path, env)
+    except BaseException as e:
+        # SystemExit тоже ловим: некоторые скрипты делают exit(1) без токена
+        logging.error(f"Не удалось загрузить тенант {bot_id}: {e}", exc_info=True)
+        return {'ok': False, 'error': f"load failed: {e}"}
+    if getattr(module, 'bot', None) is None:
+        return {'ok': False, 'error': 'script has no bot object'}
+    tenant = Tenant(bot_id, module, env)
+    tenant.thread = threading.Thread(target=run_tenant, args=(tenant,), name=f"tenant-{bot_id}", daemon=True)
+    with tenants_lock:
+        tenants[bot_id] = tenant
+    tenant.thread.start()
+    logging.info(f"Тенант {bot_id} запущен ({os.path.basename(script_path)}).")
+    return {'ok': True, 'pid': os.getpid()}
+
+
+def stop_tenant(bot_id):
+    with tenants_lock:
+        tenant = tenants.pop(bot_id, None)
+    if tenant is None:
+        return {'ok': False, 'error': 'not_found'}
+    tenant.stopping = True
+    try:
+        tenant.module.bot.stop_polling()
+    except Exception as e:
+        logging.warning(f"stop_polling для тенанта {bot_id} завершился ошибкой: {e}")
+    stop_background = getattr(tenant.module, 'stop_background', None)
+    if callable(stop_background):
+        try:
+            stop_background()
+        except Exception as e:
+            logging.warning(f"stop_background для тенанта {bot_id} завершился ошибкой: {e}")
+    if tenant.thread is not None:
+        tenant.thread.join(STOP_JOIN_TIMEOUT)
+    alive = tenant.is_alive()
+    if alive:
+        logging.warning(f"Тенант {bot_id} не завершился за {STOP_JOIN_TIMEOUT} сек.")
+    else:
+        logging.info(f"Тенант {bot_id} остановлен.")
+    return {'ok': True, 'alive': alive}
+
+
+def poll_tenant_config(tenant):
+    apply = getattr(tenant.module, 'apply_config_snapshot', None)
+    if not tenant.config_path or not callable(apply):
+        return
+    try:
+        mtime = os.stat(tenant.config_path).st_mtime_ns
+    except OSError:
+        return
+    if mtime == tenant.config_mtime:
+        return
+    try:
+        with open(tenant.config_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Не удалось прочитать снимок конфигурации тенанта {tenant.bot_id}: {e}")
+        return
+    tenant.config_mtime = mtime
+    if apply(snapshot):
+        logging.info(f"Тенант {tenant.bot_id}: применена конфигурация v{snapshot.get('version')}.")
+
+
+def config_watcher():
+    while True:
+        time.sleep(CONFIG_WATCH_INTERVAL)
+        with tenants_lock:
+            snapshot = list(tenants.values())
+        for tenant in snapshot:
+            try:
+                poll_tenant_config(tenant)
+            except Exception as e:
+                logging.error(f"Ошибка применения конфигурации тенанта {tenant.bot_id}: {e}", exc_info=True)
+
+
+def host_status():
+    with tenants_lock:
+        snapshot = list(tenants.values())
+    return {
+        'ok': True,
+        'pid': os.getpid(),
+        'tenants': {
+            str(t.bot_id): {'alive': t.is_alive(), 'started_at': t.started_at, 'error': t.error}
+            for t in snapshot
+        },
+    }
+
+
+def handle_command(payload):
+    cmd = payload.get('cmd')
+    if cmd == 'start':
+        return start_tenant(int(payload['bot_id']), payload['script'], payload.get('env') or {})
+    if cmd == 'stop':
+        return stop_tenant(int(payload['bot_id']))
+    if cmd == 'status':
+        return host_status()
+    if cmd == 'ping':
+        return {'ok': True, 'pid': os.getpid()}
+    return {'ok': False, 'error': f"unknown command: {cmd}"}
+
+
+def reply(payload):
+    _control_out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    _control_out.flush()
+
+
+def main():
+    logging.info(f"Хост ботов #{HOST_ID} запущен (PID {os.getpid()}).")
+    threading.Thread(target=config_watcher, name="config-watcher", daemon=True).start()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            payload = json.loads(line)
+            request_id = payload.get('id')
+            response = handle_command(payload)
+        except Exception as e:
+            logging.error(f"Ошибка обработки команды {line[:200]}: {e}", exc_info=True)
+            response = {'ok': False, 'error': str(e)}
+        reply({**response, 'id': request_id})
+    # stdin закрыт — конструктор завершился, гасим всех тенантов вместе с хостом
+    logging.info(f"Канал управления закрыт, хост #{HOST_ID} завершает работу.")
+    with tenants_lock:
+        snapshot = list(tenants.values())
+    for tenant in snapshot:
+        tenant.stopping = True
+        try:
+            tenant.module.bot.stop_polling()
+        except Exception:
+            pass
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Зигота дочерних ботов конструктора.
+
+Долгоживущий процесс один раз импортирует общие зависимости ботов (telebot,
+requests, aiocryptopay, ...) и компилирует скрипты ботов, а на каждый запуск
+делает fork уже прогретого интерпретатора. Окружение, argv и лог бота
+применяются в ребенке после fork, дальше скрипт исполняется как __main__ —
+так же, как при запуске `python script.py <bot_id>`, но без старта
+интерпретатора, импорта зависимостей и разбора исходника.
+
+Управление идет от конструктора построчным JSON через stdin, ответы уходят
+в исходный stdout. Зигота однопоточная: fork из процесса с потоками небезопасен.
+
+Команды:
+    {"cmd": "preload", "script": "/abs/path.py"}
+    {"cmd": "spawn", "bot_id": 1, "script": "/abs/path.py", "env": {...}, "log": "/abs/logs/bot_1.log"}
+    {"cmd": "reap"}
+    {"cmd": "ping"}
+"""
+
+import ast
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import traceback
+import types
+
+# Канал ответов конструктору — копия исходного stdout, как в bot_host.py
+_control_out = os.fdopen(os.dup(1), 'w', encoding='utf-8', buffering=1)
+os.dup2(2, 1)
+sys.stdout = os.fdopen(1, 'w', encoding='utf-8', buffering=1)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - zygote - %(levelname)s - %(message)s')
+
+# Зависимости, общие для всех ботов, — импортируются до первого скрипта
+PRELOAD_MODULES = ['telebot', 'telebot.types', 'telebot.apihelper', 'requests', 'sqlite3', 'decimal', 'aiocryptopay', 'aiohttp']
+
+code_cache = {}  # script_path -> (mtime_ns, code)
+children = {}  # pid -> bot_id
+exited = {}  # pid -> exit_code
+
+
+def preload_module(name):
+    try:
+        importlib.import_module(name)
+    except Exception as e:
+        # Отсутствующая зависимость — проблема самого бота, он упадет уже в ребенке
+        logging.info(f"Модуль {name} не предзагружен: {e}")
+
+
+def module_imports(tree):
+    """Имена модулей из импортов верхнего уровня скрипта (включая try/if-блоки)."""
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.append(node.module)
+    return names
+
+
+def get_code(script_path):
+    mtime = os.stat(script_path).st_mtime_ns
+    cached = code_cache.get(script_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(script_path, 'rb') as f:
+        source = f.read()
+    tree = ast.parse(source, script_path)
+    for name in module_imports(tree):
+        if name not in sys.modules and name != '__future__':
+            preload_module(name)
+    code = compile(tree, script_path, 'exec', dont_inherit=True)
+    code_cache[script_path] = (mtime, code)
+    logging.info(f"Скрипт {os.path.basename(script_path)} скомпилирован и закэширован.")
+    return code
+
+
+def run_child(bot_id, script_path, code, env, log_path):
+    """Выполняется в ребенке после fork и не возвращается."""
+    exit_code = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        _control_out.close()
+        log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(null_fd)
+        os.close(log_fd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = [script_path, str(bot_id)]
+        sys.path[0] = os.path.dirname(script_path)
+        # Скрипт сам настраивает логирование — handler зиготы ему не нужен
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        main_module = types.ModuleType('__main__')
+        main_module.__file__ = script_path
+        main_module.__builtins__ = __builtins__
+        sys.modules['__main__'] = main_module
+        exec(code, main_module.__dict__)
+        exit_code = 0
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(exit_code)
+
+
+def spawn(bot_id, script_path, env, log_path):
+    code = get_code(script_path)
+    pid = os.fork()
+    if pid == 0:
+        run_child(bot_id, script_path, code, env, log_path)
+    children[pid] = bot_id
+    logging.info(f"Бот {bot_id} запущен из зиготы (PID {pid}).")
+    return {'ok': True, 'pid': pid}
+
+
+def on_sigchld(signum, frame):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        exited[pid] = os.waitstatus_to_exitcode(status)
+        children.pop(pid, None)
+    # Дети зиготы не дети конструктора: будим его супервизор тем же сигналом
+    try:
+        os.kill(os.getppid(), signal.SIGCHLD)
+    except OSError:
+        pass
+
+
+def handle_command(payload):
+    cmd = payload.get('cmd')
+    if cmd == 'spawn':
+        return spawn(int(payload['bot_id']), payload['script'], payload.get('env') or {}, payload['log'])
+    if cmd == 'preload':
+        get_code(payload['script'])
+        return {'ok': True}
+    if cmd == 'reap':
+        codes = {str(pid): code for pid, code in exited.items()}
+        exited.clear()
+        return {'ok': True, 'exited': codes}
+    if cmd == 'ping':
+        return {'ok': True, 'pid': os.getpid(), 'children': len(children)}
+    return {'ok': False, 'error': f"unknown command: {cmd}"}
+
+
+def reply(payload):
+    _control_out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    _control_out.flush()
+
+
+def main():
+    started = time.monotonic()
+    for name in PRELOAD_MODULES:
+        preload_module(name)
+    logging.info(f"Зигота запущена (PID {os.getpid()}), зависимости загружены за {time.monotonic() - started:.2f} сек.")
+    signal.signal(signal.SIGCHLD, on_sigchld)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            response = handle_command(json.loads(line))
+        except Exception as e:
+            logging.error(f"Ошибка обработки команды {line[:200]}: {e}", exc_info=True)
+            response = {'ok': False, 'error': str(e)}
+        reply(response)
+    # Запущенные боты живут в своих сессиях и переживают зиготу, как и при Popen
+    logging.info("Канал управления закрыт, зигота завершает работу.")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
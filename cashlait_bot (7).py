@@ -16,16 +16,20 @@ from __future__ import annotations
 import json
 import logging
 import os
+import random
 import sqlite3
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from email.utils import parsedate_to_datetime
 from io import BytesIO
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 import telebot
 from telebot import types
 from telebot.apihelper import ApiException
@@ -34,7 +38,8 @@ from telebot.apihelper import ApiException
 # ⚠️ ВСТАВЬТЕ ВАШ ТОКЕН БОТА ОТ @BotFather:
 BOT_TOKEN = os.getenv("CASHLAIT_BOT_TOKEN", "8400644706:AAFjCQDxS73hvhizY4f3v94-vlXLkvqGHdQ")  # Например: "1234567890:ABCdefGHIjklMNOpqrsTUVwxyz"
 CONSTRUCTOR_BOT_USERNAME = os.getenv("CONSTRUCTOR_BOT_USERNAME", "MinxoCreate_bot").strip("@ ")
-CONSTRUCTOR_BOT_LINK = f"https://t.me/{CONSTRUCTOR_BOT_USERNAME}"
+CONSTRUCTOR_BOT_LINK = os.getenv("CONSTRUCTOR_LINK_URL", f"https://t.me/{CONSTRUCTOR_BOT_USERNAME}")
+CONSTRUCTOR_BOT_LINK_TEXT = os.getenv("CONSTRUCTOR_LINK_TEXT", "🤖 Хочу такого же бота")
 ADMIN_IDS = {
     int(token)
     for token in os.getenv("ADMIN_IDS", "6745031200,7585735331").replace(";", ",").split(",")
@@ -48,6 +53,52 @@ LOG_FILE_PATH = os.getenv(
     "CASHLAIT_LOG",
     os.path.join(os.path.dirname(__file__), "cashlait_bot.log"),
 )
+# Снимок конфигурации от конструктора: изменения настроек применяются без перезапуска
+BOT_CONFIG_PATH = os.getenv("BOT_CONFIG_PATH")
+CONFIG_WATCH_INTERVAL = 2.0
+# Планировщик удержаний за подписки: каждая запись проверяется к своему next_check_at
+WATCHLIST_TICK_SECONDS = 60
+WATCHLIST_PAGE_SIZE = 200
+WATCHLIST_CHECK_WORKERS = 8
+WATCHLIST_RECHECK_INTERVAL = timedelta(minutes=10)
+WATCHLIST_HOLD_PERIOD = timedelta(days=3)
+# Сколько после окончания удержания повторять проверку, если Flyer не ответил
+WATCHLIST_EXPIRED_RETRY_WINDOW = timedelta(days=1)
+# Поиск новых заданий Flyer: проход по активным пользователям частями с чекпоинтом
+FLYER_DISCOVERY_TICK_SECONDS = 60
+FLYER_DISCOVERY_USERS_PER_TICK = 500
+FLYER_DISCOVERY_WORKERS = 8
+FLYER_DISCOVERY_ACTIVE_WINDOW = timedelta(days=int(os.getenv("CASHLAIT_FLYER_ACTIVE_DAYS", "7")))
+# Общий лимит запросов к Flyer на один API ключ (все вызовы процесса)
+FLYER_RATE_PER_SECOND = 10.0
+# HTTP клиенты Flyer и Crypto Pay: пул соединений, таймауты, повторы и автомат отключения
+HTTP_POOL_SIZE = 20
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 15
+HTTP_RETRY_ATTEMPTS = 3
+HTTP_RETRY_BASE_DELAY = 0.5
+HTTP_BREAKER_FAILURES = 5
+HTTP_BREAKER_COOLDOWN = 30.0
+# Retry-After из 429 дольше этого не ждем — отдаем ответ вызывающему
+HTTP_RETRY_AFTER_MAX = 30.0
+HTTP_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 15000)
+# Вторичные индексы Storage под горячие запросы: имя -> "таблица (колонки)"
+STORAGE_INDEXES = {
+    "idx_task_logs_user_signature": "task_logs (user_id, signature, context)",
+    "idx_pending_tasks_signature": "pending_tasks (signature)",
+    "idx_users_referrer": "users (referrer_id)",
+    "idx_subscription_watchlist_due": "subscription_watchlist (completed, next_check_at, id)",
+    "idx_required_channels_category": "required_channels (category, id)",
+    "idx_custom_tasks_placement": "custom_tasks (placement, is_active, id)",
+    "idx_promo_tasks_creator": "promo_tasks (creator_id, created_at)",
+    "idx_promo_tasks_active": "promo_tasks (is_active, created_at)",
+}
+# Курсы Crypto Pay: фоновое обновление таблицы и предельный возраст курса для выплат и пополнений
+EXCHANGE_RATE_REFRESH_SECONDS = 60
+EXCHANGE_RATE_MAX_STALENESS = timedelta(minutes=15)
+
+# Сигнал остановки фоновых потоков (тенант под хостом останавливается без выхода процесса)
+background_stop = threading.Event()
 
 
 DEFAULT_SETTINGS: Dict[str, str] = {
@@ -233,6 +284,21 @@ def convert_admin_value(value_type: str, raw_text: str) -> Tuple[bool, Optional[
         return False, None, "Введите корректное число."
 
 
+@dataclass
+class WatchOutcome:
+    """Итог проверки одной записи subscription_watchlist.
+
+    action: release — удержание переходит на баланс, penalty — списывается,
+    expire — запись закрывается без движения средств, reschedule — следующая
+    проверка в next_check_at. checked_at задан, если Flyer ответил.
+    """
+
+    watch: sqlite3.Row
+    action: str
+    next_check_at: Optional[datetime] = None
+    checked_at: Optional[datetime] = None
+
+
 class Storage:
     """Thread-safe SQLite helper."""
 
@@ -359,6 +425,7 @@ class Storage:
                     reward REAL NOT NULL,
                     expires_at TEXT NOT NULL,
                     last_checked TEXT,
+                    next_check_at TEXT,
                     completed INTEGER NOT NULL DEFAULT 0,
                     penalty_applied INTEGER NOT NULL DEFAULT 0,
                     created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
@@ -456,6 +523,13 @@ class Storage:
             self._ensure_column("users", "language_code TEXT")
             self._ensure_column("users", "frozen_balance REAL NOT NULL DEFAULT 0")
             self._ensure_column("users", "promo_balance REAL NOT NULL DEFAULT 0")
+            self._ensure_column("subscription_watchlist", "next_check_at TEXT")
+            # Записи до планировщика сразу становятся к проверке
+            self._conn.execute(
+                "UPDATE subscription_watchlist SET next_check_at = created_at WHERE next_check_at IS NULL AND completed = 0"
+            )
+            for name, target in STORAGE_INDEXES.items():
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
 
     def _ensure_column(self, table: str, column_def: str) -> None:
         column_name = column_def.split()[0]
@@ -643,12 +717,14 @@ class Storage:
         reward: Decimal,
         expires_at: datetime,
     ) -> None:
+        now = now_utc()
+        next_check_at = min(now + WATCHLIST_RECHECK_INTERVAL, expires_at)
         with self._lock, self._conn:
             self._conn.execute(
                 """
                 INSERT INTO subscription_watchlist (
-                    user_id, signature, source, reward, expires_at, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?)
+                    user_id, signature, source, reward, expires_at, next_check_at, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     user_id,
@@ -656,54 +732,112 @@ class Storage:
                     source,
                     float(reward),
                     expires_at.isoformat(timespec="seconds"),
-                    now_utc().isoformat(timespec="seconds"),
+                    next_check_at.isoformat(timespec="seconds"),
+                    now.isoformat(timespec="seconds"),
                 ),
             )
 
-    def get_active_subscription_watches(
+    def get_due_subscription_watches(
         self,
+        now: datetime,
         *,
         user_id: Optional[int] = None,
-        limit: int = 20,
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = WATCHLIST_PAGE_SIZE,
     ) -> List[sqlite3.Row]:
-        query = """
-            SELECT *
-            FROM subscription_watchlist
-            WHERE completed = 0
-            ORDER BY created_at
-            LIMIT ?
-        """
-        params: List[Any] = [limit]
+        """Страница записей с next_check_at <= now по порядку (next_check_at, id).
+        after — ключ последней записи предыдущей страницы."""
+        query = "SELECT * FROM subscription_watchlist WHERE completed = 0 AND next_check_at <= ?"
+        params: List[Any] = [now.isoformat(timespec="seconds")]
         if user_id:
-            query = """
-                SELECT *
-                FROM subscription_watchlist
-                WHERE completed = 0 AND user_id = ?
-                ORDER BY created_at
-            """
-            params = [user_id]
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if after:
+            query += " AND (next_check_at, id) > (?, ?)"
+            params.extend(after)
+        query += " ORDER BY next_check_at, id LIMIT ?"
+        params.append(limit)
         with self._lock:
             cur = self._conn.execute(query, params)
             return cur.fetchall()
 
-    def mark_watch_completed(self, watch_id: int, *, penalized: bool = False) -> None:
+    def apply_watch_outcomes(self, outcomes: List[WatchOutcome]) -> List[WatchOutcome]:
+        """Закрытие/перенос проверок страницы, движения баланса и записи task_logs одной транзакцией.
+
+        Деньги двигаются только для записей, которые закрыл именно этот вызов
+        (UPDATE ... AND completed = 0 затронул строку): параллельный проход из
+        ensure_member и фоновый тик не выплатят и не спишут одно удержание дважды.
+        Возвращает примененные итоги — по ним и отправляются уведомления.
+        """
+        now_text = now_utc().isoformat(timespec="seconds")
+        applied: List[WatchOutcome] = []
         with self._lock, self._conn:
-            self._conn.execute(
+            for outcome in outcomes:
+                watch = outcome.watch
+                checked_text = outcome.checked_at.isoformat(timespec="seconds") if outcome.checked_at else None
+                if outcome.action == "reschedule":
+                    cur = self._conn.execute(
+                        """
+                        UPDATE subscription_watchlist
+                        SET next_check_at = ?, last_checked = COALESCE(?, last_checked)
+                        WHERE id = ? AND completed = 0
+                        """,
+                        (outcome.next_check_at.isoformat(timespec="seconds"), checked_text, watch["id"]),
+                    )
+                    if cur.rowcount == 1:
+                        applied.append(outcome)
+                    continue
+                cur = self._conn.execute(
+                    """
+                    UPDATE subscription_watchlist
+                    SET completed = 1,
+                        penalty_applied = CASE WHEN ? THEN 1 ELSE penalty_applied END,
+                        last_checked = COALESCE(?, last_checked)
+                    WHERE id = ? AND completed = 0
+                    """,
+                    (1 if outcome.action == "penalty" else 0, checked_text, watch["id"]),
+                )
+                if cur.rowcount != 1:
+                    continue
+                applied.append(outcome)
+                reward = dec(watch["reward"], "0")
+                if reward <= 0 or outcome.action not in ("release", "penalty"):
+                    continue
+                if outcome.action == "release":
+                    balance_delta, context, logged = float(reward), "frozen_to_balance", float(reward)
+                else:
+                    balance_delta, context, logged = 0.0, "penalty", float(-reward)
+                self._conn.execute(
+                    """
+                    UPDATE users
+                    SET balance = balance + ?,
+                        frozen_balance = COALESCE(frozen_balance, 0) + ?
+                    WHERE user_id = ?
+                    """,
+                    (balance_delta, float(-reward), watch["user_id"]),
+                )
+                self._conn.execute(
+                    """
+                    INSERT INTO task_logs (user_id, signature, source, context, reward, completed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (watch["user_id"], watch["signature"], watch["source"], context, logged, now_text),
+                )
+        return applied
+
+    def subscription_watch_backlog(self, now: datetime) -> Tuple[int, Optional[str]]:
+        """Сколько записей уже пора проверить и next_check_at самой старой из них."""
+        with self._lock:
+            cur = self._conn.execute(
                 """
-                UPDATE subscription_watchlist
-                SET completed = 1,
-                    penalty_applied = CASE WHEN ? THEN 1 ELSE penalty_applied END
-                WHERE id = ?
+                SELECT COUNT(*) AS c, MIN(next_check_at) AS oldest
+                FROM subscription_watchlist
+                WHERE completed = 0 AND next_check_at <= ?
                 """,
-                (1 if penalized else 0, watch_id),
-            )
-
-    def update_watch_last_checked(self, watch_id: int, when: datetime) -> None:
-        with self._lock, self._conn:
-            self._conn.execute(
-                "UPDATE subscription_watchlist SET last_checked = ? WHERE id = ?",
-                (when.isoformat(timespec="seconds"), watch_id),
+                (now.isoformat(timespec="seconds"),),
             )
+            row = cur.fetchone()
+        return row["c"], row["oldest"]
 
     def get_setting(self, key: str, default: Optional[str] = None) -> str:
         with self._lock:
@@ -720,6 +854,36 @@ class Storage:
                 (key, value),
             )
 
+    def list_active_users_after(self, after_user_id: int, since: datetime, limit: int) -> List[sqlite3.Row]:
+        """Следующая порция пользователей с last_seen >= since по возрастанию user_id."""
+        with self._lock:
+            cur = self._conn.execute(
+                """
+                SELECT user_id, language_code
+                FROM users
+                WHERE user_id > ? AND last_seen >= ?
+                ORDER BY user_id
+                LIMIT ?
+                """,
+                (after_user_id, since.isoformat(timespec="seconds"), limit),
+            )
+            return cur.fetchall()
+
+    def pending_task_signatures(self, user_ids: List[int], context: str) -> Dict[int, set]:
+        """Подписи закэшированных заданий сразу для многих пользователей."""
+        result: Dict[int, set] = {user_id: set() for user_id in user_ids}
+        if not user_ids:
+            return result
+        placeholders = ",".join("?" * len(user_ids))
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT user_id, signature FROM pending_tasks WHERE context = ? AND user_id IN ({placeholders})",
+                (context, *user_ids),
+            )
+            for row in cur.fetchall():
+                result[row["user_id"]].add(row["signature"])
+        return result
+
     def all_user_ids(self) -> List[int]:
         with self._lock:
             cur = self._conn.execute("SELECT user_id FROM users")
@@ -1084,24 +1248,99 @@ class Storage:
 
 db = Storage(DATABASE_PATH)
 
-def apply_env_overrides() -> None:
-    overrides = {
-        "flyer_api_key": os.getenv("CASHLAIT_FLYER_API_KEY"),
-        "crypto_pay_token": os.getenv("CASHLAIT_CRYPTO_PAY_TOKEN"),
-        "currency_symbol": os.getenv("CASHLAIT_CURRENCY_SYMBOL"),
-        "flyer_task_limit": os.getenv("CASHLAIT_FLYER_TASK_LIMIT"),
-        "welcome_text": os.getenv("CASHLAIT_WELCOME_TEXT"),
-    }
-    for key, value in overrides.items():
-        if value is None:
-            continue
-        cleaned = value.strip()
-        if not cleaned:
-            continue
-        db.set_setting(key, cleaned)
+# Настройки, которые задает конструктор: ключ settings -> переменная окружения/снимка
+CONSTRUCTOR_ENV_SETTINGS = {
+    "flyer_api_key": "CASHLAIT_FLYER_API_KEY",
+    "crypto_pay_token": "CASHLAIT_CRYPTO_PAY_TOKEN",
+    "currency_symbol": "CASHLAIT_CURRENCY_SYMBOL",
+    "flyer_task_limit": "CASHLAIT_FLYER_TASK_LIMIT",
+    "welcome_text": "CASHLAIT_WELCOME_TEXT",
+}
+# Значения, которые последний раз пришли от конструктора (JSON), — чтобы снимать удаленные
+CONSTRUCTOR_OVERRIDES_SETTING = "constructor_overrides"
+
+
+def apply_env_overrides(source: Optional[Dict[str, str]] = None) -> None:
+    """Переносит настройки конструктора в settings.
+
+    Пустая или отсутствующая переменная означает, что владелец удалил настройку в
+    конструкторе: если значение в БД все еще то, что пришло от конструктора прошлый
+    раз, оно сбрасывается на значение по умолчанию. Правки из админки бота не трогаются.
+    """
+    source = os.environ if source is None else source
+    try:
+        previous = json.loads(db.get_setting(CONSTRUCTOR_OVERRIDES_SETTING, "{}") or "{}")
+    except ValueError:
+        previous = {}
+    applied: Dict[str, str] = {}
+    for key, env_name in CONSTRUCTOR_ENV_SETTINGS.items():
+        cleaned = (source.get(env_name) or "").strip()
+        if cleaned:
+            db.set_setting(key, cleaned)
+            applied[key] = cleaned
+        elif key in previous and db.get_setting(key) == previous[key]:
+            db.set_setting(key, DEFAULT_SETTINGS.get(key, ""))
+    db.set_setting(CONSTRUCTOR_OVERRIDES_SETTING, json.dumps(applied, ensure_ascii=False))
+
+
+def write_config_ack(version: int) -> None:
+    """Подтверждает конструктору примененную версию снимка (<снимок>.ack)."""
+    if not BOT_CONFIG_PATH:
+        return
+    ack_path = f"{BOT_CONFIG_PATH}.ack"
+    try:
+        with open(f"{ack_path}.tmp", "w", encoding="utf-8") as f:
+            f.write(str(version))
+        os.replace(f"{ack_path}.tmp", ack_path)
+    except OSError as exc:
+        logger.warning("Не удалось подтвердить конфигурацию v%s: %s", version, exc)
+
 
 apply_env_overrides()
 
+applied_config_version = int(os.getenv("BOT_CONFIG_VERSION", "0") or 0)
+write_config_ack(applied_config_version)
+
+
+def apply_config_snapshot(snapshot: Dict[str, Any]) -> bool:
+    """Применяет снимок конфигурации конструктора, если он новее уже примененного.
+
+    Все переопределения CashLait живут в таблице settings, поэтому достаточно
+    переписать их — обработчики читают значения при каждом обращении.
+    """
+    global applied_config_version
+    version = int(snapshot.get("version") or 0)
+    if version <= applied_config_version:
+        return False
+    apply_env_overrides(snapshot.get("env") or {})
+    applied_config_version = version
+    write_config_ack(version)
+    logger.info("Применена конфигурация конструктора v%s", version)
+    return True
+
+
+def watch_config_snapshot() -> None:
+    last_mtime = None
+    while True:
+        time.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            mtime = os.stat(BOT_CONFIG_PATH).st_mtime_ns
+        except OSError:
+            continue
+        if mtime == last_mtime:
+            continue
+        try:
+            with open(BOT_CONFIG_PATH, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.warning("Не удалось прочитать снимок конфигурации: %s", exc)
+            continue
+        last_mtime = mtime
+        try:
+            apply_config_snapshot(snapshot)
+        except Exception as exc:
+            logger.error("Ошибка применения снимка конфигурации: %s", exc, exc_info=True)
+
 if BOT_TOKEN in {"", "PASTE_YOUR_TOKEN", "ВАШ_ТОКЕН_ОТ_BOTFATHER_ЗДЕСЬ"}:
     raise RuntimeError("⚠️ УКАЖИТЕ ТОКЕН БОТА! Откройте cashlait_bot.py и замените BOT_TOKEN на ваш токен от @BotFather")
 
@@ -1114,12 +1353,242 @@ except ApiException as exc:
     raise RuntimeError(f"Не удалось получить информацию о боте: {exc}") from exc
 
 
-class FlyerAPI:
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """После HTTP_BREAKER_FAILURES сетевых ошибок подряд отклоняет вызовы на HTTP_BREAKER_COOLDOWN сек.,
+    затем пропускает один пробный запрос; остальные отклоняются, пока он не вернется."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < HTTP_BREAKER_COOLDOWN:
+                raise CircuitOpenError(f"{self.name}: сервис недоступен, запросы приостановлены")
+            if self.probing:
+                raise CircuitOpenError(f"{self.name}: сервис недоступен, идет пробный запрос")
+            self.probing = True
+
+    def release_probe(self) -> None:
+        """Пробный запрос завершился без вывода о доступности (429, посторонняя ошибка)."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= HTTP_BREAKER_FAILURES:
+                if self.opened_at is None:
+                    logger.warning("%s: %s ошибок подряд, запросы приостановлены на %s сек.", self.name, self.failures, HTTP_BREAKER_COOLDOWN)
+                self.opened_at = time.monotonic()
+
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "open" if time.monotonic() - self.opened_at < HTTP_BREAKER_COOLDOWN and not self.probing else "half-open"
+
+
+class LatencyHistogram:
+    """Гистограмма задержек одного эндпоинта по корзинам HTTP_LATENCY_BUCKETS_MS."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1)
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *, ok: bool = True) -> None:
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(HTTP_LATENCY_BUCKETS_MS) if ms <= bound), len(HTTP_LATENCY_BUCKETS_MS))
+        with self._lock:
+            self.counts[index] += 1
+            if not ok:
+                self.errors += 1
+
+    def quantile(self, q: float) -> Optional[int]:
+        """Верхняя граница корзины, в которую попадает квантиль q; None — выше последней границы."""
+        with self._lock:
+            counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return 0
+        running = 0
+        for index, count in enumerate(counts):
+            running += count
+            if running >= q * total:
+                return HTTP_LATENCY_BUCKETS_MS[index] if index < len(HTTP_LATENCY_BUCKETS_MS) else None
+        return None
+
+    def summary(self) -> str:
+        with self._lock:
+            total, errors = sum(self.counts), self.errors
+        def bound(value: Optional[int]) -> str:
+            return f"≤{value} мс" if value is not None else f"свыше {HTTP_LATENCY_BUCKETS_MS[-1]} мс"
+        return f"{total} запр., p50 {bound(self.quantile(0.5))}, p95 {bound(self.quantile(0.95))}, ошибок {errors}"
+
+
+http_latency: Dict[str, LatencyHistogram] = {}
+_http_latency_lock = threading.Lock()
+
+
+def endpoint_latency(endpoint: str) -> LatencyHistogram:
+    with _http_latency_lock:
+        histogram = http_latency.get(endpoint)
+        if histogram is None:
+            histogram = http_latency[endpoint] = LatencyHistogram()
+        return histogram
+
+
+def http_latency_text(prefix: str) -> str:
+    lines = [f"{endpoint}: {histogram.summary()}" for endpoint, histogram in sorted(http_latency.items()) if endpoint.startswith(prefix)]
+    return "\n".join(lines) if lines else "Запросов пока не было."
+
+
+class PooledHttpClient:
+    """Долгоживущая сессия с пулом keep-alive соединений, таймаутами, повторами и автоматом отключения.
+
+    Повторяются только идемпотентные вызовы: сетевые ошибки, 429 и 5xx, с
+    экспоненциальной задержкой со случайным разбросом (для 429 — не меньше Retry-After).
+    Каждая попытка, включая повторы, берет токен из rate_limiter, если он задан.
+    """
+
+    name = "http"
+    rate_limiter: Optional["RateLimiter"] = None
+
+    def __init__(self) -> None:
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker(self.name)
+
+    def _post(self, endpoint: str, url: str, payload: Dict[str, Any], *, idempotent: bool) -> requests.Response:
+        histogram = endpoint_latency(f"{self.name}:{endpoint}")
+        attempts = HTTP_RETRY_ATTEMPTS if idempotent else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            self.breaker.before_call()
+            started = time.monotonic()
+            delay = random.uniform(0, HTTP_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(url, json=payload, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+            except (requests.ConnectionError, requests.Timeout):
+                histogram.observe(time.monotonic() - started, ok=False)
+                self.breaker.record_failure()
+                if attempt >= attempts:
+                    raise
+            except Exception:
+                self.breaker.release_probe()
+                raise
+            else:
+                retryable = response.status_code == 429 or response.status_code >= 500
+                histogram.observe(time.monotonic() - started, ok=not retryable)
+                if not retryable:
+                    self.breaker.record_success()
+                    return response
+                if response.status_code == 429:
+                    # Лимит запросов — не отказ сервиса: автомат не трогаем, ждем сколько просят
+                    self.breaker.release_probe()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if retry_after is not None:
+                        if retry_after > HTTP_RETRY_AFTER_MAX:
+                            return response
+                        if self.rate_limiter is not None:
+                            # Ожидание возьмет на себя acquire() следующей попытки — вместе с остальными потоками
+                            self.rate_limiter.pause(retry_after)
+                        else:
+                            delay = max(delay, retry_after)
+                else:
+                    self.breaker.record_failure()
+                if attempt >= attempts:
+                    return response
+            time.sleep(delay)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата; None, если заголовка нет или он битый."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=UTC)
+    return max(0.0, (retry_at - now_utc()).total_seconds())
+
+
+class RateLimiter:
+    """Token bucket: acquire() блокирует, пока не накопится токен."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """После 429 с Retry-After все пользователи лимитера ждут seconds секунд."""
+        with self._lock:
+            self.tokens = min(self.tokens, -float(seconds) * self.rate)
+            self.updated = time.monotonic()
+
+
+_flyer_rate_limiters: Dict[str, RateLimiter] = {}
+_flyer_rate_limiters_lock = threading.Lock()
+
+
+def flyer_rate_limiter(api_key: str) -> RateLimiter:
+    with _flyer_rate_limiters_lock:
+        limiter = _flyer_rate_limiters.get(api_key)
+        if limiter is None:
+            limiter = _flyer_rate_limiters[api_key] = RateLimiter(FLYER_RATE_PER_SECOND)
+        return limiter
+
+
+class FlyerAPI(PooledHttpClient):
     BASE_URL = "https://api.flyerservice.io"
+    name = "flyer"
 
     def __init__(self, api_key: str) -> None:
+        super().__init__()
         self.api_key = api_key.strip()
-        self.session = requests.Session()
+        self.rate_limiter = flyer_rate_limiter(self.api_key)
 
     def enabled(self) -> bool:
         return bool(self.api_key)
@@ -1137,11 +1606,7 @@ class FlyerAPI:
         log_payload = dict(payload)
         log_payload["key"] = mask_setting_value(self.api_key)
         logger.info("Flyer get_tasks request=%s", log_payload)
-        response = self.session.post(
-            f"{self.BASE_URL}/get_tasks",
-            json=payload,
-            timeout=15,
-        )
+        response = self._post("get_tasks", f"{self.BASE_URL}/get_tasks", payload, idempotent=True)
         response.raise_for_status()
         raw_text = response.text
         logger.info("Flyer get_tasks response status=%s body=%s", response.status_code, raw_text)
@@ -1184,11 +1649,7 @@ class FlyerAPI:
         log_payload = dict(payload)
         log_payload["key"] = mask_setting_value(self.api_key)
         logger.info("Flyer check_task request=%s", log_payload)
-        response = self.session.post(
-            f"{self.BASE_URL}/check_task",
-            json=payload,
-            timeout=15,
-        )
+        response = self._post("check_task", f"{self.BASE_URL}/check_task", payload, idempotent=True)
         response.raise_for_status()
         raw_text = response.text
         logger.info("Flyer check_task response status=%s body=%s", response.status_code, raw_text)
@@ -1201,19 +1662,22 @@ class FlyerAPI:
         return str(data.get("result") or "")
 
 
-class CryptoPayClient:
+class CryptoPayClient(PooledHttpClient):
     BASE_URL = os.getenv("CRYPTOPAY_API_URL", "https://pay.crypt.bot/api")
+    name = "cryptopay"
+    # Только чтение: повтор не может создать второй чек или счет
+    IDEMPOTENT_METHODS = {"getMe", "getBalance", "getExchangeRates", "getCurrencies", "getInvoices", "getChecks", "getTransfers"}
 
     def __init__(self, token: str) -> None:
         self.token = token.strip()
         if not self.token:
             raise ValueError("Crypto Pay token is empty")
-        self.session = requests.Session()
+        super().__init__()
         self.session.headers["Crypto-Pay-API-Token"] = self.token
 
     def call(self, method: str, payload: Optional[Dict[str, Any]] = None) -> Any:
         url = f"{self.BASE_URL}/{method}"
-        response = self.session.post(url, json=payload or {}, timeout=15)
+        response = self._post(method, url, payload or {}, idempotent=method in self.IDEMPOTENT_METHODS)
         response.raise_for_status()
         data = response.json()
         if not data.get("ok"):
@@ -1265,19 +1729,46 @@ class CryptoPayClient:
         return None
 
 
+_http_clients: Dict[type, Tuple[str, PooledHttpClient]] = {}
+_http_clients_lock = threading.Lock()
+
+
+def registered_client(client_cls: type, secret: str) -> PooledHttpClient:
+    """Один долгоживущий клиент на класс; пересоздается, только когда меняется ключ/токен."""
+    with _http_clients_lock:
+        current = _http_clients.get(client_cls)
+        if current and current[0] == secret:
+            return current[1]
+        client = client_cls(secret)
+        _http_clients[client_cls] = (secret, client)
+        return client
+
+
+def close_http_clients() -> None:
+    """Закрывает сессии всех клиентов реестра (остановка тенанта в общем хосте)."""
+    with _http_clients_lock:
+        clients = [client for _, client in _http_clients.values()]
+        _http_clients.clear()
+    for client in clients:
+        try:
+            client.session.close()
+        except Exception as exc:
+            logger.warning("Не удалось закрыть HTTP-сессию %s: %s", client.name, exc)
+
+
 def get_flyer_client() -> Optional[FlyerAPI]:
-    key = db.get_setting("flyer_api_key", "")
+    key = db.get_setting("flyer_api_key", "").strip()
     if not key:
         return None
-    return FlyerAPI(key)
+    return registered_client(FlyerAPI, key)
 
 
 def get_crypto_client() -> Optional[CryptoPayClient]:
-    token = db.get_setting("crypto_pay_token", "")
+    token = db.get_setting("crypto_pay_token", "").strip()
     if not token:
         return None
     try:
-        return CryptoPayClient(token)
+        return registered_client(CryptoPayClient, token)
     except ValueError:
         return None
 
@@ -1287,54 +1778,98 @@ def currency_symbol() -> str:
     return value or "USDT"
 
 
+class RateUnavailableError(RuntimeError):
+    pass
+
+
+class ExchangeRateTable:
+    """Курсы getExchangeRates по ключу (source, target) с временем получения каждого курса.
+
+    Таблицу обновляет фоновый поток; чтение — поиск в словаре. Если API недоступен,
+    курсы остаются прежними и отдаются, пока не старше EXCHANGE_RATE_MAX_STALENESS.
+    """
+
+    def __init__(self) -> None:
+        self.rates: Dict[Tuple[str, str], Tuple[Decimal, datetime]] = {}
+        self.refreshed_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, crypto: CryptoPayClient) -> int:
+        with self._refresh_lock:
+            try:
+                items = crypto.get_exchange_rates()
+            except Exception as exc:
+                self.last_error = str(exc)
+                raise
+            fetched_at = now_utc()
+            fresh: Dict[Tuple[str, str], Tuple[Decimal, datetime]] = {}
+            for item in items or []:
+                rate = dec(item.get("rate"), "0")
+                if item.get("is_valid") and rate > 0 and item.get("source") and item.get("target"):
+                    fresh[(item["source"], item["target"])] = (rate, fetched_at)
+            with self._lock:
+                self.rates.update(fresh)
+                self.refreshed_at = fetched_at
+                self.last_error = None
+            return len(fresh)
+
+    def rate_to_usd(self, asset: str) -> Optional[Tuple[Decimal, datetime]]:
+        """Сколько USD стоит 1 единица актива: прямой курс ASSET/USD или обратный USD/ASSET."""
+        with self._lock:
+            direct = self.rates.get((asset, "USD"))
+            if direct:
+                return direct
+            inverse = self.rates.get(("USD", asset))
+        if inverse:
+            return Decimal("1.0") / inverse[0], inverse[1]
+        return None
+
+
+exchange_rates = ExchangeRateTable()
+
+
 def get_effective_asset_rate(asset: str) -> Decimal:
     """
-    Получает курс актива к USDT через Crypto Pay API.
-    Если не удается получить курс, возвращает 1.0 (как fallback).
-    
-    Args:
-        asset: Код актива (USDT, TON, BTC, и т.д.)
-    
-    Returns:
-        Decimal: Курс актива к USDT (сколько USDT стоит 1 единица актива)
+    Курс актива к USDT (сколько USDT стоит 1 единица актива) из таблицы exchange_rates.
+
+    Если курса нет или он старше EXCHANGE_RATE_MAX_STALENESS, таблица обновляется
+    синхронно. Не удалось — RateUnavailableError: подставлять 1.0 для выплат нельзя.
     """
     # Если актив сам USDT, курс = 1
     if asset == "USDT":
         return Decimal("1.0")
-    
-    crypto = get_crypto_client()
-    if not crypto:
-        logger.warning("Crypto Pay клиент не настроен, используется курс 1.0")
-        return Decimal("1.0")
-    
-    try:
-        rates = crypto.get_exchange_rates()
-        # Ищем курс актива к USD
-        for rate_item in rates:
-            if rate_item.get("source") == asset and rate_item.get("target") == "USD":
-                rate_value = rate_item.get("rate")
-                if rate_value and rate_item.get("is_valid"):
-                    rate_decimal = dec(rate_value, "1.0")
-                    logger.info(f"Получен курс {asset}/USD: {rate_decimal}")
-                    return rate_decimal
-        
-        # Если не нашли прямой курс, пробуем обратный (USD к активу)
-        for rate_item in rates:
-            if rate_item.get("source") == "USD" and rate_item.get("target") == asset:
-                rate_value = rate_item.get("rate")
-                if rate_value and rate_item.get("is_valid"):
-                    rate_decimal = dec(rate_value, "1.0")
-                    if rate_decimal > 0:
-                        inverse_rate = Decimal("1.0") / rate_decimal
-                        logger.info(f"Получен обратный курс USD/{asset}: {rate_decimal}, инвертирован в {inverse_rate}")
-                        return inverse_rate
-        
-        logger.warning(f"Курс для {asset} не найден в API, используется fallback 1.0")
-        return Decimal("1.0")
-        
-    except Exception as exc:
-        logger.error(f"Ошибка получения курса через Crypto Pay API: {exc}")
-        return Decimal("1.0")
+
+    entry = exchange_rates.rate_to_usd(asset)
+    if entry is None or now_utc() - entry[1] > EXCHANGE_RATE_MAX_STALENESS:
+        crypto = get_crypto_client()
+        if crypto:
+            try:
+                exchange_rates.refresh(crypto)
+            except Exception as exc:
+                logger.error(f"Ошибка получения курса через Crypto Pay API: {exc}")
+        entry = exchange_rates.rate_to_usd(asset)
+    if entry is None:
+        raise RateUnavailableError(f"курс {asset}/USD недоступен")
+    rate, fetched_at = entry
+    age = now_utc() - fetched_at
+    if age > EXCHANGE_RATE_MAX_STALENESS:
+        raise RateUnavailableError(f"курс {asset}/USD устарел ({format_duration(age)})")
+    return rate
+
+
+def refresh_exchange_rates_periodically() -> None:
+    """Фоновое обновление таблицы курсов раз в EXCHANGE_RATE_REFRESH_SECONDS"""
+    while not background_stop.is_set():
+        crypto = get_crypto_client()
+        if crypto:
+            try:
+                exchange_rates.refresh(crypto)
+            except Exception as exc:
+                age = format_duration(now_utc() - exchange_rates.refreshed_at) if exchange_rates.refreshed_at else "нет данных"
+                logger.warning(f"Не удалось обновить курсы Crypto Pay (последние получены: {age}): {exc}")
+        background_stop.wait(EXCHANGE_RATE_REFRESH_SECONDS)
 
 
 def get_menu_button_text(key: str) -> str:
@@ -1488,7 +2023,15 @@ def ensure_user_row(tg_user: telebot.types.User) -> sqlite3.Row:
     return row
 
 
-def get_or_refresh_tasks(user: sqlite3.Row, context: str, *, force: bool = False) -> List[Tuple[int, Dict[str, Any]]]:
+def get_or_refresh_tasks(
+    user: sqlite3.Row,
+    context: str,
+    *,
+    force: bool = False,
+    flyer_tasks: Optional[List[Dict[str, Any]]] = None,
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Задания пользователя из кэша или заново собранные. flyer_tasks — уже полученный
+    ответ Flyer get_tasks, тогда повторный запрос не делается."""
     normalized_context = "tasks"
     user_id = int(user["user_id"])
     cached = db.list_pending_tasks(user_id, normalized_context)
@@ -1507,14 +2050,15 @@ def get_or_refresh_tasks(user: sqlite3.Row, context: str, *, force: bool = False
         if not signature:
             return False
         return db.has_task_completion(user_id, signature, normalized_context)
-    flyer = get_flyer_client()
-    if flyer and flyer.enabled():
+    flyer = get_flyer_client() if flyer_tasks is None else None
+    if flyer_tasks is not None or (flyer and flyer.enabled()):
         try:
-            flyer_tasks = flyer.get_tasks(
-                user_id=user_id,
-                language_code=language_code,
-                limit=limit,
-            )
+            if flyer_tasks is None:
+                flyer_tasks = flyer.get_tasks(
+                    user_id=user_id,
+                    language_code=language_code,
+                    limit=limit,
+                )
             for entry in flyer_tasks:
                 links = entry.get("links") or []
                 url = links[0] if links else entry.get("url")
@@ -1681,89 +2225,107 @@ def build_task_details_message(
     return "\n".join(lines), markup
 
 
-def process_subscription_watchlist(user_id: Optional[int] = None) -> None:
-    """Проверка подписок каждые 10 минут для заданий от Flyer API"""
-    flyer = get_flyer_client()
-    if not flyer:
-        return
-    entries = db.get_active_subscription_watches(user_id=user_id)
-    if not entries:
-        return
-    now = now_utc()
-    for entry in entries:
-        watch_id = entry["id"]
-        try:
-            expires_at = datetime.fromisoformat(entry["expires_at"])
-            created_at = datetime.fromisoformat(entry["created_at"])
-        except ValueError:
-            expires_at = now
-            created_at = now
-        
-        # Проверяем, прошло ли 3 дня с момента создания
-        days_passed = (now - created_at).days
-        
-        # Если прошло 3 дня и статус успешный - переводим с frozen_balance на основной баланс
-        if days_passed >= 3:
-            try:
-                status = str(flyer.check_task(entry["signature"]) or "").lower()
-                # Если статус успешный (не в списке неудачных и не отписался)
-                if status not in FLYER_FAIL_STATUSES and not any(token in status for token in FLYER_PENALTY_STATUSES):
-                    reward = dec(entry["reward"], "0")
-                    if reward > 0:
-                        # Переводим с frozen_balance на основной баланс
-                        db.update_user_balance(entry["user_id"], delta_frozen_balance=-reward, delta_balance=reward)
-                        db.add_task_log(entry["user_id"], entry["signature"], entry["source"], "frozen_to_balance", reward)
-                        db.mark_watch_completed(watch_id)
-                        try:
-                            bot.send_message(
-                                entry["user_id"],
-                                f"✅ Средства за задание переведены на основной баланс ({format_amount(reward, currency_symbol())}).",
-                            )
-                        except ApiException as exc:
-                            logger.debug("Не удалось отправить уведомление о переводе: %s", exc)
-                    continue
-            except Exception as exc:
-                logger.debug("Не удалось проверить статус задания %s: %s", entry["signature"], exc)
-        
-        # Если срок истек - завершаем проверку
-        if now >= expires_at:
-            db.mark_watch_completed(watch_id)
-            continue
-        
-        # Проверяем не чаще чем раз в 10 минут
-        last_checked = entry["last_checked"]
-        if last_checked:
-            try:
-                last_dt = datetime.fromisoformat(last_checked)
-            except ValueError:
-                last_dt = now - timedelta(days=1)
-            if now - last_dt < timedelta(minutes=10):
-                continue
-        
-        # Проверяем статус задания
-        try:
-            status = str(flyer.check_task(entry["signature"]) or "").lower()
-        except Exception as exc:
-            logger.debug("Не удалось проверить подписку %s: %s", entry["signature"], exc)
-            continue
-        
-        db.update_watch_last_checked(watch_id, now)
-        
-        # Если отписался - списываем с frozen_balance (удаляем средства)
-        if any(token in status for token in FLYER_PENALTY_STATUSES):
+watch_check_executor = ThreadPoolExecutor(max_workers=WATCHLIST_CHECK_WORKERS, thread_name_prefix="watch-check")
+watchlist_last_tick: Dict[str, Any] = {}
+
+
+def check_watch_status(flyer: FlyerAPI, entry: sqlite3.Row) -> Optional[str]:
+    """Статус задания от Flyer в нижнем регистре или None, если проверить не удалось."""
+    try:
+        return str(flyer.check_task(entry["signature"]) or "").lower()
+    except Exception as exc:
+        logger.debug("Не удалось проверить подписку %s: %s", entry["signature"], exc)
+        return None
+
+
+def decide_watch_outcome(entry: sqlite3.Row, status: Optional[str], now: datetime) -> WatchOutcome:
+    try:
+        expires_at = datetime.fromisoformat(entry["expires_at"])
+    except ValueError:
+        expires_at = now
+    penalized = status is not None and any(token in status for token in FLYER_PENALTY_STATUSES)
+    if now >= expires_at:
+        # Удержание закончилось: успешный статус переводит средства на основной баланс
+        if status is None:
+            if now >= expires_at + WATCHLIST_EXPIRED_RETRY_WINDOW:
+                return WatchOutcome(entry, "expire")
+            return WatchOutcome(entry, "reschedule", next_check_at=now + WATCHLIST_RECHECK_INTERVAL)
+        if status not in FLYER_FAIL_STATUSES and not penalized:
+            return WatchOutcome(entry, "release", checked_at=now)
+        return WatchOutcome(entry, "expire", checked_at=now)
+    if penalized:
+        return WatchOutcome(entry, "penalty", checked_at=now)
+    next_check_at = min(now + WATCHLIST_RECHECK_INTERVAL, expires_at)
+    return WatchOutcome(entry, "reschedule", next_check_at=next_check_at, checked_at=now if status is not None else None)
+
+
+def notify_watch_outcome(outcome: WatchOutcome) -> None:
+    entry = outcome.watch
+    try:
+        if outcome.action == "release":
             reward = dec(entry["reward"], "0")
             if reward > 0:
-                # Списываем с frozen_balance (удаляем средства)
-                db.update_user_balance(entry["user_id"], delta_frozen_balance=-reward)
-                db.add_task_log(entry["user_id"], entry["signature"], entry["source"], "penalty", -reward)
-            db.mark_watch_completed(watch_id, penalized=True)
-            try:
                 bot.send_message(
                     entry["user_id"],
-                    "⚠️ Вы отписались. Средства за задание списаны с удержания.",
+                    f"✅ Средства за задание переведены на основной баланс ({format_amount(reward, currency_symbol())}).",
                 )
-            except ApiException as exc:
-                logger.debug("Не удалось отправить уведомление о штрафе: %s", exc)
+        elif outcome.action == "penalty":
+            bot.send_message(
+                entry["user_id"],
+                "⚠️ Вы отписались. Средства за задание списаны с удержания.",
+            )
+    except ApiException as exc:
+        logger.debug("Не удалось отправить уведомление по удержанию: %s", exc)
+
+
+def process_subscription_watchlist(user_id: Optional[int] = None) -> int:
+    """Проверяет все записи удержания, которым подошел next_check_at, страницами.
+
+    Статусы Flyer запрашиваются параллельно в пуле watch_check_executor, итоги
+    страницы применяются одной транзакцией; уведомления уходят только по итогам,
+    которые применил этот проход. Возвращает число проверенных записей.
+    """
+    flyer = get_flyer_client()
+    if not flyer:
+        return 0
+    now = now_utc()
+    after: Optional[Tuple[str, int]] = None
+    processed = 0
+    while True:
+        page = db.get_due_subscription_watches(now, user_id=user_id, after=after)
+        if not page:
+            break
+        statuses = list(watch_check_executor.map(lambda entry: check_watch_status(flyer, entry), page))
+        outcomes = [decide_watch_outcome(entry, status, now) for entry, status in zip(page, statuses)]
+        for outcome in db.apply_watch_outcomes(outcomes):
+            notify_watch_outcome(outcome)
+        processed += len(page)
+        after = (page[-1]["next_check_at"], page[-1]["id"])
+        if len(page) < WATCHLIST_PAGE_SIZE:
+            break
+    return processed
+
+
+def watchlist_backlog_text() -> str:
+    """Отставание планировщика: сколько записей ждут проверки и как давно подошла самая старая."""
+    now = now_utc()
+    due, oldest = db.subscription_watch_backlog(now)
+    lag = timedelta(0)
+    if oldest:
+        try:
+            oldest_dt = datetime.fromisoformat(oldest)
+            if oldest_dt.tzinfo is None:
+                oldest_dt = oldest_dt.replace(tzinfo=UTC)
+            lag = now - oldest_dt
+        except ValueError:
+            pass
+    text = f"⏳ Проверки удержаний: к проверке {due}, отставание {format_duration(lag) if due else 'нет'}"
+    if watchlist_last_tick:
+        text += (
+            f"\nПоследний проход: {watchlist_last_tick['processed']} записей "
+            f"за {watchlist_last_tick['duration']:.1f} с"
+        )
+    return text
 
 
 def send_main_screen(chat_id: int, user_id: Optional[int] = None) -> None:
@@ -1908,6 +2470,10 @@ def show_flyer_settings(call: types.CallbackQuery) -> None:
     for key, (label, _) in FLYER_SETTING_FIELDS.items():
         value = db.get_setting(key, DEFAULT_SETTINGS.get(key, ""))
         lines.append(f"{label}: <code>{setting_display(key, value)}</code>")
+    lines.append("")
+    lines.append(watchlist_backlog_text())
+    lines.append("")
+    lines.append(f"📶 Запросы Flyer:\n{http_latency_text('flyer:')}")
     kb = types.InlineKeyboardMarkup(row_width=1)
     for key, (label, _) in FLYER_SETTING_FIELDS.items():
         kb.add(types.InlineKeyboardButton(label, callback_data=f"admin:flyerset:{key}"))
@@ -2159,7 +2725,7 @@ def send_about_section(chat_id: int) -> None:
     add_info_button("💬 Чат", "info_chat_url", "chat")
     # Кнопка "Хочу такого же бота" - берется из константы CONSTRUCTOR_BOT_LINK, а не из настроек
     if CONSTRUCTOR_BOT_LINK:
-        markup.add(types.InlineKeyboardButton("🤖 Хочу такого же бота", url=CONSTRUCTOR_BOT_LINK))
+        markup.add(types.InlineKeyboardButton(CONSTRUCTOR_BOT_LINK_TEXT, url=CONSTRUCTOR_BOT_LINK))
     bot.send_message(chat_id, text, reply_markup=markup)
 
 
@@ -2262,7 +2828,12 @@ def process_withdraw_amount(message: types.Message, user: sqlite3.Row) -> None:
         bot.reply_to(message, "Платёжная система временно недоступна. Попробуйте позже.")
         return
     asset = db.get_setting("crypto_pay_asset", "USDT") or "USDT"
-    asset_rate = get_effective_asset_rate(asset)
+    try:
+        asset_rate = get_effective_asset_rate(asset)
+    except RateUnavailableError as exc:
+        logger.error("Вывод отложен: %s", exc)
+        bot.reply_to(message, "Курс выплаты временно недоступен. Попробуйте позже.")
+        return
     asset_amount = (amount / asset_rate).quantize(ASSET_QUANT, rounding=ROUND_HALF_UP)
     if asset_amount <= 0:
         asset_amount = ASSET_QUANT
@@ -2646,7 +3217,12 @@ def process_deposit_amount(message: types.Message, user: sqlite3.Row) -> None:
         bot.reply_to(message, "Crypto Pay не настроен.")
         return
     asset = db.get_setting("crypto_pay_asset", "USDT") or "USDT"
-    asset_rate = get_effective_asset_rate(asset)
+    try:
+        asset_rate = get_effective_asset_rate(asset)
+    except RateUnavailableError as exc:
+        logger.error("Пополнение отложено: %s", exc)
+        bot.reply_to(message, "Курс Crypto Pay временно недоступен. Попробуйте позже.")
+        return
     asset_amount = (amount / asset_rate).quantize(ASSET_QUANT, rounding=ROUND_HALF_UP)
     if asset_amount <= 0:
         asset_amount = ASSET_QUANT
@@ -2862,7 +3438,7 @@ def callback_task_check(call: types.CallbackQuery) -> None:
                 signature=signature,
                 source=source,
                 reward=payout,
-                expires_at=now_utc() + timedelta(days=3),  # Проверяем 3 дня
+                expires_at=now_utc() + WATCHLIST_HOLD_PERIOD,  # Проверяем 3 дня
             )
     else:
         # Для не-Flyer заданий - на основной баланс
@@ -3693,6 +4269,12 @@ def show_reserve_settings(call: types.CallbackQuery) -> None:
     for key, (label, _) in RESERVE_SETTING_FIELDS.items():
         value = db.get_setting(key, DEFAULT_SETTINGS.get(key, ""))
         lines.append(f"{label}: <code>{setting_display(key, value)}</code>")
+    lines.append("")
+    if exchange_rates.refreshed_at:
+        lines.append(f"💱 Курсы обновлены {format_duration(now_utc() - exchange_rates.refreshed_at)} назад")
+    if exchange_rates.last_error:
+        lines.append("⚠️ Последнее обновление курсов не удалось, используются прежние значения")
+    lines.append(f"📶 Запросы Crypto Pay:\n{http_latency_text('cryptopay:')}")
     kb = types.InlineKeyboardMarkup(row_width=1)
     for key, (label, _) in RESERVE_SETTING_FIELDS.items():
         kb.add(types.InlineKeyboardButton(label.split(" (")[0], callback_data=f"admin:reserveset:{key}"))
@@ -4088,103 +4670,135 @@ def open_admin_panel(message: types.Message) -> None:
     send_admin_menu(message.chat.id)
 
 
+flyer_discovery_executor = ThreadPoolExecutor(max_workers=FLYER_DISCOVERY_WORKERS, thread_name_prefix="flyer-discovery")
+
+
+def fetch_flyer_tasks_for(flyer: FlyerAPI, user_row: sqlite3.Row, limit: int) -> Optional[List[Dict[str, Any]]]:
+    try:
+        return flyer.get_tasks(user_id=user_row["user_id"], language_code=user_row["language_code"], limit=limit)
+    except Exception as exc:
+        logger.warning(f"Flyer get_tasks failed for user {user_row['user_id']}: {exc}")
+        return None
+
+
+def discover_new_flyer_tasks() -> int:
+    """Один шаг прохода: следующая порция активных пользователей после чекпоинта.
+
+    Задания Flyer запрашиваются в пуле flyer_discovery_executor (скорость на ключ
+    ограничивает FlyerAPI), полученный список сразу пишется в кэш заданий без
+    повторного запроса. Чекпоинт хранится в settings, поэтому проход растягивается
+    на несколько тиков и переживает перезапуск. Возвращает число проверенных пользователей.
+    """
+    flyer = get_flyer_client()
+    if not flyer or not flyer.enabled():
+        return 0
+    after_user_id = int(db.get_setting("flyer_discovery_cursor", "0") or 0)
+    users = db.list_active_users_after(after_user_id, now_utc() - FLYER_DISCOVERY_ACTIVE_WINDOW, FLYER_DISCOVERY_USERS_PER_TICK)
+    if not users:
+        # Проход завершен, следующий тик начинает новый
+        if after_user_id:
+            db.set_setting("flyer_discovery_cursor", "0")
+        return 0
+    limit = max(1, int(db.get_setting("flyer_task_limit", "5") or 5))
+    old_signatures = db.pending_task_signatures([row["user_id"] for row in users], "tasks")
+    fetched = flyer_discovery_executor.map(lambda row: fetch_flyer_tasks_for(flyer, row, limit), users)
+    for user_row, flyer_tasks in zip(users, fetched):
+        if not flyer_tasks:
+            continue
+        user_id = user_row["user_id"]
+        known = old_signatures.get(user_id, set())
+        if not any(entry.get("signature") and entry["signature"] not in known for entry in flyer_tasks):
+            continue
+        try:
+            get_or_refresh_tasks(user_row, "tasks", force=True, flyer_tasks=flyer_tasks)
+            bot.send_message(
+                user_id,
+                f"🎉 Вам доступно новое задание в разделе 'Задания'!"
+            )
+        except Exception as exc:
+            logger.warning(f"Failed to notify user {user_id} about new tasks: {exc}")
+    db.set_setting("flyer_discovery_cursor", str(users[-1]["user_id"]))
+    return len(users)
+
+
 def check_flyer_tasks_periodically():
-    """Проверка новых заданий от Flyer каждые 10 минут для каждого пользователя"""
-    while True:
+    """Фоновый поиск новых заданий Flyer: шаг прохода раз в FLYER_DISCOVERY_TICK_SECONDS"""
+    while not background_stop.wait(FLYER_DISCOVERY_TICK_SECONDS):
         try:
-            time.sleep(600)  # 10 минут
-            flyer = get_flyer_client()
-            if not flyer or not flyer.enabled():
-                continue
-            
-            # Получаем всех пользователей
-            with db._lock:
-                cur = db._conn.execute("SELECT user_id, language_code FROM users")
-                users = cur.fetchall()
-            
-            for user_row in users:
-                try:
-                    user_id = user_row["user_id"]
-                    language_code = user_row.get("language_code")
-                    
-                    # Получаем текущие задания пользователя
-                    user = db.get_user(user_id)
-                    if not user:
-                        continue
-                    
-                    old_tasks = db.load_tasks(user_id, "tasks")
-                    old_signatures = {task.get("signature") for task in old_tasks if task.get("signature")}
-                    
-                    # Получаем новые задания от Flyer
-                    limit = max(1, int(db.get_setting("flyer_task_limit", "5") or 5))
-                    try:
-                        flyer_tasks = flyer.get_tasks(
-                            user_id=user_id,
-                            language_code=language_code,
-                            limit=limit,
-                        )
-                    except Exception as exc:
-                        logger.warning(f"Flyer get_tasks failed for user {user_id}: {exc}")
-                        continue
-                    
-                    # Проверяем, есть ли новые задания
-                    new_tasks = []
-                    for entry in flyer_tasks:
-                        signature = entry.get("signature")
-                        if signature and signature not in old_signatures:
-                            new_tasks.append(entry)
-                    
-                    # Если есть новые задания, отправляем уведомление
-                    if new_tasks:
-                        try:
-                            bot.send_message(
-                                user_id,
-                                f"🎉 Вам доступно новое задание в разделе 'Задания'!"
-                            )
-                            # Обновляем кэш заданий
-                            get_or_refresh_tasks(user, "tasks", force=True)
-                        except Exception as exc:
-                            logger.warning(f"Failed to notify user {user_id} about new tasks: {exc}")
-                
-                except Exception as exc:
-                    logger.warning(f"Error checking Flyer tasks for user {user_row.get('user_id')}: {exc}")
-                    continue
-        
+            discover_new_flyer_tasks()
         except Exception as exc:
             logger.error(f"Error in check_flyer_tasks_periodically: {exc}", exc_info=True)
-            time.sleep(60)  # При ошибке ждем минуту перед повтором
+            background_stop.wait(60)  # При ошибке ждем минуту перед повтором
 
 
-if __name__ == "__main__":
+def check_subscriptions_periodically():
+    """Проход планировщика удержаний раз в WATCHLIST_TICK_SECONDS"""
+    while not background_stop.wait(WATCHLIST_TICK_SECONDS):
+        try:
+            started = time.monotonic()
+            processed = process_subscription_watchlist()
+            watchlist_last_tick.update(processed=processed, duration=time.monotonic() - started, at=now_utc())
+            if processed:
+                logger.info("Проверки удержаний: %s записей. %s", processed, watchlist_backlog_text().splitlines()[0])
+        except Exception as exc:
+            logger.error(f"Ошибка в проверке подписок: {exc}", exc_info=True)
+            background_stop.wait(60)  # При ошибке ждем минуту перед повтором
+
+
+def start_background() -> None:
+    """Фоновые потоки бота. Хост тенантов зовет это отдельно от приема обновлений,
+    поэтому в режиме вебхуков (pull) планировщики работают так же, как при polling."""
+    background_stop.clear()
+    # Запускаем фоновую проверку Flyer заданий
+    threading.Thread(target=check_flyer_tasks_periodically, name="cashlait-flyer", daemon=True).start()
+    logger.info(
+        "Фоновый поиск Flyer заданий запущен (%s польз. за тик раз в %s сек.)",
+        FLYER_DISCOVERY_USERS_PER_TICK,
+        FLYER_DISCOVERY_TICK_SECONDS,
+    )
+    # Запускаем планировщик проверок подписок: каждый проход забирает все записи, которым пора
+    threading.Thread(target=check_subscriptions_periodically, name="cashlait-watchlist", daemon=True).start()
+    logger.info("Планировщик проверок подписок запущен (проход каждые %s сек.)", WATCHLIST_TICK_SECONDS)
+    threading.Thread(target=refresh_exchange_rates_periodically, name="cashlait-rates", daemon=True).start()
+    logger.info("Фоновое обновление курсов Crypto Pay запущено (каждые %s сек.)", EXCHANGE_RATE_REFRESH_SECONDS)
+
+
+def stop_background() -> None:
+    """Останавливает фоновые потоки после текущего прохода (хост зовет при остановке тенанта).
+
+    Модуль остановленного тенанта остается в памяти хоста, поэтому пулы потоков
+    и HTTP-сессии освобождаются здесь, а не при выходе процесса.
+    """
+    background_stop.set()
+    watch_check_executor.shutdown(wait=False, cancel_futures=True)
+    flyer_discovery_executor.shutdown(wait=False, cancel_futures=True)
+    close_http_clients()
+
+
+def run_polling() -> None:
+    logger.info("Начинаю polling...")
+    bot.infinity_polling(none_stop=True, interval=0, timeout=20)
+
+
+def main() -> None:
     try:
         logger.info("CashLait bot запущен.")
         logger.info(f"Токен бота: {BOT_TOKEN[:10]}... (первые 10 символов)")
         logger.info(f"Имя бота: {BOT_USERNAME}")
-        
-        # Запускаем фоновую проверку Flyer заданий
-        flyer_check_thread = threading.Thread(target=check_flyer_tasks_periodically, daemon=True)
-        flyer_check_thread.start()
-        logger.info("Фоновая проверка Flyer заданий запущена (каждые 10 минут)")
-        
-        # Запускаем фоновую проверку подписок каждые 10 минут
-        def check_subscriptions_periodically():
-            """Проверка подписок каждые 10 минут"""
-            while True:
-                try:
-                    time.sleep(600)  # 10 минут
-                    process_subscription_watchlist()
-                except Exception as exc:
-                    logger.error(f"Ошибка в проверке подписок: {exc}", exc_info=True)
-                    time.sleep(60)  # При ошибке ждем минуту перед повтором
-        
-        subscription_check_thread = threading.Thread(target=check_subscriptions_periodically, daemon=True)
-        subscription_check_thread.start()
-        logger.info("Фоновая проверка подписок запущена (каждые 10 минут)")
-        
-        logger.info("Начинаю polling...")
-        bot.infinity_polling(none_stop=True, interval=0, timeout=20)
+        start_background()
+        # Под хостом снимок конфигурации отслеживает сам хост, здесь — только для отдельного процесса
+        if BOT_CONFIG_PATH:
+            threading.Thread(target=watch_config_snapshot, daemon=True).start()
+            logger.info("Слежение за конфигурацией конструктора: %s", BOT_CONFIG_PATH)
+        run_polling()
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем.")
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+    finally:
+        stop_background()
+
+
+if __name__ == "__main__":
+    main()
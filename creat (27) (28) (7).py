@@ -16,10 +16,24 @@ import psutil
 import sys
 import threading
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from aiocryptopay import AioCryptoPay, Networks
 import asyncio
 import re
+import io
+import queue
+import select
+import concurrent.futures
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+from types import SimpleNamespace
+from collections import deque
+import ssl
+import certifi
+import hashlib
+import hmac
+import secrets
+import glob
+import gzip
 try:
     from flyerapi import Flyer, APIError as FlyerAPIError
     FLYER_IMPORTED_FOR_CHECKER = True
@@ -46,6 +60,28 @@ ANONCHAT_BOT_SCRIPT_NAME = 'anonchatik.py'
 CASHLAIT_BOT_SCRIPT_NAME = 'cashlait_bot.py'
 DICELITE_BOT_SCRIPT_NAME = 'dicelite_bot.py'
 EXCHANGE_BOT_SCRIPT_NAME = 'exchange_bot.py'
+BOT_HOST_SCRIPT_NAME = 'bot_host.py'
+# Снимки конфигурации дочерних ботов для применения настроек без перезапуска
+BOT_CONFIG_DIR = 'configs'
+# Типы ботов, которые следят за снимком и применяют его на лету
+HOT_CONFIG_BOT_TYPES = {'cashlait', 'exchange'}
+# Сколько ждать подтверждения (<снимок>.ack с версией) от бота, прежде чем перезапустить его
+BOT_CONFIG_ACK_TIMEOUT_SECONDS = 10
+# Режим хостов: боты этих типов запускаются тенантами внутри общих процессов bot_host.py
+# вместо отдельного интерпретатора на каждого бота
+BOT_HOST_MODE_ENABLED = os.getenv('BOT_HOST_MODE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+BOT_HOST_POOL_SIZE = int(os.getenv('BOT_HOST_POOL_SIZE', '4'))
+BOT_HOST_MAX_TENANTS = int(os.getenv('BOT_HOST_MAX_TENANTS', '50'))
+# Модули остановленных тенантов остаются в памяти хоста: после стольких запусков
+# хост больше не принимает ботов и перезапускается, когда опустеет
+BOT_HOST_MAX_TENANT_STARTS = int(os.getenv('BOT_HOST_MAX_TENANT_STARTS', '200'))
+HOSTABLE_BOT_TYPES = ('cashlait', 'dicelite', 'exchange', 'anonchat')
+# Зигота: отдельные процессы ботов форкаются из прогретого bot_zygote.py вместо
+# холодного `python script.py <id>`
+BOT_ZYGOTE_ENABLED = os.getenv('BOT_ZYGOTE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+BOT_ZYGOTE_SCRIPT_NAME = 'bot_zygote.py'
+# Не чаще этого супервизор спрашивает у зиготы коды выхода ее детей
+BOT_ZYGOTE_REAP_INTERVAL = 1.0
 CLICKER_UNLOCK_CODE = '62927'
 ANONCHAT_UNLOCK_CODE = '67576'
 CASHLAIT_UNLOCK_CODE = '480034'
@@ -194,6 +230,126 @@ CUSTOMIZATION_RESET_COMMANDS = {'сброс', 'reset', 'default', 'станда
 DB_NAME = 'creator_data2.db'
 MIN_CREATOR_WITHDRAWAL = 50.0
 TTL_STATES_SECONDS = 1800
+BOT_USER_COUNTS_REFRESH_INTERVAL = 60
+# Публичный каталог '📋 Списки ботов': размер страницы и настройки, от которых зависит порядок
+BOT_CATALOGUE_PAGE_SIZE = 25
+BOT_CATALOGUE_SETTING_KEYS = ('bots_list_pinned', 'bots_list_manual', 'bots_list_hidden', 'bots_list_min_users')
+BOT_CATALOGUE_RANK_SPAN = 10 ** 12
+BOT_CATALOGUE_REFRESH_CHUNK = 500
+# Массовый запуск/перезапуск: параллелизм, пороги нагрузки и проверка готовности
+MASS_JOB_WORKERS = 8
+MASS_JOB_MAX_CPU_PERCENT = 85.0
+MASS_JOB_MAX_RAM_PERCENT = 90.0
+MASS_JOB_ADMISSION_TIMEOUT_SECONDS = 120
+MASS_JOB_READY_GRACE_SECONDS = 5
+MASS_JOB_READY_TIMEOUT_SECONDS = 30
+MASS_JOB_PROGRESS_INTERVAL_SECONDS = 5
+# Рассылка по дочерним ботам: ботов параллельно, лимит Telegram на один токен, размер пачки
+BOTS_BROADCAST_WORKERS = 4
+BOTS_BROADCAST_RATE_PER_SECOND = 25
+BOTS_BROADCAST_CHUNK_SIZE = 500
+# Курсор бота сохраняется после каждых стольких получателей: после падения повторно
+# уйдет не больше этого числа сообщений на бота
+BOTS_BROADCAST_CHECKPOINT_EVERY = 20
+BOTS_BROADCAST_MAX_ATTEMPTS = 3
+# Рассылка по пользователям конструктора: потоков отправки, общий лимит в секунду, размер пачки
+BROADCAST_WORKERS = 8
+BROADCAST_RATE_PER_SECOND = 25
+BROADCAST_CHUNK_SIZE = 100
+BROADCAST_DELIVERIES_RETENTION_SECONDS = 30 * 24 * 3600
+# Супервизор дочерних процессов: перезапуск упавших ботов с экспоненциальной задержкой
+SUPERVISOR_RESTART_BASE_DELAY = 5
+SUPERVISOR_RESTART_MAX_DELAY = 300
+# Столько падений за окно — бот считается в цикле падений и больше не перезапускается сам
+SUPERVISOR_CRASH_LOOP_LIMIT = 5
+SUPERVISOR_CRASH_LOOP_WINDOW_SECONDS = 600
+# Бот, проработавший дольше, считается стабильным — счетчик падений обнуляется
+SUPERVISOR_STABLE_UPTIME_SECONDS = 600
+# Страховочная проверка без SIGCHLD (тенанты в хостах, процессы от прошлого запуска)
+SUPERVISOR_FALLBACK_INTERVAL_SECONDS = 30
+SUPERVISOR_LOG_TAIL_LINES = 20
+# Сколько помнить pid вручную остановленного процесса: выход, который до супервизора
+# так и не дошел (процесса уже не было, его забрала зигота), не копится вечно
+SUPERVISOR_EXPECTED_EXIT_TTL_SECONDS = 600
+# Телеметрия ресурсов: один проход по процессам раз в минуту
+RESOURCE_SAMPLE_INTERVAL_SECONDS = 60
+# Кольцевые буферы: разрешение -> (шаг в секундах, число ячеек)
+RESOURCE_RETENTION = {
+    '1m': (60, 1440),   # сутки поминутно
+    '1h': (3600, 168),  # неделя почасово
+    '1d': (86400, 90),  # три месяца посуточно
+}
+# Оповещение об утечке: RSS стабильно растет быстрее этого темпа в течение нескольких часов
+RESOURCE_LEAK_ALERT_MB_PER_HOUR = 50
+RESOURCE_LEAK_WINDOW_HOURS = 3
+RESOURCE_LEAK_ALERT_COOLDOWN_SECONDS = 86400
+# Сверка счетов Crypto Pay: окно по invoice_id, срок жизни неоплаченного счета
+CRYPTO_RECONCILE_INTERVAL_SECONDS = 120
+# При работающем вебхуке опрос нужен только как страховка
+CRYPTO_RECONCILE_FALLBACK_INTERVAL_SECONDS = 900
+CRYPTO_RECONCILE_PAGE_SIZE = 100
+CRYPTO_INVOICE_EXPIRE_SECONDS = 3 * 86400
+# Локальный приемник вебхука invoice_paid (включается, если задан порт)
+CRYPTO_PAY_WEBHOOK_HOST = os.getenv('CRYPTO_PAY_WEBHOOK_HOST', '127.0.0.1')
+CRYPTO_PAY_WEBHOOK_PORT = int(os.getenv('CRYPTO_PAY_WEBHOOK_PORT', '0') or 0)
+CRYPTO_PAY_WEBHOOK_PATH = os.getenv('CRYPTO_PAY_WEBHOOK_PATH', '/crypto-pay/webhook')
+# Вызовы Crypto Pay: таймаут одного вызова (включая ожидание в очереди), одновременных
+# запросов, ожидающих в очереди, соединений в пуле и окно для статистики задержек
+CRYPTO_PAY_CALL_TIMEOUT_SECONDS = 15
+CRYPTO_PAY_CONCURRENCY = 8
+CRYPTO_PAY_QUEUE_SIZE = 200
+CRYPTO_PAY_POOL_SIZE = 16
+CRYPTO_PAY_KEEPALIVE_SECONDS = 60
+CRYPTO_PAY_LATENCY_WINDOW = 500
+# Логи: активный файл ротируется по размеру и возрасту, старые сегменты жмутся в gzip
+# блоками по LOG_INDEX_BLOCK_BYTES с индексом смещений рядом (.idx)
+LOG_DIR = 'logs'
+LOG_ARCHIVE_DIR = os.path.join(LOG_DIR, 'archive')
+LOG_ROTATE_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_MAX_AGE_SECONDS = 86400
+LOG_ROTATE_CHECK_INTERVAL_SECONDS = 60
+LOG_INDEX_BLOCK_BYTES = 64 * 1024
+LOG_RETENTION_SEGMENTS = 10
+LOG_RETENTION_SECONDS = 14 * 86400
+LOG_TAIL_DEFAULT_BYTES = 16 * 1024
+LOG_EXPORT_MAX_BYTES = 2 * 1024 * 1024
+# Отладочные логи конструктора в корне, которые тоже ротируются
+ROOT_LOG_FILES = ('start_debug.log', 'callback_debug.log')
+# Единый вход вебхуков Telegram: конструктор и тенанты хостов получают обновления
+# через один локальный HTTP-сервер вместо собственного long-poll на каждого бота
+WEBHOOK_MODE_ENABLED = os.getenv('WEBHOOK_MODE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+WEBHOOK_LISTEN_HOST = os.getenv('WEBHOOK_LISTEN_HOST', '127.0.0.1')
+WEBHOOK_LISTEN_PORT = int(os.getenv('WEBHOOK_LISTEN_PORT', '8081') or 8081)
+# Внешний https-адрес, который проксируется на WEBHOOK_LISTEN_*. Без него вебхук не
+# включается и все остаются на polling — если только явно не задан WEBHOOK_OFFLINE
+WEBHOOK_PUBLIC_URL = os.getenv('WEBHOOK_PUBLIC_URL', '').rstrip('/')
+# Офлайн-режим: вход слушает только локально, setWebhook не вызывается, обновления
+# подаются прогоном записанного файла через webhook_replay.py
+WEBHOOK_OFFLINE = os.getenv('WEBHOOK_OFFLINE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+WEBHOOK_PATH_PREFIX = '/tg'
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_PULL_TIMEOUT_SECONDS = 10
+WEBHOOK_PULL_BATCH_SIZE = 100
+# Файл JSONL для записи принятых обновлений (для офлайн-прогона через webhook_replay.py)
+WEBHOOK_RECORD_PATH = os.getenv('WEBHOOK_RECORD_PATH', '')
+# Проверка холда Flyer: общий пул клиентов, лимиты на один ключ и отложенный повтор ошибок
+HOLD_CHECK_INTERVAL_SECONDS = 300
+FLYER_CHECK_CONCURRENCY_PER_KEY = 5
+FLYER_CHECK_RATE_PER_SECOND = 10
+FLYER_CLIENT_IDLE_SECONDS = 3600
+FLYER_CHECK_ERROR_BASE_DELAY = 300
+FLYER_CHECK_ERROR_MAX_DELAY = 6 * 3600
+# SQLite: запросы дольше порога попадают в лог, кэш подготовленных выражений на соединение
+DB_SLOW_QUERY_MS = 200
+DB_STATEMENT_CACHE_SIZE = 256
+DB_BUSY_TIMEOUT_SECONDS = 30
+# Кэш таблицы settings: как часто сверять PRAGMA data_version на внешние записи
+SETTINGS_CACHE_RECHECK_SECONDS = 1.0
+# Строки bots в памяти: записи конструктора сбрасывают строку сразу, TTL — страховка от правок в обход
+BOT_INFO_CACHE_TTL_SECONDS = 60
+# Дневные сводки stats_daily: как часто пересчитывать текущий день и за сколько дней показывать админу
+STATS_ROLLUP_INTERVAL_SECONDS = 600
+STATS_ADMIN_DAYS = 7
 # =================================================================================
 
 # =================================================================================
@@ -209,12 +365,114 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 if not os.path.exists('logs'): os.makedirs('logs')
 if not os.path.exists('dbs'): os.makedirs('dbs')
 
-db_lock = threading.Lock()
-conn = sqlite3.connect(DB_NAME, check_same_thread=False)
-conn.row_factory = sqlite3.Row
+class OwnedRLock:
+    """RLock, который знает, удерживает ли его текущий поток."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+    def acquire(self, blocking=True, timeout=-1):
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.local.depth = getattr(self.local, 'depth', 0) + 1
+        return acquired
+
+    def release(self):
+        self.local.depth -= 1
+        self.lock.release()
+
+    def held(self):
+        return getattr(self.local, 'depth', 0) > 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SQLiteStorage:
+    """Доступ к БД конструктора: WAL, свое соединение на чтение у каждого потока
+    и одно общее соединение на запись под write_lock.
+
+    Читатели в WAL не ждут писателя, поэтому долгий список в админке не держит
+    обработку платежей. Поток, который держит write_lock, читает через писателя:
+    читатели не видят его незакоммиченных записей, а код внутри `with db_lock:`
+    рассчитывает прочитать то, что только что записал. Подготовленные выражения
+    переиспользуются встроенным кэшем sqlite3 (cached_statements) — запросы
+    пишутся с параметрами, а не подстановкой значений в текст.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = OwnedRLock()
+        self.writer = self._connect()
+
+    def enable_wal(self):
+        """Переводит БД в WAL. Зовется из init_db после check_schema_version, чтобы
+        не менять файл БД, которую этот код открывать не должен."""
+        with self.write_lock:
+            self.writer.execute("PRAGMA journal_mode=WAL")
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+
+    def _connect(self, read_only=False):
+        connection = sqlite3.connect(
+            self.path, check_same_thread=False,
+            timeout=DB_BUSY_TIMEOUT_SECONDS, cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        connection.row_factory = sqlite3.Row
+        if read_only:
+            connection.execute("PRAGMA query_only=1")
+        return connection
+
+    def reader(self):
+        connection = getattr(self.local, 'reader', None)
+        if connection is None:
+            connection = self._connect(read_only=True)
+            self.local.reader = connection
+        return connection
+
+    @staticmethod
+    def is_read_query(query):
+        return query.lstrip()[:6].upper().startswith(('SELECT', 'WITH'))
+
+    def execute(self, query, params=(), commit=False, fetchone=False, fetchall=False):
+        started = time.perf_counter()
+        if not commit and self.is_read_query(query) and not self.write_lock.held():
+            cursor = self.reader().execute(query, params)
+            result = cursor.fetchone() if fetchone else cursor.fetchall() if fetchall else cursor
+            self.log_if_slow(query, started)
+            return result
+        with self.write_lock:
+            locked = time.perf_counter()
+            cursor = self.writer.cursor()
+            cursor.execute(query, params)
+            if commit:
+                self.writer.commit()
+                result = cursor.lastrowid
+            else:
+                result = cursor.fetchone() if fetchone else cursor.fetchall() if fetchall else cursor
+        self.log_if_slow(query, started, locked)
+        return result
+
+    def log_if_slow(self, query, started, locked=None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < DB_SLOW_QUERY_MS:
+            return
+        wait_note = f", из них ожидание записи {(locked - started) * 1000:.0f} мс" if locked else ""
+        logging.warning(f"[DB] Медленный запрос {elapsed_ms:.0f} мс{wait_note}: {' '.join(query.split())[:300]}")
+
+
+storage = SQLiteStorage(DB_NAME)
+# Соединение и блокировка писателя — для мест, где несколько записей идут одной транзакцией
+conn = storage.writer
+db_lock = storage.write_lock
+bot_config_lock = threading.Lock()
 bot = telebot.TeleBot(CREATOR_BOT_TOKEN)
 user_states = {}
-bots_broadcast_running = False
 
 async_loop = asyncio.new_event_loop()
 
@@ -228,6 +486,144 @@ def run_async_task(coro):
     future = asyncio.run_coroutine_threadsafe(coro, async_loop)
     return future.result()
 
+class CryptoPayUnavailable(Exception):
+    """Crypto Pay не ответил за таймаут или очередь запросов к нему переполнена."""
+
+class CryptoPayService:
+    """Вызовы Crypto Pay на собственном event loop, отдельно от async_loop с фоновыми задачами.
+
+    Клиент AioCryptoPay один на текущий токен и держит пул соединений aiohttp; сессия
+    привязана к loop сервиса, поэтому клиент создается и закрывается только на нем.
+    submit() возвращает concurrent.futures.Future: хендлеры ждут его с таймаутом,
+    корутины других loop — через call_async. Одновременно выполняется не больше
+    CRYPTO_PAY_CONCURRENCY запросов, ожидающих — не больше CRYPTO_PAY_QUEUE_SIZE.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.client = None
+        self.token = None
+        self.semaphore = asyncio.Semaphore(CRYPTO_PAY_CONCURRENCY)
+        self.pending = 0
+        self.inflight = 0
+        self.counters = {'ok': 0, 'error': 0, 'timeout': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=CRYPTO_PAY_LATENCY_WINDOW)
+        self.queue_waits = deque(maxlen=CRYPTO_PAY_LATENCY_WINDOW)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=run_async_loop, args=(self.loop,), name="crypto-pay-loop", daemon=True)
+                self.thread.start()
+
+    async def _open_client(self, token):
+        client = AioCryptoPay(token=token, network=Networks.MAIN_NET)
+        # BaseClient переиспользует готовую _session — подкладываем свою с лимитом пула и keep-alive
+        connector = TCPConnector(
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+            limit=CRYPTO_PAY_POOL_SIZE,
+            keepalive_timeout=CRYPTO_PAY_KEEPALIVE_SECONDS,
+        )
+        client._session = ClientSession(connector=connector, timeout=ClientTimeout(total=CRYPTO_PAY_CALL_TIMEOUT_SECONDS))
+        return client
+
+    def get_client(self, token):
+        """Клиент для token; при смене токена старый клиент закрывается."""
+        self.start()
+        with self.lock:
+            if self.client is not None and self.token == token:
+                return self.client
+            previous = self.client
+            try:
+                self.client = asyncio.run_coroutine_threadsafe(self._open_client(token), self.loop).result(CRYPTO_PAY_CALL_TIMEOUT_SECONDS)
+                self.token = token
+            except Exception as e:
+                logging.error(f"Ошибка инициализации Crypto Pay: {e}")
+                self.client, self.token = None, None
+            if previous is not None:
+                asyncio.run_coroutine_threadsafe(previous.close(), self.loop)
+            return self.client
+
+    async def _call(self, client, method, args, kwargs, queued_at):
+        async with self.semaphore:
+            started = time.monotonic()
+            self.queue_waits.append(started - queued_at)
+            self.inflight += 1
+            try:
+                return await getattr(client, method)(*args, **kwargs)
+            finally:
+                self.inflight -= 1
+                self.latencies.append(time.monotonic() - started)
+
+    async def _run(self, client, method, args, kwargs, timeout, queued_at):
+        outcome = 'error'
+        try:
+            result = await asyncio.wait_for(self._call(client, method, args, kwargs, queued_at), timeout)
+            outcome = 'ok'
+            return result
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            logging.warning(f"Crypto Pay {method}: нет ответа за {timeout} сек.")
+            raise CryptoPayUnavailable("Crypto Pay сейчас не отвечает. Попробуйте чуть позже.") from None
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.counters[outcome] += 1
+
+    def submit(self, method, *args, timeout=None, **kwargs):
+        """Ставит вызов client.method(*args, **kwargs) в очередь и возвращает Future."""
+        client = get_crypto_client()
+        if client is None:
+            raise CryptoPayUnavailable("Crypto Pay недоступен сейчас.")
+        with self.lock:
+            if self.pending >= CRYPTO_PAY_QUEUE_SIZE:
+                self.counters['rejected'] += 1
+                raise CryptoPayUnavailable("Слишком много запросов к Crypto Pay. Попробуйте через минуту.")
+            self.pending += 1
+        coro = self._run(client, method, args, kwargs, timeout or CRYPTO_PAY_CALL_TIMEOUT_SECONDS, time.monotonic())
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, method, *args, timeout=None, **kwargs):
+        """Синхронный вызов из потока хендлера, не дольше timeout."""
+        timeout = timeout or CRYPTO_PAY_CALL_TIMEOUT_SECONDS
+        future = self.submit(method, *args, timeout=timeout, **kwargs)
+        try:
+            # Таймаут соблюдает сам loop; здесь запас на случай, если loop завис
+            return future.result(timeout + 5)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise CryptoPayUnavailable("Crypto Pay сейчас не отвечает. Попробуйте чуть позже.") from None
+
+    async def call_async(self, method, *args, timeout=None, **kwargs):
+        """Вызов из корутины другого event loop (сверка платежей на async_loop)."""
+        return await asyncio.wrap_future(self.submit(method, *args, timeout=timeout, **kwargs))
+
+    def stats(self):
+        def percentile(values, q):
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+        with self.lock:
+            counters = dict(self.counters)
+            pending = self.pending
+        latencies = list(self.latencies)
+        queue_waits = list(self.queue_waits)
+        return {
+            'pending': pending,
+            'inflight': self.inflight,
+            'queued': max(0, pending - self.inflight),
+            **counters,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'queue_wait_p95': percentile(queue_waits, 0.95),
+        }
+
+crypto_pay_service = CryptoPayService()
+
+def crypto_pay_call(method, *args, timeout=None, **kwargs):
+    return crypto_pay_service.call(method, *args, timeout=timeout, **kwargs)
+
 def row_to_dict(record):
     if record is None:
         return None
@@ -243,10 +639,7 @@ def is_admin(user_id: int) -> bool:
     except Exception:
         return user_id == ADMIN_ID
 
-if "YOUR_CRYPTO_PAY_API_TOKEN" not in CRYPTO_PAY_TOKEN:
-    crypto_pay = AioCryptoPay(token=CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
-else:
-    crypto_pay = None
+if "YOUR_CRYPTO_PAY_API_TOKEN" in CRYPTO_PAY_TOKEN:
     logging.warning("ВНИМАНИЕ: Не указан токен для Crypto Pay. Оплата VIP будет недоступна.")
 
 # --- Helpers for Crypto Pay safe usage ---
@@ -268,10 +661,11 @@ def is_crypto_token_configured() -> bool:
     return True
 
 def get_crypto_client():
-    """Lazily initialize and return Crypto Pay client based on the current token.
+    """Return the Crypto Pay client for the current token (recreated when the token changes).
     Returns None if token is not configured or initialization failed.
+    Network calls go through crypto_pay_call / crypto_pay_service, not by awaiting the client.
     """
-    global crypto_pay, CRYPTO_PAY_TOKEN
+    global CRYPTO_PAY_TOKEN
     if not is_crypto_token_configured():
         return None
     # Ensure CRYPTO_PAY_TOKEN reflects the latest saved setting
@@ -281,14 +675,7 @@ def get_crypto_client():
             CRYPTO_PAY_TOKEN = saved
     except Exception:
         pass
-    if crypto_pay is None:
-        try:
-            crypto_pay = AioCryptoPay(token=CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
-        except Exception as e:
-            logging.error(f"Ошибка инициализации Crypto Pay (lazy): {e}")
-            crypto_pay = None
-            return None
-    return crypto_pay
+    return crypto_pay_service.get_client(CRYPTO_PAY_TOKEN)
 
 # =================================================================================
 # --------------------------- РАБОТА С БАЗОЙ ДАННЫХ -------------------------------
@@ -297,6 +684,8 @@ def get_crypto_client():
 def init_db():
     with db_lock:
         cursor = conn.cursor()
+        check_schema_version(cursor)
+        storage.enable_wal()
         
         cursor.execute('''CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY, username TEXT, balance REAL DEFAULT 0.0,
@@ -374,6 +763,102 @@ def init_db():
             amount REAL NOT NULL,
             status TEXT DEFAULT 'pending' 
         )''')
+        crypto_payment_columns = [desc[1] for desc in cursor.execute("PRAGMA table_info(crypto_payments)").fetchall()]
+        if 'created_at' not in crypto_payment_columns:
+            cursor.execute("ALTER TABLE crypto_payments ADD COLUMN created_at INTEGER")
+            logging.info("Колонка 'created_at' добавлена в таблицу 'crypto_payments'.")
+        # Примененные оплаты: ключ идемпотентности не дает выдать покупку дважды
+        cursor.execute('''CREATE TABLE IF NOT EXISTS crypto_payment_applications (
+            idempotency_key TEXT PRIMARY KEY,
+            invoice_id INTEGER NOT NULL,
+            kind TEXT,
+            result_bot_id INTEGER,
+            applied_at INTEGER
+        )''')
+        
+        # Массовые задания запуска/перезапуска ботов (переживают рестарт конструктора)
+        cursor.execute('''CREATE TABLE IF NOT EXISTS mass_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            admin_id INTEGER NOT NULL,
+            filter_count INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            ok_count INTEGER DEFAULT 0,
+            fail_count INTEGER DEFAULT 0,
+            progress_message_id INTEGER,
+            created_at INTEGER,
+            updated_at INTEGER
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS mass_job_items (
+            job_id INTEGER NOT NULL,
+            bot_id INTEGER NOT NULL,
+            state TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (job_id, bot_id)
+        )''')
+
+        # Рассылки по дочерним ботам с курсором по каждому боту
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bots_broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'running',
+            payload TEXT NOT NULL,
+            reply_markup TEXT,
+            progress_message_id INTEGER,
+            created_at INTEGER,
+            updated_at INTEGER
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bots_broadcast_progress (
+            job_id INTEGER NOT NULL,
+            bot_id INTEGER NOT NULL,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            done BOOLEAN DEFAULT FALSE,
+            error TEXT,
+            PRIMARY KEY (job_id, bot_id)
+        )''')
+
+        # История завершений дочерних процессов
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_process_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            pid INTEGER,
+            exit_code INTEGER,
+            uptime_seconds INTEGER,
+            log_tail TEXT,
+            details TEXT,
+            created_at INTEGER
+        )''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_process_events_bot ON bot_process_events (bot_id, created_at)")
+
+        # Телеметрия ресурсов: bot_id 0 — сам конструктор, отрицательный — хост ботов (-host_id)
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_resource_samples (
+            resolution TEXT NOT NULL,
+            bot_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            samples INTEGER DEFAULT 1,
+            pid INTEGER,
+            rss_mb REAL,
+            cpu_percent REAL,
+            open_fds INTEGER,
+            threads INTEGER,
+            db_size_bytes INTEGER,
+            PRIMARY KEY (resolution, bot_id, slot)
+        )''')
+
+        # Кэш числа пользователей дочерних ботов, обновляется воркером по mtime файлов БД
+        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_user_counts (
+            bot_id INTEGER PRIMARY KEY,
+            user_count INTEGER NOT NULL DEFAULT 0,
+            db_mtime REAL,
+            updated_at INTEGER
+        )''')
         
         cursor.execute('''CREATE TABLE IF NOT EXISTS pending_flyer_rewards (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -399,6 +884,10 @@ def init_db():
                 logging.info("Таблица 'pending_flyer_rewards' была пересоздана с правильной структурой.")
         except sqlite3.OperationalError:
              pass
+        flyer_rewards_columns = [desc[1] for desc in cursor.execute("PRAGMA table_info(pending_flyer_rewards)").fetchall()]
+        if 'error_count' not in flyer_rewards_columns:
+            cursor.execute("ALTER TABLE pending_flyer_rewards ADD COLUMN error_count INTEGER DEFAULT 0")
+            logging.info("Колонка 'error_count' добавлена в таблицу 'pending_flyer_rewards'.")
 
         bot_columns = [desc[1] for desc in cursor.execute("PRAGMA table_info(bots)").fetchall()]
         new_columns = {
@@ -551,22 +1040,154 @@ def init_db():
             cursor.execute("UPDATE users SET exchange_unlocked = 1 WHERE exchange_unlocked IS NULL OR exchange_unlocked = 0")
 
         conn.commit()
+        apply_schema_migrations(cursor)
+        settings_cache.invalidate()
         logging.info("База данных успешно инициализирована/обновлена.")
 
-def db_execute(query, params=(), commit=False, fetchone=False, fetchall=False):
-    with db_lock:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        if commit:
+# -------------------- МИГРАЦИИ СХЕМЫ --------------------
+# init_db создает таблицы и колонки идемпотентно, а все, что должно примениться
+# ровно один раз и по порядку, оформляется шагом миграции. Номер примененного шага
+# хранится в schema_version; новый шаг дописывается в конец SCHEMA_MIGRATIONS.
+
+# Таблицы фоновых заданий со статусом running/done/failed, которые продолжаются после перезапуска
+JOB_TABLES = ('mass_jobs', 'bots_broadcast_jobs', 'broadcast_jobs')
+
+def migration_0001_core_indexes(cursor):
+    # get_user_bots / лимит ботов на пользователя
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bots_owner_id ON bots (owner_id)")
+    # супервизор, телеметрия и фильтры массового запуска
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bots_status ON bots (status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bots_bot_type ON bots (bot_type)")
+    # сверка платежей идет по status = 'pending' окнами invoice_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crypto_payments_status ON crypto_payments (status, invoice_id)")
+    # проверка холда выбирает задачи по check_after_timestamp <= now
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_flyer_rewards_check_after ON pending_flyer_rewards (check_after_timestamp)")
+
+def migration_0002_bot_config_version(cursor):
+    cursor.execute("PRAGMA table_info(bots)")
+    if 'config_version' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE bots ADD COLUMN config_version INTEGER NOT NULL DEFAULT 0")
+
+def migration_0003_bot_catalogue(cursor):
+    # rank IS NULL — бот в публичный список не попадает (остановлен, скрыт или ниже порога)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bot_catalogue (
+        bot_id INTEGER PRIMARY KEY,
+        bot_username TEXT,
+        bot_type TEXT,
+        user_count INTEGER NOT NULL DEFAULT 0,
+        running INTEGER NOT NULL DEFAULT 0,
+        pinned INTEGER NOT NULL DEFAULT 0,
+        hidden INTEGER NOT NULL DEFAULT 0,
+        manual INTEGER NOT NULL DEFAULT 0,
+        rank INTEGER,
+        updated_at INTEGER
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_catalogue_rank ON bot_catalogue (rank) WHERE rank IS NOT NULL")
+
+def migration_0004_broadcast_jobs(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        source_message_id INTEGER NOT NULL,
+        reply_markup TEXT,
+        progress_message_id INTEGER,
+        cursor INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created_at INTEGER,
+        updated_at INTEGER,
+        finished_at INTEGER
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        job_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        updated_at INTEGER,
+        PRIMARY KEY (job_id, user_id)
+    )''')
+    # Заблокировавшие конструктор пропускаются следующими рассылками, пока снова не напишут боту
+    cursor.execute("PRAGMA table_info(users)")
+    if 'blocked_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE users ADD COLUMN blocked_at INTEGER")
+
+def migration_0005_stats_daily(cursor):
+    # dimension — тип бота, тип payload или исход проверки холда; '' для общих метрик
+    cursor.execute('''CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        dimension TEXT NOT NULL DEFAULT '',
+        value REAL NOT NULL DEFAULT 0,
+        updated_at INTEGER,
+        PRIMARY KEY (day, metric, dimension)
+    )''')
+    # У ботов, созданных до миграции, даты нет — в bots_created они не попадут
+    cursor.execute("PRAGMA table_info(bots)")
+    if 'created_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE bots ADD COLUMN created_at INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bots_created_at ON bots (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crypto_payment_applications_applied_at ON crypto_payment_applications (applied_at)")
+
+def migration_0006_job_errors(cursor):
+    # Текст ошибки, с которой фоновое задание остановилось в статусе 'failed' (см. fail_job)
+    for table in JOB_TABLES:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'error' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN error TEXT")
+
+SCHEMA_MIGRATIONS = [
+    (1, "Индексы bots, crypto_payments и pending_flyer_rewards", migration_0001_core_indexes),
+    (2, "Версия снимка конфигурации дочернего бота", migration_0002_bot_config_version),
+    (3, "Материализованный каталог публичного списка ботов", migration_0003_bot_catalogue),
+    (4, "Возобновляемые рассылки по пользователям конструктора", migration_0004_broadcast_jobs),
+    (5, "Дневные сводки статистики и дата создания бота", migration_0005_stats_daily),
+    (6, "Ошибка остановленных фоновых заданий", migration_0006_job_errors),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def check_schema_version(cursor):
+    """Возвращает текущую версию схемы. Если БД уже обновлена более новой версией
+    кода, работать с ней нельзя — бросаем RuntimeError до любых изменений.
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at INTEGER
+    )''')
+    conn.commit()
+    current = cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Схема БД {DB_NAME} версии {current} новее кода (поддерживается до {SCHEMA_VERSION}). "
+            f"Обновите конструктор или восстановите совместимую БД."
+        )
+    return current
+
+def apply_schema_migrations(cursor):
+    """Применяет недостающие шаги по порядку, каждый в своей транзакции."""
+    current = check_schema_version(cursor)
+    for version, description, step in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            cursor.execute("BEGIN")
+            step(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                           (version, description, int(time.time())))
             conn.commit()
-            return cursor.lastrowid
-        if fetchone:
-            return cursor.fetchone()
-        if fetchall:
-            return cursor.fetchall()
-        return cursor
+        except Exception:
+            conn.rollback()
+            logging.critical(f"Миграция схемы #{version} ({description}) не применена.", exc_info=True)
+            raise
+        logging.info(f"Применена миграция схемы #{version}: {description}")
 
-def get_child_bot_user_count(bot_id, bot_type):
+def db_execute(query, params=(), commit=False, fetchone=False, fetchall=False):
+    return storage.execute(query, params, commit=commit, fetchone=fetchone, fetchall=fetchall)
+
+def get_child_bot_db_path(bot_id, bot_type):
     db_filename_map = {
         'ref': f"dbs/bot_{bot_id}_data.db",
         'stars': f"dbs/bot_{bot_id}_stars_data.db",
@@ -574,103 +1195,380 @@ def get_child_bot_user_count(bot_id, bot_type):
         'anonchat': f"dbs/bot_{bot_id}_anonchat.db",
         'cashlait': f"dbs/bot_{bot_id}_cashlait.db",
         'dicelite': f"dbs/bot_{bot_id}_dicelite.db",
+        'exchange': f"dbs/bot_{bot_id}_exchange.db",
     }
-    db_filename = db_filename_map.get(bot_type, f"dbs/bot_{bot_id}_data.db")
+    return db_filename_map.get(bot_type, f"dbs/bot_{bot_id}_data.db")
+
+def get_child_bot_user_count(bot_id, bot_type):
+    """Живой подсчет пользователей в БД дочернего бота. Для экранов используйте кэш bot_user_counts.
+    None — БД есть, но прочитать ее не удалось (занята, повреждена): это не 0 пользователей."""
+    db_filename = get_child_bot_db_path(bot_id, bot_type)
+    if not os.path.exists(db_filename):
+        return 0
     try:
-        if not os.path.exists(db_filename):
-            return 0
         child_conn = sqlite3.connect(f'file:{db_filename}?mode=ro', uri=True)
-        count = child_conn.cursor().execute("SELECT COUNT(*) FROM users").fetchone()[0]
-        child_conn.close()
-        return count
-    except Exception:
-        return 0
+        try:
+            return child_conn.cursor().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            child_conn.close()
+    except Exception as e:
+        logging.warning(f"Не удалось посчитать пользователей бота #{bot_id}: {e}")
+        return None
 
-def update_bot_setting(bot_id, setting_name, new_value):
-    allowed_settings = [
-        'bot_token', 'bot_username', 'ref_reward_1', 'ref_reward_2', 'withdrawal_limit', 'status',
-        'withdrawal_method_text', 'payout_channel', 'chat_link', 'regulations_text', 'vip_status', 
-        'admins', 'owner_id', 'welcome_message', 'flyer_op_enabled', 'flyer_api_key', 'flyer_limit',
-        'stars_payments_channel', 'stars_support_chat', 'stars_flyer_api_key', 'stars_welcome_bonus', 'stars_op_enabled',
-        'stars_daily_bonus', 'stars_daily_cooldown', 'stars_ref_bonus_referrer', 'stars_ref_bonus_new_user',
-        # Clicker-specific settings
-        'click_reward_min', 'click_reward_max', 'energy_max', 'energy_regen_rate', 'welcome_bonus_clicker',
-        'daily_bonus_clicker', 'daily_bonus_cooldown_clicker', 'ref_bonus_referrer_clicker', 'ref_bonus_new_user_clicker',
-        'withdrawal_min_clicker', 'withdrawal_method_text_clicker', 'payments_channel_clicker', 'support_chat_clicker',
-        'clicker_flyer_api_key', 'clicker_op_enabled',
-        # Anonchat-specific settings
-        'anonchat_channel_id', 'anonchat_vip_price', 'anonchat_welcome_message', 'anonchat_crypto_api_token',
-        'anonchat_flyer_api_key', 'anonchat_flyer_tasks_limit',
-        # CashLait-specific settings
-        'cashlait_flyer_api_key', 'cashlait_crypto_pay_token', 'cashlait_currency_symbol',
-        # DiceLite-specific settings
-        'dicelite_crypto_pay_token', 'dicelite_welcome_text',
-    ]
-    if setting_name in allowed_settings:
-        db_execute(f"UPDATE bots SET {setting_name} = ? WHERE id = ?", (new_value, bot_id), commit=True)
+def get_child_db_mtime(db_filename):
+    """mtime БД с учетом WAL-файла: в WAL-режиме основной файл меняется только на чекпоинте."""
+    mtimes = []
+    for path in (db_filename, f"{db_filename}-wal"):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            continue
+    return max(mtimes) if mtimes else None
+
+def refresh_bot_user_counts():
+    """Пересчитывает пользователей только у тех ботов, чьи файлы БД изменились с прошлого прохода."""
+    rows = db_execute(
+        "SELECT b.id, b.bot_type, c.db_mtime FROM bots b LEFT JOIN bot_user_counts c ON c.bot_id = b.id",
+        fetchall=True
+    ) or []
+    updates = []
+    for row in rows:
+        db_filename = get_child_bot_db_path(row['id'], row['bot_type'])
+        mtime = get_child_db_mtime(db_filename)
+        if mtime is None:
+            if row['db_mtime'] is not None:
+                updates.append((row['id'], 0, None))
+            continue
+        if row['db_mtime'] is not None and mtime <= row['db_mtime']:
+            continue
+        count = get_child_bot_user_count(row['id'], row['bot_type'])
+        if count is None:
+            # Ошибку чтения не пишем как 0 — иначе бот выпадет из каталога; mtime не сдвигаем, повторим
+            continue
+        updates.append((row['id'], count, mtime))
+    now_ts = int(time.time())
+    with db_lock:
+        conn.executemany(
+            "INSERT INTO bot_user_counts (bot_id, user_count, db_mtime, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(bot_id) DO UPDATE SET user_count = excluded.user_count, db_mtime = excluded.db_mtime, updated_at = excluded.updated_at",
+            [(bot_id, count, mtime, now_ts) for bot_id, count, mtime in updates]
+        )
+        conn.execute("DELETE FROM bot_user_counts WHERE bot_id NOT IN (SELECT id FROM bots)")
+        conn.commit()
+    if updates:
+        refresh_bot_catalogue([bot_id for bot_id, _, _ in updates])
+    return len(updates)
+
+def get_cached_bot_user_count(bot_id, bot_type):
+    row = db_execute("SELECT user_count FROM bot_user_counts WHERE bot_id = ?", (bot_id,), fetchone=True)
+    if row is not None:
+        return row['user_count']
+    # Бот еще не попал в кэш (создан после последнего прохода воркера)
+    return get_child_bot_user_count(bot_id, bot_type) or 0
+
+def bot_user_counts_worker():
+    logging.info("Воркер кэша числа пользователей ботов запущен.")
+    while True:
+        try:
+            updated = refresh_bot_user_counts()
+            if updated:
+                logging.info(f"Кэш пользователей ботов обновлен: пересчитано {updated} БД.")
+        except Exception as e:
+            logging.error(f"Ошибка в воркере кэша пользователей ботов: {e}")
+        time.sleep(BOT_USER_COUNTS_REFRESH_INTERVAL)
+
+# -------------------- НАСТРОЙКИ ДОЧЕРНИХ БОТОВ --------------------
+# Типизированная схема колонок bots, которые можно менять через update_bot_settings:
+# колонка -> (тип значения, типы ботов). None вместо типов ботов — настройка общая.
+# 'json' — строка с JSON (список админов), list/dict сериализуются автоматически.
+
+BOT_SETTINGS_SCHEMA = {
+    'bot_token': (str, None), 'bot_username': (str, None), 'status': (str, None),
+    'admins': ('json', None), 'owner_id': (int, None), 'welcome_message': (str, None), 'vip_status': (bool, None),
+    'flyer_op_enabled': (bool, None), 'flyer_api_key': (str, None), 'flyer_limit': (int, None),
+    # Ref-specific settings
+    'ref_reward_1': (float, ('ref',)), 'ref_reward_2': (float, ('ref',)), 'withdrawal_limit': (float, ('ref',)),
+    'withdrawal_method_text': (str, ('ref',)), 'payout_channel': (str, ('ref', 'cashlait')), 'chat_link': (str, ('ref', 'cashlait')),
+    'regulations_text': (str, ('ref',)),
+    # Stars-specific settings
+    'stars_payments_channel': (str, ('stars',)), 'stars_support_chat': (str, ('stars',)), 'stars_flyer_api_key': (str, ('stars',)),
+    'stars_op_enabled': (bool, ('stars',)), 'stars_welcome_bonus': (float, ('stars',)), 'stars_daily_bonus': (float, ('stars',)),
+    'stars_daily_cooldown': (int, ('stars',)), 'stars_ref_bonus_referrer': (float, ('stars',)), 'stars_ref_bonus_new_user': (float, ('stars',)),
+    # Clicker-specific settings
+    'click_reward_min': (float, ('clicker',)), 'click_reward_max': (float, ('clicker',)), 'energy_max': (int, ('clicker',)),
+    'energy_regen_rate': (int, ('clicker',)), 'welcome_bonus_clicker': (float, ('clicker',)), 'daily_bonus_clicker': (float, ('clicker',)),
+    'daily_bonus_cooldown_clicker': (int, ('clicker',)), 'ref_bonus_referrer_clicker': (float, ('clicker',)),
+    'ref_bonus_new_user_clicker': (float, ('clicker',)), 'withdrawal_min_clicker': (float, ('clicker',)),
+    'withdrawal_method_text_clicker': (str, ('clicker',)), 'payments_channel_clicker': (str, ('clicker',)),
+    'support_chat_clicker': (str, ('clicker',)), 'clicker_flyer_api_key': (str, ('clicker',)), 'clicker_op_enabled': (bool, ('clicker',)),
+    # Anonchat-specific settings
+    'anonchat_channel_id': (str, ('anonchat',)), 'anonchat_vip_price': (float, ('anonchat',)),
+    'anonchat_welcome_message': (str, ('anonchat',)), 'anonchat_crypto_api_token': (str, ('anonchat',)),
+    'anonchat_flyer_api_key': (str, ('anonchat',)), 'anonchat_flyer_tasks_limit': (int, ('anonchat',)),
+    # CashLait-specific settings
+    'cashlait_flyer_api_key': (str, ('cashlait',)), 'cashlait_crypto_pay_token': (str, ('cashlait',)),
+    'cashlait_currency_symbol': (str, ('cashlait',)), 'cashlait_welcome_text': (str, ('cashlait',)),
+    # DiceLite-specific settings
+    'dicelite_crypto_pay_token': (str, ('dicelite',)), 'dicelite_welcome_text': (str, ('dicelite',)),
+    # Exchange-specific settings
+    'exchange_welcome_text': (str, ('exchange',)),
+}
 
-def build_public_bots_list(min_users: int):
-    """Строит список ботов для раздела '📋 Списки ботов' с учетом закрепов/ручного/скрытых.
-    Возвращает список кортежей: (bot_id, username_or_None, bot_type, users_count, link)
-    Показаны только активные (запущенные) боты.
-    """
+def coerce_bot_setting(bot_type, name, value):
+    """Приводит значение к типу из BOT_SETTINGS_SCHEMA. ValueError — настройки нет,
+    она не относится к этому типу бота или значение не приводится к типу."""
+    spec = BOT_SETTINGS_SCHEMA.get(name)
+    if spec is None:
+        raise ValueError(f"неизвестная настройка бота: {name}")
+    value_type, bot_types = spec
+    if bot_types is not None and bot_type not in bot_types:
+        raise ValueError(f"настройка {name} не относится к ботам типа {bot_type}")
+    if value is None:
+        return None
+    if value_type is bool:
+        if isinstance(value, str):
+            return 1 if value.strip().lower() in ('1', 'true', 'yes', 'on') else 0
+        return 1 if value else 0
+    if value_type is int:
+        return int(value)
+    if value_type is float:
+        return float(value.replace(',', '.')) if isinstance(value, str) else float(value)
+    if value_type == 'json':
+        if isinstance(value, str):
+            json.loads(value)
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def update_bot_settings(bot_id, changes):
+    """Пишет несколько настроек бота одним UPDATE и одним коммитом вместе с config_version + 1,
+    затем публикует снимок конфигурации этой версии. Возвращает новую версию.
+    При ошибке валидации (ValueError) в БД ничего не пишется."""
+    bot_info = get_bot_by_id(bot_id)
+    if not bot_info:
+        raise ValueError(f"бот #{bot_id} не найден")
+    values = {name: coerce_bot_setting(bot_info['bot_type'], name, value) for name, value in changes.items()}
+    if not values:
+        return bot_info['config_version']
+    assignments = ", ".join(f"{name} = ?" for name in values)
+    with bot_config_lock:
+        db_execute(f"UPDATE bots SET {assignments}, config_version = config_version + 1 WHERE id = ?",
+                   (*values.values(), bot_id), commit=True)
+        bot_info_cache.invalidate(bot_id)
+    if 'status' in values or 'bot_username' in values:
+        refresh_bot_catalogue([bot_id])
+    return publish_bot_config(bot_id, bump=False) or bot_info['config_version'] + 1
+
+def update_bot_setting(bot_id, setting_name, new_value):
+    try:
+        update_bot_settings(bot_id, {setting_name: new_value})
+    except ValueError as e:
+        logging.warning(f"Настройка {setting_name} бота #{bot_id} не сохранена: {e}")
+
+# -------------------- КАТАЛОГ '📋 СПИСКИ БОТОВ' --------------------
+# Порядок публичного списка материализуется в bot_catalogue.rank, чтобы экран
+# пользователя был одним индексным запросом со страницами. rank = секция * SPAN + ключ:
+#   0 — закрепленные (по позиции в bots_list_pinned), независимо от порога;
+#   1 — набравшие порог bots_list_min_users, новые выше;
+#   2 — добавленные вручную (по позиции в bots_list_manual).
+# Строка пересчитывается при смене статуса/юзернейма бота и числа его пользователей,
+# весь каталог — при изменении списков закрепа/скрытия/ручного или порога.
+
+def load_bot_catalogue_rules():
     try:
         pinned = json.loads(get_setting('bots_list_pinned') or '[]')
         manual = json.loads(get_setting('bots_list_manual') or '[]')
         hidden = set(json.loads(get_setting('bots_list_hidden') or '[]'))
     except Exception:
         pinned, manual, hidden = [], [], set()
+    try:
+        min_users = int(float(get_setting('bots_list_min_users') or 30))
+    except Exception:
+        min_users = 30
+    return {
+        'pinned': {bid: pos for pos, bid in enumerate(pinned)},
+        'manual': {bid: pos for pos, bid in enumerate(manual)},
+        'hidden': hidden,
+        'min_users': min_users,
+    }
 
-    bots = db_execute("SELECT id, bot_username, bot_type, status FROM bots ORDER BY id DESC", fetchall=True) or []
-    listed: List[tuple] = []
+def bot_catalogue_rank(bot_id, running, user_count, rules):
+    if not running or bot_id in rules['hidden']:
+        return None
+    if bot_id in rules['pinned']:
+        return rules['pinned'][bot_id]
+    if user_count >= rules['min_users']:
+        return BOT_CATALOGUE_RANK_SPAN + (BOT_CATALOGUE_RANK_SPAN - 1 - bot_id)
+    if bot_id in rules['manual']:
+        return 2 * BOT_CATALOGUE_RANK_SPAN + rules['manual'][bot_id]
+    return None
 
-    # Добавляем закрепленные сверху, независимо от порога, если не скрыты
-    for bid in pinned:
-        b = next((x for x in bots if x['id'] == bid), None)
-        if not b or bid in hidden:
-            continue
-        if b['status'] != 'running':
-            continue
-        cnt = get_child_bot_user_count(b['id'], b['bot_type'])
-        link = f"https://t.me/{b['bot_username']}" if b['bot_username'] else "—"
-        listed.append((b['id'], b['bot_username'] or 'Без имени', b['bot_type'], cnt, link))
+def refresh_bot_catalogue(bot_ids=None):
+    """Пересчитывает строки каталога для bot_ids, а без аргумента — весь каталог."""
+    rules = load_bot_catalogue_rules()
+    base_query = (
+        "SELECT b.id, b.bot_username, b.bot_type, b.status, COALESCE(c.user_count, 0) AS user_count "
+        "FROM bots b LEFT JOIN bot_user_counts c ON c.bot_id = b.id"
+    )
+    if bot_ids is None:
+        rows = db_execute(base_query, fetchall=True) or []
+    else:
+        ids = sorted(set(bot_ids))
+        rows = []
+        for i in range(0, len(ids), BOT_CATALOGUE_REFRESH_CHUNK):
+            chunk = ids[i:i + BOT_CATALOGUE_REFRESH_CHUNK]
+            rows.extend(db_execute(f"{base_query} WHERE b.id IN ({','.join('?' * len(chunk))})", chunk, fetchall=True) or [])
+    now_ts = int(time.time())
+    values = []
+    for row in rows:
+        bot_id = row['id']
+        running = row['status'] == 'running'
+        values.append((
+            bot_id, row['bot_username'], row['bot_type'], row['user_count'], int(running),
+            int(bot_id in rules['pinned']), int(bot_id in rules['hidden']), int(bot_id in rules['manual']),
+            bot_catalogue_rank(bot_id, running, row['user_count'], rules), now_ts
+        ))
+    with db_lock:
+        conn.executemany(
+            "INSERT INTO bot_catalogue (bot_id, bot_username, bot_type, user_count, running, pinned, hidden, manual, rank, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(bot_id) DO UPDATE SET "
+            "bot_username = excluded.bot_username, bot_type = excluded.bot_type, user_count = excluded.user_count, "
+            "running = excluded.running, pinned = excluded.pinned, hidden = excluded.hidden, manual = excluded.manual, "
+            "rank = excluded.rank, updated_at = excluded.updated_at",
+            values
+        )
+        if bot_ids is None:
+            conn.execute("DELETE FROM bot_catalogue WHERE bot_id NOT IN (SELECT id FROM bots)")
+        conn.commit()
+    return len(values)
 
-    # Остальные по порогу, исключая скрытых и уже добавленных
-    added_ids = {x[0] for x in listed}
-    for b in bots:
-        if b['id'] in added_ids or b['id'] in hidden:
-            continue
-        if b['status'] != 'running':
-            continue
-        cnt = get_child_bot_user_count(b['id'], b['bot_type'])
-        if cnt >= min_users:
-            link = f"https://t.me/{b['bot_username']}" if b['bot_username'] else "—"
-            listed.append((b['id'], b['bot_username'] or 'Без имени', b['bot_type'], cnt, link))
-
-    # Добавляем вручную добавленные, если не скрыты и еще не в списке
-    for bid in manual:
-        if bid in hidden or bid in added_ids:
-            continue
-        b = next((x for x in bots if x['id'] == bid), None)
-        if not b:
-            continue
-        if b['status'] != 'running':
-            continue
-        cnt = get_child_bot_user_count(b['id'], b['bot_type'])
+def rebuild_bot_catalogue():
+    try:
+        count = refresh_bot_catalogue()
+        logging.info(f"Каталог публичного списка ботов перестроен: {count} ботов.")
+    except Exception as e:
+        logging.error(f"Не удалось перестроить каталог ботов: {e}")
+
+def build_public_bots_list(page=0, page_size=BOT_CATALOGUE_PAGE_SIZE):
+    """Страница раздела '📋 Списки ботов' из материализованного каталога.
+    Возвращает (список кортежей (bot_id, username_or_'Без имени', bot_type, users_count, link), всего_ботов).
+    Показаны только активные (запущенные) боты.
+    """
+    total = db_execute("SELECT COUNT(*) FROM bot_catalogue WHERE rank IS NOT NULL", fetchone=True)[0]
+    rows = db_execute(
+        "SELECT bot_id, bot_username, bot_type, user_count FROM bot_catalogue "
+        "WHERE rank IS NOT NULL ORDER BY rank LIMIT ? OFFSET ?",
+        (page_size, page * page_size), fetchall=True
+    ) or []
+    listed: List[tuple] = []
+    for b in rows:
         link = f"https://t.me/{b['bot_username']}" if b['bot_username'] else "—"
-        listed.append((b['id'], b['bot_username'] or 'Без имени', b['bot_type'], cnt, link))
+        listed.append((b['bot_id'], b['bot_username'] or 'Без имени', b['bot_type'], b['user_count'], link))
+    return listed, total
+
+def render_public_bots_page(page):
+    """Текст и клавиатура страницы публичного списка. None — список пуст."""
+    listed, total = build_public_bots_list(page)
+    if not listed:
+        if total and page > 0:
+            # Список сократился, пока пользователь листал — показываем последнюю страницу
+            return render_public_bots_page((total - 1) // BOT_CATALOGUE_PAGE_SIZE)
+        return None
+    lines = []
+    for bid, uname, btype, cnt, link in listed:
+        type_icon = "💸" if btype == 'ref' else ("⭐" if btype == 'stars' else "🖱")
+        username_show = f"@{uname}" if uname != 'Без имени' else 'Без имени'
+        link_show = link if link != '—' else '—'
+        lines.append(f"{type_icon} ID: <code>{bid}</code> | {username_show} | 👥 {cnt} | 🔗 {link_show}")
+    total_pages = (total + BOT_CATALOGUE_PAGE_SIZE - 1) // BOT_CATALOGUE_PAGE_SIZE
+    text = "<b>📋 Списки ботов</b>\n\n" + "\n".join(lines)
+    markup = None
+    if total_pages > 1:
+        text += f"\n\nСтраница {page + 1}/{total_pages}"
+        markup = types.InlineKeyboardMarkup()
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"botslist_page_{page - 1}"))
+        if page + 1 < total_pages:
+            nav_buttons.append(types.InlineKeyboardButton("Вперед ➡️", callback_data=f"botslist_page_{page + 1}"))
+        markup.row(*nav_buttons)
+    return text, markup
+
+class SettingsCache:
+    """Таблица settings целиком в памяти процесса.
+
+    Записи через set_setting/delete_setting обновляют словарь сразу и двигают
+    version. Изменения, сделанные мимо конструктора (другим процессом или руками),
+    ловятся по PRAGMA data_version соединения-писателя: он меняется только от чужих
+    коммитов. Проверка не чаще раза в SETTINGS_CACHE_RECHECK_SECONDS.
+    """
+
+    def __init__(self):
+        self.values = None
+        self.version = 0
+        self.data_version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _reload(self):
+        with db_lock:
+            rows = conn.execute("SELECT key, value FROM settings").fetchall()
+            self.data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self.values = {row[0]: row[1] for row in rows}
+        self.version += 1
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self.values is not None and now - self.checked_at < SETTINGS_CACHE_RECHECK_SECONDS:
+            return
+        with self.lock:
+            if self.values is None:
+                self._reload()
+            else:
+                with db_lock:
+                    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self.data_version:
+                    self._reload()
+            self.checked_at = now
+
+    def get(self, key):
+        self._ensure_fresh()
+        return self.values.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            db_execute("REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value), commit=True)
+            if self.values is not None:
+                # sqlite3 хранит bool как целое — кэш должен отдавать то же, что и SELECT
+                self.values[key] = int(value) if isinstance(value, bool) else value
+            self.version += 1
+
+    def delete(self, key):
+        with self.lock:
+            db_execute("DELETE FROM settings WHERE key = ?", (key,), commit=True)
+            if self.values is not None:
+                self.values.pop(key, None)
+            self.version += 1
 
-    return listed
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+
+
+settings_cache = SettingsCache()
 
 def get_setting(key):
-    result = db_execute("SELECT value FROM settings WHERE key = ?", (key,), fetchone=True)
-    return result[0] if result else None
+    return settings_cache.get(key)
 
 def set_setting(key, value):
-    db_execute("REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value), commit=True)
+    settings_cache.set(key, value)
+    if key in BOT_CATALOGUE_SETTING_KEYS:
+        rebuild_bot_catalogue()
 
 def delete_setting(key):
-    db_execute("DELETE FROM settings WHERE key = ?", (key,), commit=True)
+    settings_cache.delete(key)
+    if key in BOT_CATALOGUE_SETTING_KEYS:
+        rebuild_bot_catalogue()
 
 def is_customization_unlocked():
     try:
@@ -853,96 +1751,115 @@ def unlock_exchange_globally():
         logging.error(f"Не удалось установить глобальный доступ к Exchange Bot: {exc}")
         raise
 
+# Колонка флага доступа пользователя и проверка глобальной разблокировки шаблона
+USER_UNLOCK_FLAGS = [
+    ('clicker_unlocked', is_clicker_unlocked_globally),
+    ('anonchat_unlocked', is_anonchat_unlocked_globally),
+    ('cashlait_unlocked', is_cashlait_unlocked_globally),
+    ('dicelite_unlocked', is_dicelite_unlocked_globally),
+    ('exchange_unlocked', is_exchange_unlocked_globally),
+]
+
 def get_user(user_id, username=None):
+    """Читает пользователя одним SELECT. Пишет в БД только когда есть что менять:
+    новая строка или флаг глобально открытого шаблона еще не выставлен. Флаги берутся
+    из кэша настроек. Вызывается и для третьих лиц (карточки в админке, владельцы
+    ботов), поэтому blocked_at здесь не трогается — см. mark_user_reachable."""
+    unlocked = [column for column, is_unlocked_globally in USER_UNLOCK_FLAGS if is_unlocked_globally()]
     user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
-    if user is None: 
-        db_execute("INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)", (user_id, username), commit=True)
-        user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
-    if user is not None:
+    if user is None:
         try:
-            needs_sync_clicker = (
-                hasattr(user, 'keys')
-                and 'clicker_unlocked' in user.keys()
-                and user['clicker_unlocked'] in (None, 0, '0', False)
-            )
-            if needs_sync_clicker and is_clicker_unlocked_globally():
-                db_execute(
-                    "UPDATE users SET clicker_unlocked = 1 WHERE user_id = ?",
-                    (user_id,),
-                    commit=True
-                )
-                user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
-            
-            needs_sync_anonchat = (
-                hasattr(user, 'keys')
-                and 'anonchat_unlocked' in user.keys()
-                and user['anonchat_unlocked'] in (None, 0, '0', False)
-            )
-            if needs_sync_anonchat and is_anonchat_unlocked_globally():
-                db_execute(
-                    "UPDATE users SET anonchat_unlocked = 1 WHERE user_id = ?",
-                    (user_id,),
-                    commit=True
-                )
-                user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
-            
-            needs_sync_cashlait = (
-                hasattr(user, 'keys')
-                and 'cashlait_unlocked' in user.keys()
-                and user['cashlait_unlocked'] in (None, 0, '0', False)
-            )
-            if needs_sync_cashlait and is_cashlait_unlocked_globally():
-                db_execute(
-                    "UPDATE users SET cashlait_unlocked = 1 WHERE user_id = ?",
-                    (user_id,),
-                    commit=True
-                )
-                user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
-
-            needs_sync_dicelite = (
-                hasattr(user, 'keys')
-                and 'dicelite_unlocked' in user.keys()
-                and user['dicelite_unlocked'] in (None, 0, '0', False)
+            db_execute(
+                f"INSERT INTO users (user_id, username{''.join(f', {c}' for c in unlocked)}) "
+                f"VALUES (?, ?{', 1' * len(unlocked)}) ON CONFLICT(user_id) DO NOTHING",
+                (user_id, username),
+                commit=True
             )
-            if needs_sync_dicelite and is_dicelite_unlocked_globally():
-                db_execute(
-                    "UPDATE users SET dicelite_unlocked = 1 WHERE user_id = ?",
-                    (user_id,),
-                    commit=True
-                )
-                user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
+        except Exception as exc:
+            logging.error(f"Не удалось создать пользователя {user_id}: {exc}")
+        user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
+        if user is None:
+            return None
 
-            needs_sync_exchange = (
-                hasattr(user, 'keys')
-                and 'exchange_unlocked' in user.keys()
-                and user['exchange_unlocked'] in (None, 0, '0', False)
+    changes = {column: 1 for column in unlocked if user.get(column) in (None, 0, '0', False)}
+    if changes:
+        try:
+            db_execute(
+                f"UPDATE users SET {', '.join(f'{c} = ?' for c in changes)} WHERE user_id = ?",
+                (*changes.values(), user_id),
+                commit=True
             )
-            if needs_sync_exchange and is_exchange_unlocked_globally():
-                db_execute(
-                    "UPDATE users SET exchange_unlocked = 1 WHERE user_id = ?",
-                    (user_id,),
-                    commit=True
-                )
-                user = row_to_dict(db_execute("SELECT * FROM users WHERE user_id = ?", (user_id,), fetchone=True))
+            user.update(changes)
         except Exception as exc:
-            logging.error(f"Не удалось синхронизировать флаги разблокировки для пользователя {user_id}: {exc}")
+            logging.error(f"Не удалось синхронизировать пользователя {user_id}: {exc}")
     return user
 
+def mark_user_reachable(user_id):
+    """Снимает отметку blocked_at, когда сам пользователь пишет боту или жмет кнопку:
+    раз апдейт от него пришел, бот разблокирован и пользователь снова попадает в рассылки."""
+    row = db_execute("SELECT blocked_at FROM users WHERE user_id = ?", (user_id,), fetchone=True)
+    if row and row[0]:
+        db_execute(
+            "UPDATE users SET blocked_at = NULL WHERE user_id = ? AND blocked_at IS NOT NULL",
+            (user_id,), commit=True
+        )
+
 def get_user_bots_count(user_id):
     return db_execute("SELECT COUNT(*) FROM bots WHERE owner_id = ?", (user_id,), fetchone=True)[0]
 
 def get_user_bots(user_id):
     return db_execute("SELECT * FROM bots WHERE owner_id = ? ORDER BY id DESC", (user_id,), fetchall=True)
 
+class BotInfoCache:
+    """Строки bots по id в памяти процесса.
+
+    Все записи в bots идут через конструктор и после коммита сбрасывают строку бота,
+    поэтому чтение из кэша не отстает от БД. Поколение защищает от гонки, когда
+    чтение началось до записи, а закончилось после сброса.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, bot_id):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.rows.get(bot_id)
+            if cached and now - cached[0] < BOT_INFO_CACHE_TTL_SECONDS:
+                return dict(cached[1])
+            generation = self.generation
+        row = row_to_dict(db_execute("SELECT * FROM bots WHERE id = ?", (bot_id,), fetchone=True))
+        if row is None:
+            return None
+        with self.lock:
+            if self.generation == generation:
+                self.rows[bot_id] = (now, row)
+        return dict(row)
+
+    def invalidate(self, bot_id=None):
+        with self.lock:
+            self.generation += 1
+            if bot_id is None:
+                self.rows.clear()
+            else:
+                self.rows.pop(bot_id, None)
+
+
+bot_info_cache = BotInfoCache()
+
 def get_bot_by_id(bot_id):
-    return row_to_dict(db_execute("SELECT * FROM bots WHERE id = ?", (bot_id,), fetchone=True))
+    return bot_info_cache.get(bot_id)
 
 def create_bot_in_db(owner_id, bot_type):
-    return db_execute("INSERT INTO bots (owner_id, admins, bot_type) VALUES (?, ?, ?)", 
-                      (owner_id, json.dumps([owner_id]), bot_type), commit=True)
+    return db_execute("INSERT INTO bots (owner_id, admins, bot_type, created_at) VALUES (?, ?, ?, ?)", 
+                      (owner_id, json.dumps([owner_id]), bot_type, int(time.time())), commit=True)
 
 def update_bot_process_info(bot_id, status, pid, start_time=None):
     db_execute("UPDATE bots SET status = ?, pid = ?, start_time = ? WHERE id = ?", (status, pid, start_time, bot_id), commit=True)
+    bot_info_cache.invalidate(bot_id)
+    refresh_bot_catalogue([bot_id])
 
 def delete_bot_from_db(bot_id):
     bot_info = get_bot_by_id(bot_id)
@@ -950,6 +1867,7 @@ def delete_bot_from_db(bot_id):
     stop_bot_process(bot_id)
     try: os.remove(f"logs/bot_{bot_id}.log")
     except FileNotFoundError: pass
+    delete_log_archives(f"bot_{bot_id}")
     db_filename_map = {
         'ref': f"dbs/bot_{bot_id}_data.db",
         'stars': f"dbs/bot_{bot_id}_stars_data.db",
@@ -964,6 +1882,224 @@ def delete_bot_from_db(bot_id):
             os.remove(db_filename)
     except FileNotFoundError: pass
     db_execute("DELETE FROM bots WHERE id = ?", (bot_id,), commit=True)
+    bot_info_cache.invalidate(bot_id)
+    db_execute("DELETE FROM bot_user_counts WHERE bot_id = ?", (bot_id,), commit=True)
+    db_execute("DELETE FROM bot_catalogue WHERE bot_id = ?", (bot_id,), commit=True)
+
+def get_bot_config_path(bot_id):
+    return os.path.abspath(os.path.join(BOT_CONFIG_DIR, f"bot_{bot_id}.json"))
+
+def get_bot_config_ack_path(bot_id):
+    return f"{get_bot_config_path(bot_id)}.ack"
+
+def read_bot_config_ack(bot_id):
+    """Версия снимка, которую бот подтвердил как примененную (0, если подтверждения нет)."""
+    try:
+        with open(get_bot_config_ack_path(bot_id), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def wait_for_bot_config_ack(bot_id, version, timeout=BOT_CONFIG_ACK_TIMEOUT_SECONDS):
+    deadline = time.time() + timeout
+    while True:
+        if read_bot_config_ack(bot_id) >= version:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.5)
+
+def write_bot_config_snapshot(bot_info, config, bump=True):
+    """Атомарно пишет версионированный снимок конфигурации бота.
+
+    Дочерний бот (или хост тенантов) следит за mtime файла и применяет новую
+    версию на лету. bump=False — версию уже подняла запись настроек.
+    Возвращает (путь, версия).
+    """
+    bot_id = bot_info['id']
+    path = get_bot_config_path(bot_id)
+    with bot_config_lock:
+        if bump:
+            db_execute("UPDATE bots SET config_version = config_version + 1 WHERE id = ?", (bot_id,), commit=True)
+            bot_info_cache.invalidate(bot_id)
+        version = db_execute("SELECT config_version FROM bots WHERE id = ?", (bot_id,), fetchone=True)[0]
+        snapshot = {
+            'bot_id': bot_id,
+            'bot_type': bot_info['bot_type'],
+            'version': version,
+            'updated_at': int(time.time()),
+            'env': config,
+        }
+        os.makedirs(BOT_CONFIG_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        # В снимке токены — файл доступен только владельцу процесса
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    return path, version
+
+def publish_bot_config(bot_id, bump=True):
+    """Пересобирает и публикует снимок для запущенного бота. Возвращает версию или None,
+    если бот не запущен со снимком (старый процесс) и изменения увидит только после рестарта."""
+    bot_info = get_bot_by_id(bot_id)
+    if not bot_info or bot_info['status'] != 'running' or not os.path.exists(get_bot_config_path(bot_id)):
+        return None
+    script_name, config = build_bot_config(bot_info)
+    if script_name is None:
+        return None
+    try:
+        return write_bot_config_snapshot(bot_info, config, bump=bump)[1]
+    except OSError as e:
+        logging.error(f"Не удалось записать снимок конфигурации бота #{bot_id}: {e}")
+        return None
+
+def apply_bot_config(bot_id):
+    """Доносит измененные настройки до бота. Снимок уже опубликован update_bot_settings:
+    боты из HOT_CONFIG_BOT_TYPES подхватывают его без перезапуска, остальные
+    перезапускаются как раньше. Горячее применение засчитывается, только если бот
+    подтвердил версию снимка; старый скрипт без подтверждений перезапускается.
+    Возвращает True, если обошлось без перезапуска.
+
+    Блокирует вызывающий поток: до BOT_CONFIG_ACK_TIMEOUT_SECONDS ожидания подтверждения
+    и затем, возможно, stop + 1 сек. + start. Из хендлера callback-кнопки сначала
+    отвечайте на callback (answer_callback_query), иначе Telegram сочтет его просроченным."""
+    bot_info = get_bot_by_id(bot_id)
+    if (bot_info and bot_info['bot_type'] in HOT_CONFIG_BOT_TYPES and bot_info['status'] == 'running'
+            and os.path.exists(get_bot_config_path(bot_id))):
+        version = db_execute("SELECT config_version FROM bots WHERE id = ?", (bot_id,), fetchone=True)[0]
+        if wait_for_bot_config_ack(bot_id, version):
+            return True
+        logging.warning(f"Бот #{bot_id} не подтвердил снимок конфигурации v{version} — перезапускаю.")
+    stop_bot_process(bot_id)
+    time.sleep(1)
+    start_bot_process(bot_id)
+    return False
+
+def build_bot_config(bot_info):
+    """Собирает переменные окружения конкретного бота (без окружения конструктора).
+
+    Тот же набор уходит в env при запуске и в снимок конфигурации для горячего
+    применения. Возвращает (script_name, config) или (None, None) для неизвестного типа.
+    """
+    bot_id = bot_info['id']
+    config = {}
+    admin_ids_env = []
+    try:
+        admins_raw = bot_info['admins']
+    except (KeyError, IndexError, TypeError):
+        admins_raw = None
+    if admins_raw:
+        try:
+            parsed_admins = json.loads(admins_raw)
+            if isinstance(parsed_admins, list):
+                for admin_candidate in parsed_admins:
+                    try:
+                        admin_id = int(admin_candidate)
+                    except (TypeError, ValueError):
+                        continue
+                    if admin_id not in admin_ids_env:
+                        admin_ids_env.append(admin_id)
+        except (ValueError, TypeError, json.JSONDecodeError):
+            logging.warning(f"Не удалось разобрать список админов для бота #{bot_id}")
+    try:
+        owner_id = bot_info['owner_id']
+        if owner_id is not None:
+            owner_id_int = int(owner_id)
+            if owner_id_int not in admin_ids_env:
+                admin_ids_env.insert(0, owner_id_int)
+    except (TypeError, ValueError, KeyError, IndexError):
+        pass
+    if admin_ids_env:
+        config['ADMIN_IDS'] = ",".join(str(admin_id) for admin_id in admin_ids_env)
+    script_name = ""
+
+    if bot_info['bot_type'] == 'ref':
+        script_name = REF_BOT_SCRIPT_NAME
+        if bot_info['flyer_api_key']:
+            config['FLYER_API_KEY'] = bot_info['flyer_api_key']
+    elif bot_info['bot_type'] == 'stars':
+        script_name = STARS_BOT_SCRIPT_NAME
+        if bot_info['stars_flyer_api_key']:
+             config['FLYER_API_KEY'] = bot_info['stars_flyer_api_key']
+    elif bot_info['bot_type'] == 'clicker':
+        script_name = CLICKER_BOT_SCRIPT_NAME
+        if bot_info['clicker_flyer_api_key']:
+             config['FLYER_API_KEY'] = bot_info['clicker_flyer_api_key']
+    elif bot_info['bot_type'] == 'anonchat':
+        script_name = ANONCHAT_BOT_SCRIPT_NAME
+        config['ANONCHAT_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_anonchat.db")
+        if bot_info['bot_token']:
+             config['ANONCHAT_BOT_TOKEN'] = bot_info['bot_token']
+        if bot_info['anonchat_flyer_api_key']:
+             config['ANONCHAT_FLYER_API_KEY'] = bot_info['anonchat_flyer_api_key']
+        if bot_info['anonchat_flyer_tasks_limit']:
+             config['ANONCHAT_FLYER_TASKS_LIMIT'] = str(bot_info['anonchat_flyer_tasks_limit'])
+    elif bot_info['bot_type'] == 'cashlait':
+        script_name = CASHLAIT_BOT_SCRIPT_NAME
+        config['CASHLAIT_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_cashlait.db")
+        config['CASHLAIT_FLYER_TASK_LIMIT'] = str(bot_info['flyer_limit'] or 5)
+        if bot_info['bot_token']:
+            config['CASHLAIT_BOT_TOKEN'] = bot_info['bot_token']
+        if bot_info['cashlait_flyer_api_key']:
+            config['CASHLAIT_FLYER_API_KEY'] = bot_info['cashlait_flyer_api_key']
+        if bot_info['cashlait_crypto_pay_token']:
+            config['CASHLAIT_CRYPTO_PAY_TOKEN'] = bot_info['cashlait_crypto_pay_token']
+        if bot_info['cashlait_currency_symbol']:
+            config['CASHLAIT_CURRENCY_SYMBOL'] = bot_info['cashlait_currency_symbol']
+        if bot_info['cashlait_welcome_text']:
+            config['CASHLAIT_WELCOME_TEXT'] = bot_info['cashlait_welcome_text']
+
+        # Pass custom branding info
+        link_text = get_custom_text('constructor_bot_link_text')
+        link_url = get_custom_text('constructor_bot_link')
+        if link_text: config['CONSTRUCTOR_LINK_TEXT'] = link_text
+        if link_url: config['CONSTRUCTOR_LINK_URL'] = link_url
+    elif bot_info['bot_type'] == 'dicelite':
+        script_name = DICELITE_BOT_SCRIPT_NAME
+        config['DICELITE_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_dicelite.db")
+        if bot_info['bot_token']:
+            config['DICELITE_BOT_TOKEN'] = bot_info['bot_token']
+        if bot_info.get('dicelite_crypto_pay_token'):
+            config['DICELITE_CRYPTO_PAY_TOKEN'] = bot_info['dicelite_crypto_pay_token']
+        if bot_info.get('dicelite_welcome_text'):
+            config['DICELITE_WELCOME_TEXT'] = bot_info['dicelite_welcome_text']
+        # Creator branding for DiceLite
+        link_raw = get_custom_text('constructor_bot_link')
+        link_url = normalize_creator_link_value(link_raw)
+        link_text = get_custom_text('constructor_bot_link_text')
+        label_value = derive_creator_label_from_link(link_url)
+        if link_url:
+            config['CREATOR_CONTACT_URL'] = link_url
+        if label_value:
+            config['CREATOR_CONTACT_LABEL'] = label_value
+        if link_text:
+            config['CREATOR_CONTACT_BUTTON_LABEL'] = link_text
+        config['CREATOR_BRANDING'] = 'true' if (link_url and not bot_info['vip_status']) else 'false'
+    elif bot_info['bot_type'] == 'exchange':
+        script_name = EXCHANGE_BOT_SCRIPT_NAME
+        config['EXCHANGE_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_exchange.db")
+        if bot_info['bot_token']:
+            config['EXCHANGE_BOT_TOKEN'] = bot_info['bot_token']
+        link_raw = get_custom_text('constructor_bot_link')
+        link_url = normalize_creator_link_value(link_raw)
+        link_text = get_custom_text('constructor_bot_link_text')
+        label_value = derive_creator_label_from_link(link_url)
+        if link_url:
+            config['CREATOR_CONTACT_URL'] = link_url
+        if label_value:
+            config['CREATOR_CONTACT_LABEL'] = label_value
+        if link_text:
+            config['CREATOR_CONTACT_BUTTON_LABEL'] = link_text
+        config['CREATOR_BRANDING'] = 'true' if (link_url and not bot_info['vip_status']) else 'false'
+        if bot_info.get('exchange_welcome_text'):
+            config['EXCHANGE_WELCOME_TEXT'] = bot_info['exchange_welcome_text']
+    else:
+        return None, None
+
+    if not bot_info['vip_status']:
+        config['CREATOR_BRANDING'] = 'true'
+    return script_name, config
 
 def start_bot_process(bot_id):
     try:
@@ -978,139 +2114,55 @@ def start_bot_process(bot_id):
     if bot_info['status'] == 'running':
         return False, "Бот уже запущен."
     try:
-        env = os.environ.copy()
-        admin_ids_env = []
-        try:
-            admins_raw = bot_info['admins']
-        except (KeyError, IndexError, TypeError):
-            admins_raw = None
-        if admins_raw:
-            try:
-                parsed_admins = json.loads(admins_raw)
-                if isinstance(parsed_admins, list):
-                    for admin_candidate in parsed_admins:
-                        try:
-                            admin_id = int(admin_candidate)
-                        except (TypeError, ValueError):
-                            continue
-                        if admin_id not in admin_ids_env:
-                            admin_ids_env.append(admin_id)
-            except (ValueError, TypeError, json.JSONDecodeError):
-                logging.warning(f"Не удалось разобрать список админов для бота #{bot_id}")
-        try:
-            owner_id = bot_info['owner_id']
-            if owner_id is not None:
-                owner_id_int = int(owner_id)
-                if owner_id_int not in admin_ids_env:
-                    admin_ids_env.insert(0, owner_id_int)
-        except (TypeError, ValueError, KeyError, IndexError):
-            pass
-        if admin_ids_env:
-            env['ADMIN_IDS'] = ",".join(str(admin_id) for admin_id in admin_ids_env)
-        script_name = ""
-        
-        if bot_info['bot_type'] == 'ref':
-            script_name = REF_BOT_SCRIPT_NAME
-            if bot_info['flyer_api_key']:
-                env['FLYER_API_KEY'] = bot_info['flyer_api_key']
-        elif bot_info['bot_type'] == 'stars':
-            script_name = STARS_BOT_SCRIPT_NAME
-            if bot_info['stars_flyer_api_key']:
-                 env['FLYER_API_KEY'] = bot_info['stars_flyer_api_key']
-        elif bot_info['bot_type'] == 'clicker':
-            script_name = CLICKER_BOT_SCRIPT_NAME
-            if bot_info['clicker_flyer_api_key']:
-                 env['FLYER_API_KEY'] = bot_info['clicker_flyer_api_key']
-        elif bot_info['bot_type'] == 'anonchat':
-            script_name = ANONCHAT_BOT_SCRIPT_NAME
-            env['ANONCHAT_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_anonchat.db")
-            if bot_info['bot_token']:
-                 env['ANONCHAT_BOT_TOKEN'] = bot_info['bot_token']
-            if bot_info['anonchat_flyer_api_key']:
-                 env['ANONCHAT_FLYER_API_KEY'] = bot_info['anonchat_flyer_api_key']
-            if bot_info['anonchat_flyer_tasks_limit']:
-                 env['ANONCHAT_FLYER_TASKS_LIMIT'] = str(bot_info['anonchat_flyer_tasks_limit'])
-        elif bot_info['bot_type'] == 'cashlait':
-            script_name = CASHLAIT_BOT_SCRIPT_NAME
-            env['CASHLAIT_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_cashlait.db")
-            env['CASHLAIT_FLYER_TASK_LIMIT'] = str(bot_info['flyer_limit'] or 5)
-            if bot_info['bot_token']:
-                env['CASHLAIT_BOT_TOKEN'] = bot_info['bot_token']
-            if bot_info['cashlait_flyer_api_key']:
-                env['CASHLAIT_FLYER_API_KEY'] = bot_info['cashlait_flyer_api_key']
-            if bot_info['cashlait_crypto_pay_token']:
-                env['CASHLAIT_CRYPTO_PAY_TOKEN'] = bot_info['cashlait_crypto_pay_token']
-            if bot_info['cashlait_currency_symbol']:
-                env['CASHLAIT_CURRENCY_SYMBOL'] = bot_info['cashlait_currency_symbol']
-            if bot_info['cashlait_welcome_text']:
-                env['CASHLAIT_WELCOME_TEXT'] = bot_info['cashlait_welcome_text']
-            
-            # Pass custom branding info
-            link_text = get_custom_text('constructor_bot_link_text')
-            link_url = get_custom_text('constructor_bot_link')
-            if link_text: env['CONSTRUCTOR_LINK_TEXT'] = link_text
-            if link_url: env['CONSTRUCTOR_LINK_URL'] = link_url
-        elif bot_info['bot_type'] == 'dicelite':
-            script_name = DICELITE_BOT_SCRIPT_NAME
-            env['DICELITE_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_dicelite.db")
-            if bot_info['bot_token']:
-                env['DICELITE_BOT_TOKEN'] = bot_info['bot_token']
-            if bot_info.get('dicelite_crypto_pay_token'):
-                env['DICELITE_CRYPTO_PAY_TOKEN'] = bot_info['dicelite_crypto_pay_token']
-            if bot_info.get('dicelite_welcome_text'):
-                env['DICELITE_WELCOME_TEXT'] = bot_info['dicelite_welcome_text']
-            # Creator branding for DiceLite
-            link_raw = get_custom_text('constructor_bot_link')
-            link_url = normalize_creator_link_value(link_raw)
-            link_text = get_custom_text('constructor_bot_link_text')
-            label_value = derive_creator_label_from_link(link_url)
-            if link_url:
-                env['CREATOR_CONTACT_URL'] = link_url
-            if label_value:
-                env['CREATOR_CONTACT_LABEL'] = label_value
-            if link_text:
-                env['CREATOR_CONTACT_BUTTON_LABEL'] = link_text
-            env['CREATOR_BRANDING'] = 'true' if (link_url and not bot_info['vip_status']) else 'false'
-        elif bot_info['bot_type'] == 'exchange':
-            script_name = EXCHANGE_BOT_SCRIPT_NAME
-            env['EXCHANGE_DB'] = os.path.abspath(f"dbs/bot_{bot_id}_exchange.db")
-            if bot_info['bot_token']:
-                env['EXCHANGE_BOT_TOKEN'] = bot_info['bot_token']
-            link_raw = get_custom_text('constructor_bot_link')
-            link_url = normalize_creator_link_value(link_raw)
-            link_text = get_custom_text('constructor_bot_link_text')
-            label_value = derive_creator_label_from_link(link_url)
-            if link_url:
-                env['CREATOR_CONTACT_URL'] = link_url
-            if label_value:
-                env['CREATOR_CONTACT_LABEL'] = label_value
-            if link_text:
-                env['CREATOR_CONTACT_BUTTON_LABEL'] = link_text
-            env['CREATOR_BRANDING'] = 'true' if (link_url and not bot_info['vip_status']) else 'false'
-            if bot_info.get('exchange_welcome_text'):
-                env['EXCHANGE_WELCOME_TEXT'] = bot_info['exchange_welcome_text']
-        else:
+        script_name, config = build_bot_config(bot_info)
+        if script_name is None:
             return False, "Неизвестный тип бота."
-        
-        if not bot_info['vip_status']:
-            env['CREATOR_BRANDING'] = 'true'
+        config_path, config_version = write_bot_config_snapshot(bot_info, config)
+        config['BOT_CONFIG_PATH'] = config_path
+        config['BOT_CONFIG_VERSION'] = str(config_version)
+        env = os.environ.copy()
+        env.update(config)
         
         # Ensure logs directory exists
         if not os.path.exists('logs'):
             os.makedirs('logs')
             
-        log_file = open(f"logs/bot_{bot_id}.log", "a", encoding='utf-8')
         script_path = os.path.join(os.path.dirname(__file__), script_name)
         
         # Verify script exists before launching
         if not os.path.exists(script_path):
             return False, f"Скрипт не найден: {script_name}"
-        process = subprocess.Popen(
-            [sys.executable, script_path, str(bot_id)],
-            stdout=log_file, stderr=log_file, env=env
-        )
-        log_file.close()
+
+        if bot_host_pool.accepts(bot_info['bot_type']):
+            # В хост уходят только переменные тенанта, остальное окружение у хоста свое
+            webhook_env = webhook_ingress.attach_tenant(bot_id, bot_info['bot_token'])
+            host_pid = bot_host_pool.start_tenant(bot_id, script_path, {**config, **(webhook_env or {})})
+            if host_pid:
+                update_bot_process_info(bot_id, 'running', host_pid, int(time.time()))
+                bot_supervisor.track_tenant(bot_id, host_pid)
+                try:
+                    with open("start_debug.log", "a", encoding="utf-8") as f:
+                        f.write(f"[SUCCESS] Bot {bot_id} launched as tenant in host PID {host_pid}\n")
+                except:
+                    pass
+                return True, "Бот успешно запущен."
+            webhook_ingress.detach(bot_id, bot_info['bot_token'])
+            logging.warning(f"Хосты ботов недоступны, бот #{bot_id} запускается отдельным процессом.")
+
+        process = None
+        if bot_zygote.enabled:
+            process = bot_zygote.spawn(bot_id, script_path, env, os.path.abspath(f"logs/bot_{bot_id}.log"))
+            if process is None:
+                logging.warning(f"Зигота недоступна, бот #{bot_id} запускается холодным стартом.")
+        if process is None:
+            log_file = open(f"logs/bot_{bot_id}.log", "a", encoding='utf-8')
+            process = subprocess.Popen(
+                [sys.executable, script_path, str(bot_id)],
+                stdout=log_file, stderr=log_file, env=env
+            )
+            log_file.close()
         update_bot_process_info(bot_id, 'running', process.pid, int(time.time()))
+        bot_supervisor.track_process(bot_id, process)
         try:
             with open("start_debug.log", "a", encoding="utf-8") as f:
                 f.write(f"[SUCCESS] Bot {bot_id} launched with PID {process.pid}\n")
@@ -1119,38 +2171,2218 @@ def start_bot_process(bot_id):
         return True, "Бот успешно запущен."
     except Exception as e:
         try:
-            with open("start_debug.log", "a", encoding="utf-8") as f:
-                f.write(f"[ERROR] Bot {bot_id} failed: {e}\n")
-        except:
-            pass
-        return False, f"Ошибка запуска: {e}"
+            with open("start_debug.log", "a", encoding="utf-8") as f:
+                f.write(f"[ERROR] Bot {bot_id} failed: {e}\n")
+        except:
+            pass
+        return False, f"Ошибка запуска: {e}"
+
+def stop_bot_process(bot_id):
+    bot_info = get_bot_by_id(bot_id)
+    # Ручная остановка отменяет отложенный перезапуск и не считается падением
+    bot_supervisor.expect_exit(bot_id, bot_info['pid'] if bot_info else None)
+    for path in (get_bot_config_path(bot_id), get_bot_config_ack_path(bot_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    if not bot_info or not bot_info['pid']:
+        update_bot_process_info(bot_id, 'stopped', None, None)
+        return False, "Процесс не найден."
+    if bot_info['status'] != 'running': return False, "Бот уже остановлен."
+    if bot_host_pool.has_tenant(bot_id):
+        # pid у тенанта — это pid общего хоста, его нельзя убивать
+        stopped = bot_host_pool.stop_tenant(bot_id)
+        webhook_ingress.detach(bot_id, bot_info['bot_token'])
+        update_bot_process_info(bot_id, 'stopped', None, None)
+        if stopped:
+            return True, "Бот успешно остановлен."
+        return False, "Хост бота не ответил, статус сброшен."
+    try:
+        p = psutil.Process(bot_info['pid'])
+        p.kill()
+        update_bot_process_info(bot_id, 'stopped', None, None)
+        return True, "Бот успешно остановлен."
+    except psutil.NoSuchProcess:
+        update_bot_process_info(bot_id, 'stopped', None, None)
+        return False, "Процесс не найден, статус сброшен."
+    except Exception as e:
+        update_bot_process_info(bot_id, 'stopped', None, None)
+        return False, f"Ошибка остановки: {e}"
+
+# -------------------- ХОСТЫ ДОЧЕРНИХ БОТОВ --------------------
+# Вместо отдельного интерпретатора на каждого бота держим небольшой пул процессов
+# bot_host.py, каждый из которых крутит несколько ботов как тенантов. Управление —
+# построчный JSON через stdin/stdout хоста. Каждая команда несет id, хост возвращает
+# его в ответе: запоздавший ответ на команду, по которой истек таймаут, отбрасывается
+# и не принимается за ответ на следующую.
+
+class BotHost:
+    def __init__(self, host_id):
+        self.host_id = host_id
+        self.process = None
+        self.tenants = set()
+        self.lock = threading.Lock()
+        self.replies = queue.Queue()
+        self.request_seq = 0
+        # Хост уходит на перезапуск: новых тенантов на него не ставим
+        self.retiring = False
+        self.tenant_starts = 0
+
+    def spawn(self):
+        script_path = os.path.join(os.path.dirname(__file__), BOT_HOST_SCRIPT_NAME)
+        if not os.path.exists(script_path):
+            raise FileNotFoundError(f"Скрипт хоста не найден: {BOT_HOST_SCRIPT_NAME}")
+        log_file = open(f"logs/host_{self.host_id}.log", "a", encoding='utf-8')
+        self.process = subprocess.Popen(
+            [sys.executable, script_path, str(self.host_id)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log_file,
+            text=True, encoding='utf-8', bufsize=1
+        )
+        log_file.close()
+        # select() по буферизованному TextIOWrapper может не увидеть уже прочитанную в буфер
+        # строку, поэтому ответы читает отдельный поток в очередь
+        threading.Thread(target=self._read_replies, args=(self.process.stdout,),
+                         name=f"bot-host-{self.host_id}-reader", daemon=True).start()
+        logging.info(f"Запущен хост ботов #{self.host_id} (PID {self.process.pid}).")
+
+    def _read_replies(self, stdout):
+        try:
+            for line in stdout:
+                self.replies.put(line)
+        except (OSError, ValueError):
+            pass
+        # None — канал закрыт, хост завершился
+        self.replies.put(None)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def request(self, payload, timeout=30):
+        with self.lock:
+            if not self.is_alive():
+                return None
+            self.request_seq += 1
+            request_id = self.request_seq
+            try:
+                self.process.stdin.write(json.dumps({**payload, 'id': request_id}, ensure_ascii=False) + "\n")
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                logging.error(f"Ошибка связи с хостом #{self.host_id}: {e}")
+                return None
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.error(f"Хост #{self.host_id} не ответил на {payload.get('cmd')} за {timeout} сек.")
+                    return None
+                try:
+                    line = self.replies.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if line is None:
+                    # Канал закрыт: маркер оставляем для следующих запросов
+                    self.replies.put(None)
+                    return None
+                try:
+                    response = json.loads(line)
+                except ValueError as e:
+                    logging.error(f"Хост #{self.host_id} прислал не JSON: {e}")
+                    continue
+                if response.get('id') != request_id:
+                    logging.warning(f"Хост #{self.host_id}: отброшен запоздавший ответ на команду #{response.get('id')}")
+                    continue
+                return response
+
+    def shutdown(self):
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=20)
+        except Exception:
+            self.process.kill()
+
+
+class BotHostPool:
+    def __init__(self, pool_size, max_tenants, max_tenant_starts):
+        self.pool_size = pool_size
+        self.max_tenants = max_tenants
+        self.max_tenant_starts = max_tenant_starts
+        self.hosts = []
+        self.placement = {}  # bot_id -> BotHost
+        self.lock = threading.Lock()
+        self.next_host_id = 1
+
+    def accepts(self, bot_type):
+        return BOT_HOST_MODE_ENABLED and bot_type in HOSTABLE_BOT_TYPES
+
+    def has_tenant(self, bot_id):
+        with self.lock:
+            return bot_id in self.placement
+
+    def _pick_host(self):
+        """Выбирает наименее загруженный живой хост, при нехватке места поднимает новый."""
+        self.hosts = [h for h in self.hosts if h.is_alive() or h.tenants]
+        serving = [h for h in self.hosts if h.is_alive() and not h.retiring]
+        candidates = [h for h in serving if len(h.tenants) < self.max_tenants]
+        if candidates:
+            return min(candidates, key=lambda h: len(h.tenants))
+        if len(serving) >= self.pool_size:
+            return None
+        host = BotHost(self.next_host_id)
+        self.next_host_id += 1
+        host.spawn()
+        self.hosts.append(host)
+        return host
+
+    def start_tenant(self, bot_id, script_path, env):
+        """Размещает бота на хосте. Возвращает pid хоста или None, если разместить не удалось."""
+        with self.lock:
+            try:
+                host = self._pick_host()
+            except Exception as e:
+                logging.error(f"Не удалось поднять хост ботов: {e}")
+                return None
+            if host is None:
+                return None
+            host.tenants.add(bot_id)
+            self.placement[bot_id] = host
+            host.tenant_starts += 1
+            if host.tenant_starts >= self.max_tenant_starts:
+                host.retiring = True
+                logging.info(f"Хост #{host.host_id} принял {host.tenant_starts} запусков и будет перезапущен, когда опустеет.")
+        response = host.request({'cmd': 'start', 'bot_id': bot_id, 'script': script_path, 'env': env}, timeout=120)
+        if response and response.get('ok'):
+            return host.pid
+        logging.error(f"Хост #{host.host_id} не запустил бота #{bot_id}: {(response or {}).get('error')}")
+        with self.lock:
+            host.tenants.discard(bot_id)
+            self.placement.pop(bot_id, None)
+        return None
+
+    def stop_tenant(self, bot_id):
+        with self.lock:
+            host = self.placement.pop(bot_id, None)
+            if host is None:
+                return False
+            # Модули остановленных тенантов остаются в памяти хоста, поэтому пустой хост
+            # перезапускаем. Помечаем его до остановки, под тем же замком: иначе параллельный
+            # start_tenant успеет поставить сюда нового бота, и shutdown молча убьет его
+            if host.tenants <= {bot_id}:
+                host.retiring = True
+        response = host.request({'cmd': 'stop', 'bot_id': bot_id}, timeout=60)
+        with self.lock:
+            host.tenants.discard(bot_id)
+            recycle = host.retiring and not host.tenants
+        if recycle:
+            host.shutdown()
+        return bool(response and response.get('ok'))
+
+    def is_tenant_alive(self, bot_id):
+        with self.lock:
+            host = self.placement.get(bot_id)
+        if host is None or not host.is_alive():
+            return False
+        status = host.request({'cmd': 'status'}, timeout=10)
+        if not status or not status.get('ok'):
+            return False
+        info = status.get('tenants', {}).get(str(bot_id))
+        return bool(info and info.get('alive'))
+
+    def host_of(self, bot_id):
+        with self.lock:
+            return self.placement.get(bot_id)
+
+    def reap(self):
+        """Сверяет тенантов с хостами: возвращает ID ботов, чьи тенанты или хосты умерли."""
+        dead_bot_ids = []
+        with self.lock:
+            hosts = list(self.hosts)
+        for host in hosts:
+            if not host.is_alive():
+                with self.lock:
+                    dead_bot_ids.extend(host.tenants)
+                    for bid in host.tenants:
+                        self.placement.pop(bid, None)
+                    host.tenants = set()
+                continue
+            status = host.request({'cmd': 'status'}, timeout=10)
+            if not status or not status.get('ok'):
+                continue
+            reported = status.get('tenants', {})
+            with self.lock:
+                for bid in list(host.tenants):
+                    info = reported.get(str(bid))
+                    if info is None or not info.get('alive'):
+                        dead_bot_ids.append(bid)
+                        host.tenants.discard(bid)
+                        self.placement.pop(bid, None)
+        return dead_bot_ids
+
+
+bot_host_pool = BotHostPool(BOT_HOST_POOL_SIZE, BOT_HOST_MAX_TENANTS, BOT_HOST_MAX_TENANT_STARTS)
+
+# -------------------- ЗИГОТА ДОЧЕРНИХ БОТОВ --------------------
+# bot_zygote.py держит импортированные зависимости и скомпилированные скрипты и
+# форкает готового ребенка на каждый запуск. Дети принадлежат зиготе, поэтому
+# супервизору они отдаются через ZygoteProcess с Popen-подобным poll().
+
+class ZygoteProcess:
+    def __init__(self, zygote, pid):
+        self.zygote = zygote
+        self.pid = pid
+
+    def poll(self):
+        return self.zygote.exit_code(self.pid)
+
+
+class BotZygote:
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+        self.children = {}  # pid -> bot_id
+        self.exited = {}  # pid -> exit_code
+        self.reaped_at = 0.0
+
+    @property
+    def enabled(self):
+        return BOT_ZYGOTE_ENABLED
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _ensure_running(self):
+        if self.is_alive():
+            return True
+        script_path = os.path.join(os.path.dirname(__file__), BOT_ZYGOTE_SCRIPT_NAME)
+        if not os.path.exists(script_path):
+            logging.error(f"Скрипт зиготы не найден: {BOT_ZYGOTE_SCRIPT_NAME}")
+            return False
+        os.makedirs('logs', exist_ok=True)
+        log_file = open("logs/zygote.log", "a", encoding='utf-8')
+        self.process = subprocess.Popen(
+            [sys.executable, script_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log_file,
+            text=True, encoding='utf-8', bufsize=1
+        )
+        log_file.close()
+        logging.info(f"Запущена зигота ботов (PID {self.process.pid}).")
+        # Прогреваем все известные скрипты заранее, чтобы первый запуск тоже был быстрым
+        for script_name in (REF_BOT_SCRIPT_NAME, STARS_BOT_SCRIPT_NAME, CLICKER_BOT_SCRIPT_NAME, ANONCHAT_BOT_SCRIPT_NAME,
+                            CASHLAIT_BOT_SCRIPT_NAME, DICELITE_BOT_SCRIPT_NAME, EXCHANGE_BOT_SCRIPT_NAME):
+            path = os.path.join(os.path.dirname(__file__), script_name)
+            if os.path.exists(path):
+                self._request({'cmd': 'preload', 'script': path}, timeout=120)
+        return True
+
+    def _request(self, payload, timeout=30):
+        try:
+            self.process.stdin.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            if not ready:
+                logging.error(f"Зигота не ответила на {payload.get('cmd')} за {timeout} сек.")
+                return None
+            line = self.process.stdout.readline()
+            return json.loads(line) if line else None
+        except (OSError, ValueError) as e:
+            logging.error(f"Ошибка связи с зиготой: {e}")
+            return None
+
+    def spawn(self, bot_id, script_path, env, log_path):
+        """Возвращает ZygoteProcess или None, если зигота недоступна."""
+        with self.lock:
+            if not self._ensure_running():
+                return None
+            response = self._request({'cmd': 'spawn', 'bot_id': bot_id, 'script': script_path, 'env': env, 'log': log_path})
+            if not response or not response.get('ok'):
+                logging.error(f"Зигота не запустила бота #{bot_id}: {response.get('error') if response else 'нет ответа'}")
+                return None
+            self.children[response['pid']] = bot_id
+            return ZygoteProcess(self, response['pid'])
+
+    def bot_of(self, pid):
+        return self.children.get(pid)
+
+    def exit_code(self, pid):
+        with self.lock:
+            if pid not in self.exited and self.is_alive() and time.monotonic() - self.reaped_at >= BOT_ZYGOTE_REAP_INTERVAL:
+                self.reaped_at = time.monotonic()
+                response = self._request({'cmd': 'reap'}, timeout=10)
+                for exited_pid, code in ((response or {}).get('exited') or {}).items():
+                    self.exited[int(exited_pid)] = code
+            if pid in self.exited:
+                self.children.pop(pid, None)
+                return self.exited.pop(pid)
+            if not self.is_alive() and not psutil.pid_exists(pid):
+                # Зигота умерла вместе с кодами выхода — знаем только, что процесса больше нет
+                self.children.pop(pid, None)
+                return -1
+            return None
+
+
+bot_zygote = BotZygote()
+
+# -------------------- ЛОГИ: РОТАЦИЯ, ИНДЕКС, ХВОСТ И ПОИСК --------------------
+# Дети пишут в logs/<source>.log через O_APPEND, поэтому ротация — copytruncate:
+# содержимое уходит в архивный сегмент, файл обрезается, и ребенок продолжает писать
+# с начала без переоткрытия. Сегмент — склейка gzip-членов по одному на блок, что
+# остается валидным .gz, а .idx хранит смещения и время каждого блока, чтобы хвост
+# и поиск по времени распаковывали только нужные блоки.
+
+LOG_LINE_TS_RE = re.compile(rb'^(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})')
+log_first_seen = {}  # path -> время, когда файл без меток времени впервые стал непустым
+
+def log_source_of(path):
+    return os.path.basename(path)[:-len('.log')] if path.endswith('.log') else os.path.basename(path)
+
+def log_source_path(source):
+    if f"{source}.log" in ROOT_LOG_FILES:
+        return f"{source}.log"
+    return os.path.join(LOG_DIR, f"{source}.log")
+
+def parse_log_line_ts(line):
+    match = LOG_LINE_TS_RE.match(line)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1).decode().replace('T', ' '), "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+def block_time_bounds(data):
+    """Время первой и последней строки блока с меткой времени (или None)."""
+    lines = data.splitlines()
+    first_ts = next((ts for ts in map(parse_log_line_ts, lines) if ts is not None), None)
+    last_ts = next((ts for ts in map(parse_log_line_ts, reversed(lines)) if ts is not None), None)
+    return first_ts, last_ts
+
+def load_log_segments(source):
+    segments = []
+    for idx_path in glob.glob(os.path.join(LOG_ARCHIVE_DIR, f"{glob.escape(source)}.*.log.gz.idx")):
+        try:
+            with open(idx_path, 'r', encoding='utf-8') as f:
+                segment = json.load(f)
+        except (OSError, ValueError):
+            continue
+        segment['path'] = idx_path[:-len('.idx')]
+        segments.append(segment)
+    segments.sort(key=lambda segment: segment.get('first_ts') or 0)
+    return segments
+
+def read_log_block(segment, block):
+    gz_offset, gz_length = block[0], block[1]
+    with open(segment['path'], 'rb') as f:
+        f.seek(gz_offset)
+        return gzip.decompress(f.read(gz_length))
+
+def rotate_log_file(path):
+    """Переносит активный лог в сжатый индексированный сегмент и обрезает его."""
+    source = log_source_of(path)
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    tmp_path = os.path.join(LOG_ARCHIVE_DIR, f"{source}.rotating.tmp")
+    blocks = []
+    raw_offset = 0
+    first_ts = last_ts = None
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        while True:
+            chunk = src.read(LOG_INDEX_BLOCK_BYTES)
+            if not chunk:
+                break
+            # Строка не должна разрываться между блоками
+            if not chunk.endswith(b'\n'):
+                chunk += src.readline()
+            block_first, block_last = block_time_bounds(chunk)
+            block_first = block_first or last_ts
+            block_last = block_last or block_first
+            gz_offset = dst.tell()
+            dst.write(gzip.compress(chunk, compresslevel=6))
+            blocks.append([gz_offset, dst.tell() - gz_offset, raw_offset, block_first, block_last])
+            raw_offset += len(chunk)
+            first_ts = first_ts or block_first
+            last_ts = block_last or last_ts
+        # Все, что ребенок успел дописать во время копирования, уже прочитано до EOF
+        os.truncate(path, 0)
+    if not blocks:
+        os.remove(tmp_path)
+        return None
+    now = time.time()
+    first_ts = first_ts or log_first_seen.get(path) or now
+    last_ts = last_ts or now
+    segment_path = os.path.join(LOG_ARCHIVE_DIR, f"{source}.{int(first_ts)}.log.gz")
+    suffix = 1
+    while os.path.exists(segment_path):
+        segment_path = os.path.join(LOG_ARCHIVE_DIR, f"{source}.{int(first_ts)}-{suffix}.log.gz")
+        suffix += 1
+    index = {
+        'source': source,
+        'first_ts': first_ts,
+        'last_ts': last_ts,
+        'raw_bytes': raw_offset,
+        'gz_bytes': os.path.getsize(tmp_path),
+        'blocks': blocks,
+    }
+    with open(f"{segment_path}.idx", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, segment_path)
+    log_first_seen.pop(path, None)
+    prune_log_archives(source)
+    return segment_path
+
+def prune_log_archives(source):
+    segments = load_log_segments(source)
+    cutoff = time.time() - LOG_RETENTION_SECONDS
+    excess = len(segments) - LOG_RETENTION_SEGMENTS
+    for position, segment in enumerate(segments):
+        if position < excess or (segment.get('last_ts') or 0) < cutoff:
+            for target in (segment['path'], f"{segment['path']}.idx"):
+                try:
+                    os.remove(target)
+                except FileNotFoundError:
+                    pass
+
+def delete_log_archives(source):
+    for segment in load_log_segments(source):
+        for target in (segment['path'], f"{segment['path']}.idx"):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+
+def log_needs_rotation(path):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if size == 0:
+        log_first_seen.pop(path, None)
+        return False
+    if size >= LOG_ROTATE_MAX_BYTES:
+        return True
+    with open(path, 'rb') as f:
+        first_ts, _ = block_time_bounds(f.read(4096))
+    if first_ts is None:
+        first_ts = log_first_seen.setdefault(path, time.time())
+    return time.time() - first_ts >= LOG_ROTATE_MAX_AGE_SECONDS
+
+def rotate_logs():
+    rotated = 0
+    for path in glob.glob(os.path.join(LOG_DIR, '*.log')) + list(ROOT_LOG_FILES):
+        try:
+            if log_needs_rotation(path) and rotate_log_file(path):
+                rotated += 1
+        except OSError as e:
+            logging.error(f"Не удалось ротировать лог {path}: {e}")
+    return rotated
+
+def log_rotation_worker():
+    while True:
+        try:
+            rotated = rotate_logs()
+            if rotated:
+                logging.info(f"Ротация логов: заархивировано сегментов {rotated}.")
+        except Exception as e:
+            logging.error(f"Ошибка в воркере ротации логов: {e}")
+        time.sleep(LOG_ROTATE_CHECK_INTERVAL_SECONDS)
+
+def tail_log(source, max_bytes=LOG_TAIL_DEFAULT_BYTES, lines=None):
+    """Последние max_bytes лога: конец активного файла и, если его не хватает, последние
+    блоки архивных сегментов. Возвращает None, если у источника нет ни файла, ни архива."""
+    parts = []
+    found = False
+    need = max_bytes
+    # Начинаются ли собранные данные с начала строки: блоки архива всегда режутся по строкам
+    starts_at_line = True
+    try:
+        with open(log_source_path(source), 'rb') as f:
+            found = True
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            start = max(0, size - need)
+            if start:
+                f.seek(start - 1)
+                starts_at_line = f.read(1) == b'\n'
+            f.seek(start)
+            data = f.read()
+            parts.append(data)
+            need -= len(data)
+    except OSError:
+        pass
+    if need > 0:
+        for segment in reversed(load_log_segments(source)):
+            found = True
+            for block in reversed(segment['blocks']):
+                data = read_log_block(segment, block)
+                parts.insert(0, data)
+                starts_at_line = True
+                need -= len(data)
+                if need <= 0:
+                    break
+            if need <= 0:
+                break
+    if not found:
+        return None
+    data = b''.join(parts)
+    truncated = len(data) > max_bytes or not starts_at_line
+    text = data[-max_bytes:].decode('utf-8', errors='replace')
+    if truncated:
+        # Первая строка обрезана посередине
+        text = text.split('\n', 1)[-1]
+    if lines:
+        text = "\n".join(text.splitlines()[-lines:])
+    return text
+
+def find_log_offset(f, size, since):
+    """Бинарный поиск в активном файле: смещение не позже первой строки с ts >= since."""
+    low, high = 0, size
+    while high - low > LOG_INDEX_BLOCK_BYTES:
+        middle = (low + high) // 2
+        f.seek(middle)
+        f.readline()
+        ts = None
+        for _ in range(64):
+            line = f.readline()
+            if not line:
+                break
+            ts = parse_log_line_ts(line)
+            if ts is not None:
+                break
+        if ts is None or ts >= since:
+            high = middle
+        else:
+            low = middle
+    return low
+
+def search_log(source, since=None, until=None, needle=None, max_bytes=LOG_EXPORT_MAX_BYTES):
+    """Строки лога за интервал [since, until] (unix-время), опционально содержащие needle.
+
+    Архивные блоки, не пересекающие интервал, не распаковываются; в активном файле
+    начало интервала ищется бинарным поиском. Строка без метки времени относится
+    ко времени предыдущей строки."""
+    needle_bytes = needle.encode('utf-8') if needle else None
+    result = []
+    collected = 0
+
+    def overlaps(first_ts, last_ts):
+        if since is not None and last_ts is not None and last_ts < since:
+            return False
+        if until is not None and first_ts is not None and first_ts > until:
+            return False
+        return True
+
+    def consume(data, current_ts):
+        nonlocal collected
+        for line in data.splitlines():
+            ts = parse_log_line_ts(line)
+            if ts is not None:
+                current_ts = ts
+            if since is not None and (current_ts is None or current_ts < since):
+                continue
+            if until is not None and current_ts is not None and current_ts > until:
+                return current_ts, True
+            if needle_bytes and needle_bytes not in line:
+                continue
+            result.append(line)
+            collected += len(line) + 1
+            if collected >= max_bytes:
+                return current_ts, True
+        return current_ts, False
+
+    current_ts = None
+    for segment in load_log_segments(source):
+        if not overlaps(segment.get('first_ts'), segment.get('last_ts')):
+            continue
+        for block in segment['blocks']:
+            if not overlaps(block[3], block[4]):
+                continue
+            current_ts, done = consume(read_log_block(segment, block), block[3])
+            if done:
+                return b"\n".join(result).decode('utf-8', errors='replace')
+    try:
+        with open(log_source_path(source), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            start = find_log_offset(f, size, since) if since is not None else 0
+            f.seek(start)
+            if start:
+                f.readline()
+            while True:
+                data = f.read(LOG_INDEX_BLOCK_BYTES)
+                if not data:
+                    break
+                if not data.endswith(b'\n'):
+                    data += f.readline()
+                current_ts, done = consume(data, current_ts)
+                if done:
+                    break
+    except OSError:
+        pass
+    return b"\n".join(result).decode('utf-8', errors='replace')
+
+def export_log_document(source, caption_name=None):
+    """Хвост лога (до LOG_EXPORT_MAX_BYTES) как документ для send_document или None."""
+    text = tail_log(source, max_bytes=LOG_EXPORT_MAX_BYTES)
+    if text is None:
+        return None
+    return types.InputFile(io.BytesIO(text.encode('utf-8')), file_name=caption_name or f"{source}.log")
+
+LOG_QUERY_DURATION_RE = re.compile(r'^(\d+)([mhd])$')
+LOG_QUERY_DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def parse_log_query(text):
+    """Запрос логов из админки: "<ID> [период] [текст]".
+
+    Период — 30m / 6h / 2d (последние N минут/часов/дней) или интервал
+    2025-01-31T10:00..2025-01-31T12:00 в местном времени, как метки в логах.
+    Возвращает (bot_id, since, until, needle); ValueError при неверном ID или дате.
+    """
+    tokens = (text or '').split(maxsplit=2)
+    if not tokens:
+        raise ValueError("пустой запрос")
+    bot_id = int(tokens[0])
+    since = until = None
+    rest = tokens[1:]
+    if rest:
+        duration = LOG_QUERY_DURATION_RE.match(rest[0])
+        if duration:
+            since = time.time() - int(duration.group(1)) * LOG_QUERY_DURATION_UNITS[duration.group(2)]
+            rest = rest[1:]
+        elif '..' in rest[0]:
+            start_text, end_text = rest[0].split('..', 1)
+            since = datetime.strptime(start_text, "%Y-%m-%dT%H:%M").timestamp()
+            until = datetime.strptime(end_text, "%Y-%m-%dT%H:%M").timestamp() + 59
+            rest = rest[1:]
+    needle = " ".join(rest).strip() or None
+    return bot_id, since, until, needle
+
+def search_log_document(source, since=None, until=None, needle=None):
+    """Строки search_log как документ для send_document или None, если ничего не найдено."""
+    text = search_log(source, since=since, until=until, needle=needle)
+    if not text:
+        return None
+    return types.InputFile(io.BytesIO(text.encode('utf-8')), file_name=f"{source}.search.log")
+
+# -------------------- СУПЕРВИЗОР ДОЧЕРНИХ ПРОЦЕССОВ --------------------
+# Конструктор держит Popen каждого запущенного бота. SIGCHLD будит поток супервизора,
+# тот забирает код выхода через poll() (waitpid конкретного pid), пишет событие
+# в bot_process_events и перезапускает упавшего бота с экспоненциальной задержкой.
+
+def read_log_tail(path, lines=SUPERVISOR_LOG_TAIL_LINES, max_bytes=16384):
+    return tail_log(log_source_of(path), max_bytes=max_bytes, lines=lines)
+
+def record_bot_process_event(bot_id, event, pid=None, exit_code=None, uptime_seconds=None, log_tail=None, details=None):
+    db_execute(
+        "INSERT INTO bot_process_events (bot_id, event, pid, exit_code, uptime_seconds, log_tail, details, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (bot_id, event, pid, exit_code, uptime_seconds, log_tail, details, int(time.time())),
+        commit=True
+    )
+
+class BotSupervisor:
+    def __init__(self):
+        self.processes = {}  # bot_id -> (Popen, started_at)
+        self.tenants = {}  # bot_id -> (host_pid, host_id, started_at)
+        self.expected_exits = {}  # pid процесса, остановленного вручную -> до какого времени (monotonic) ждать его выхода
+        self.crash_history = {}  # bot_id -> [время падения, ...]
+        self.pending_restarts = {}  # bot_id -> threading.Timer
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def track_process(self, bot_id, process):
+        with self.lock:
+            self.processes[bot_id] = (process, time.time())
+
+    def track_tenant(self, bot_id, host_pid):
+        host = bot_host_pool.host_of(bot_id)
+        with self.lock:
+            self.tenants[bot_id] = (host_pid, host.host_id if host else None, time.time())
+
+    def expect_exit(self, bot_id, pid):
+        with self.lock:
+            # У тенанта pid — это pid общего хоста, его выход к остановке бота не относится
+            if pid and self.tenants.pop(bot_id, None) is None:
+                self.expected_exits[pid] = time.monotonic() + SUPERVISOR_EXPECTED_EXIT_TTL_SECONDS
+            self.evict_expected_exits()
+            timer = self.pending_restarts.pop(bot_id, None)
+        if timer:
+            timer.cancel()
+
+    def evict_expected_exits(self):
+        """Удаляет просроченные ожидания выхода. Зовется под self.lock."""
+        now = time.monotonic()
+        for pid in [pid for pid, deadline in self.expected_exits.items() if deadline <= now]:
+            del self.expected_exits[pid]
+
+    def on_sigchld(self, signum, frame):
+        # В обработчике сигнала только будим поток — вся работа идет вне него
+        self.wakeup.set()
+
+    def install_signal_handler(self):
+        if hasattr(signal, 'SIGCHLD') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGCHLD, self.on_sigchld)
+            return True
+        return False
+
+    def run(self):
+        logging.info("Супервизор дочерних процессов запущен.")
+        self.reconcile_untracked()
+        while True:
+            signaled = self.wakeup.wait(SUPERVISOR_FALLBACK_INTERVAL_SECONDS)
+            self.wakeup.clear()
+            try:
+                self.reap_processes()
+                self.reap_tenants()
+                if not signaled:
+                    self.reconcile_untracked()
+            except Exception as e:
+                logging.error(f"Ошибка в супервизоре дочерних процессов: {e}", exc_info=True)
+
+    def reap_processes(self):
+        with self.lock:
+            snapshot = list(self.processes.items())
+        for bot_id, (process, started_at) in snapshot:
+            exit_code = process.poll()
+            if exit_code is None:
+                continue
+            with self.lock:
+                if self.processes.get(bot_id, (None,))[0] is process:
+                    del self.processes[bot_id]
+            self.handle_exit(bot_id, process.pid, exit_code, started_at, f"logs/bot_{bot_id}.log")
+
+    def reap_tenants(self):
+        for bot_id in bot_host_pool.reap():
+            with self.lock:
+                host_pid, host_id, started_at = self.tenants.pop(bot_id, (None, None, time.time()))
+            log_path = f"logs/host_{host_id}.log" if host_id is not None else None
+            self.handle_exit(bot_id, host_pid, None, started_at, log_path)
+
+    def reconcile_untracked(self):
+        """Боты, запущенные прошлым экземпляром конструктора, не наши дети — их проверяем по pid."""
+        running_bots = db_execute("SELECT id, pid, start_time FROM bots WHERE status = 'running' AND pid IS NOT NULL", fetchall=True) or []
+        with self.lock:
+            tracked = set(self.processes) | set(self.tenants)
+        for row in running_bots:
+            if row['id'] in tracked or bot_host_pool.has_tenant(row['id']):
+                continue
+            if psutil.pid_exists(row['pid']):
+                continue
+            logging.warning(f"Процесс бота ID: {row['id']} (PID: {row['pid']}) не найден. Сбрасываю статус.")
+            self.handle_exit(row['id'], row['pid'], None, row['start_time'] or time.time(), f"logs/bot_{row['id']}.log")
+
+    def handle_exit(self, bot_id, pid, exit_code, started_at, log_path):
+        uptime = int(time.time() - started_at)
+        with self.lock:
+            self.evict_expected_exits()
+            expected = self.expected_exits.pop(pid, None) is not None
+        log_tail = read_log_tail(log_path) if log_path else None
+        if expected:
+            record_bot_process_event(bot_id, 'stopped', pid, exit_code, uptime, log_tail)
+            return
+        logging.warning(f"Бот #{bot_id} (PID {pid}) завершился с кодом {exit_code} после {uptime} сек. работы.")
+        record_bot_process_event(bot_id, 'crashed', pid, exit_code, uptime, log_tail)
+        # Статус сбрасываем только если в БД все еще этот процесс, а не уже новый запуск
+        db_execute("UPDATE bots SET status = 'stopped', pid = NULL, start_time = NULL WHERE id = ? AND status = 'running' AND pid = ?",
+                   (bot_id, pid), commit=True)
+        bot_info_cache.invalidate(bot_id)
+        refresh_bot_catalogue([bot_id])
+        self.schedule_restart(bot_id, uptime)
+
+    def schedule_restart(self, bot_id, uptime):
+        now = time.time()
+        with self.lock:
+            history = self.crash_history.get(bot_id, [])
+            if uptime >= SUPERVISOR_STABLE_UPTIME_SECONDS:
+                history = []
+            history = [ts for ts in history if now - ts < SUPERVISOR_CRASH_LOOP_WINDOW_SECONDS] + [now]
+            crash_loop = len(history) >= SUPERVISOR_CRASH_LOOP_LIMIT
+            self.crash_history[bot_id] = [] if crash_loop else history
+        if crash_loop:
+            logging.error(f"Бот #{bot_id} упал {len(history)} раз за {SUPERVISOR_CRASH_LOOP_WINDOW_SECONDS} сек. Автоперезапуск отключен.")
+            record_bot_process_event(bot_id, 'crash_loop', details=f"{len(history)} падений за {SUPERVISOR_CRASH_LOOP_WINDOW_SECONDS} сек.")
+            try:
+                bot.send_message(ADMIN_ID, f"⚠️ Бот #{bot_id} постоянно падает ({len(history)} раз за {SUPERVISOR_CRASH_LOOP_WINDOW_SECONDS // 60} мин.). Автоперезапуск отключен, проверьте логи.")
+            except Exception as e:
+                logging.warning(f"Не удалось уведомить админа о цикле падений бота #{bot_id}: {e}")
+            return
+        delay = min(SUPERVISOR_RESTART_BASE_DELAY * 2 ** (len(history) - 1), SUPERVISOR_RESTART_MAX_DELAY)
+        timer = threading.Timer(delay, self.restart, args=(bot_id,))
+        timer.daemon = True
+        with self.lock:
+            previous = self.pending_restarts.pop(bot_id, None)
+            self.pending_restarts[bot_id] = timer
+        if previous:
+            previous.cancel()
+        logging.info(f"Бот #{bot_id} будет перезапущен через {delay} сек.")
+        timer.start()
+
+    def restart(self, bot_id):
+        with self.lock:
+            self.pending_restarts.pop(bot_id, None)
+        bot_info = get_bot_by_id(bot_id)
+        if not bot_info or bot_info['status'] == 'running':
+            return
+        success, message = start_bot_process(bot_id)
+        record_bot_process_event(bot_id, 'restarted' if success else 'restart_failed', details=message)
+        if not success:
+            logging.error(f"Автоперезапуск бота #{bot_id} не удался: {message}")
+
+
+bot_supervisor = BotSupervisor()
+
+# -------------------- МАССОВЫЙ ЗАПУСК / ПЕРЕЗАПУСК --------------------
+# Задание и его позиции лежат в mass_jobs/mass_job_items, поэтому после рестарта
+# конструктора незавершенные задания продолжаются с необработанных ботов.
+
+MASS_JOB_TITLES = {
+    'restart': "Массовый перезапуск",
+    'start': "Массовый запуск",
+}
+
+active_mass_jobs = set()
+active_mass_jobs_lock = threading.Lock()
+mass_job_admission_lock = threading.Lock()
+
+def create_mass_job(kind, admin_id, f_count, progress_message_id=None):
+    status_filter = "b.status = 'running'" if kind == 'restart' else "b.status != 'running'"
+    bots_rows = db_execute(
+        "SELECT b.id FROM bots b LEFT JOIN bot_user_counts c ON c.bot_id = b.id "
+        f"WHERE {status_filter} AND (? <= 0 OR COALESCE(c.user_count, 0) >= ?) ORDER BY b.id",
+        (f_count, f_count), fetchall=True
+    ) or []
+    if not bots_rows:
+        return None, 0
+    now_ts = int(time.time())
+    with db_lock:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO mass_jobs (kind, admin_id, filter_count, status, total, progress_message_id, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'running', ?, ?, ?, ?)",
+            (kind, admin_id, f_count, len(bots_rows), progress_message_id, now_ts, now_ts)
+        )
+        job_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO mass_job_items (job_id, bot_id) VALUES (?, ?)", [(job_id, r['id']) for r in bots_rows])
+        conn.commit()
+    return job_id, len(bots_rows)
+
+def wait_for_admission():
+    """Пускает следующий запуск только пока CPU и RAM хоста ниже порогов."""
+    deadline = time.time() + MASS_JOB_ADMISSION_TIMEOUT_SECONDS
+    with mass_job_admission_lock:
+        while time.time() < deadline:
+            cpu = psutil.cpu_percent(interval=None)
+            ram = psutil.virtual_memory().percent
+            if cpu < MASS_JOB_MAX_CPU_PERCENT and ram < MASS_JOB_MAX_RAM_PERCENT:
+                return True
+            time.sleep(1)
+    return False
+
+def is_bot_process_alive(bot_id, pid):
+    if bot_host_pool.has_tenant(bot_id):
+        return bot_host_pool.is_tenant_alive(bot_id)
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+def wait_for_process_exit(pid, timeout=5):
+    try:
+        psutil.Process(pid).wait(timeout=timeout)
+    except (psutil.NoSuchProcess, psutil.TimeoutExpired, ChildProcessError):
+        pass
+
+def probe_bot_ready(bot_id):
+    """Проверка после запуска: процесс (или тенант хоста) прожил MASS_JOB_READY_GRACE_SECONDS
+    и токен бота отвечает на getMe. Возвращает (успех, причина отказа)."""
+    deadline = time.time() + MASS_JOB_READY_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        info = get_bot_by_id(bot_id)
+        if not info or info['status'] != 'running' or not info['pid']:
+            return False, "процесс не запущен"
+        if not is_bot_process_alive(bot_id, info['pid']):
+            update_bot_process_info(bot_id, 'stopped', None, None)
+            return False, f"процесс завершился в первые {MASS_JOB_READY_GRACE_SECONDS} сек."
+        if time.time() - (info['start_time'] or 0) >= MASS_JOB_READY_GRACE_SECONDS:
+            break
+        time.sleep(0.5)
+    else:
+        return False, f"процесс не прожил {MASS_JOB_READY_GRACE_SECONDS} сек. за {MASS_JOB_READY_TIMEOUT_SECONDS} сек."
+    # Жив процесс — еще не значит, что бот работает: отозванный токен роняет только polling
+    try:
+        telebot.TeleBot(info['bot_token'], threaded=False).get_me()
+    except Exception as e:
+        return False, f"токен не отвечает на getMe: {e}"
+    return True, None
+
+def process_mass_job_item(kind, bot_id):
+    if kind == 'restart':
+        info = get_bot_by_id(bot_id)
+        old_pid = info['pid'] if info else None
+        hosted = bot_host_pool.has_tenant(bot_id)
+        stop_bot_process(bot_id)
+        if old_pid and not hosted:
+            wait_for_process_exit(old_pid)
+    if not wait_for_admission():
+        return False, "нет свободных ресурсов"
+    success, message = start_bot_process(bot_id)
+    if not success:
+        return False, message
+    return probe_bot_ready(bot_id)
+
+class ThrottledProgressMessage:
+    """Редактирует одно сообщение с прогрессом не чаще раза в MASS_JOB_PROGRESS_INTERVAL_SECONDS.
+
+    Если сообщение отредактировать нельзя, отправляет новое и сообщает его id через on_new_message.
+    """
+
+    def __init__(self, admin_id, message_id, on_new_message=None):
+        self.admin_id = admin_id
+        self.message_id = message_id
+        self.on_new_message = on_new_message
+        self.last_update = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, text, force=False, reply_markup=None):
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_update < MASS_JOB_PROGRESS_INTERVAL_SECONDS:
+                return
+            self.last_update = now
+            self._render(text, reply_markup)
+
+    def _render(self, text, reply_markup):
+        try:
+            if self.message_id:
+                bot.edit_message_text(text, self.admin_id, self.message_id, reply_markup=reply_markup)
+                return
+        except telebot.apihelper.ApiTelegramException as e:
+            if 'message is not modified' in str(e):
+                return
+        except Exception as e:
+            # Сетевой сбой: пропускаем это обновление, следующее снова попробует отредактировать
+            logging.warning(f"Не удалось обновить сообщение с прогрессом: {e}")
+            return
+        try:
+            msg = bot.send_message(self.admin_id, text, reply_markup=reply_markup)
+            self.message_id = msg.message_id
+            if self.on_new_message:
+                self.on_new_message(msg.message_id)
+        except Exception as e:
+            logging.warning(f"Не удалось обновить сообщение с прогрессом: {e}")
+
+def fail_job(table, job_id, job, progress, text):
+    """Общий путь падения фонового задания из JOB_TABLES.
+
+    Строка задания переводится из 'running' в 'failed' с текстом ошибки — иначе задание
+    повторялось бы при каждом запуске конструктора и блокировало новые. Админу сообщение
+    с прогрессом правится на text (или приходит новое). Зовется из блока except.
+    """
+    error = sys.exc_info()[1]
+    logging.error(f"Критическая ошибка задания {table} #{job_id}: {error}", exc_info=True)
+    now_ts = int(time.time())
+    finished_at = ", finished_at = ?" if table == 'broadcast_jobs' else ""
+    try:
+        db_execute(
+            f"UPDATE {table} SET status = 'failed', error = ?, updated_at = ?{finished_at} WHERE id = ? AND status = 'running'",
+            (str(error)[:500], now_ts, *((now_ts,) if finished_at else ()), job_id), commit=True
+        )
+    except Exception as db_error:
+        logging.error(f"Не удалось отметить задание {table} #{job_id} как прерванное: {db_error}")
+    if not job:
+        return
+    progress = progress or ThrottledProgressMessage(job['admin_id'], job['progress_message_id'])
+    try:
+        progress.update(
+            text, force=True,
+            reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
+        )
+    except Exception as e:
+        logging.warning(f"Не удалось сообщить админу {progress.admin_id} о сбое задания {table} #{job_id}: {e}")
+
+def run_mass_job(job_id):
+    with active_mass_jobs_lock:
+        if job_id in active_mass_jobs:
+            return
+        active_mass_jobs.add(job_id)
+    job = None
+    progress = None
+    try:
+        job = row_to_dict(db_execute("SELECT * FROM mass_jobs WHERE id = ?", (job_id,), fetchone=True))
+        if not job or job['status'] != 'running':
+            return
+        kind = job['kind']
+        title = MASS_JOB_TITLES.get(kind, kind)
+        pending = [r['bot_id'] for r in db_execute(
+            "SELECT bot_id FROM mass_job_items WHERE job_id = ? AND state = 'pending' ORDER BY bot_id", (job_id,), fetchall=True
+        ) or []]
+        counters = {'ok': job['ok_count'] or 0, 'fail': job['fail_count'] or 0}
+        total = job['total'] or 0
+        progress = ThrottledProgressMessage(
+            job['admin_id'], job['progress_message_id'],
+            lambda message_id: db_execute("UPDATE mass_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id), commit=True)
+        )
+        started_at = time.time()
+        psutil.cpu_percent(interval=None)  # первый вызов только задает точку отсчета
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MASS_JOB_WORKERS) as executor:
+            futures = {executor.submit(process_mass_job_item, kind, bot_id): bot_id for bot_id in pending}
+            for future in concurrent.futures.as_completed(futures):
+                bot_id = futures[future]
+                try:
+                    success, error = future.result()
+                except Exception as e:
+                    logging.error(f"Ошибка при обработке бота {bot_id} в задании #{job_id}: {e}")
+                    success, error = False, str(e)
+                counters['ok' if success else 'fail'] += 1
+                with db_lock:
+                    conn.execute("UPDATE mass_job_items SET state = ?, error = ? WHERE job_id = ? AND bot_id = ?",
+                                 ('ok' if success else 'failed', error, job_id, bot_id))
+                    conn.execute("UPDATE mass_jobs SET ok_count = ?, fail_count = ?, updated_at = ? WHERE id = ?",
+                                 (counters['ok'], counters['fail'], int(time.time()), job_id))
+                    conn.commit()
+                processed = counters['ok'] + counters['fail']
+                progress.update(f"🚀 {title}: {processed}/{total}\n\n👍 Успешно: {counters['ok']}\n👎 С ошибками: {counters['fail']}")
+
+        db_execute("UPDATE mass_jobs SET status = 'done', updated_at = ? WHERE id = ?", (int(time.time()), job_id), commit=True)
+        progress.update(
+            f"✅ {title} завершен за {time.time() - started_at:.1f} сек.\n\n"
+            f"👍 Успешно: {counters['ok']}\n"
+            f"👎 С ошибками: {counters['fail']}",
+            force=True,
+            reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
+        )
+    except Exception as e:
+        fail_job('mass_jobs', job_id, job, progress,
+                 f"❌ {MASS_JOB_TITLES.get(job['kind'], job['kind'])} прерван: {e}" if job else "")
+    finally:
+        with active_mass_jobs_lock:
+            active_mass_jobs.discard(job_id)
+
+def start_mass_job(kind, admin_id, f_count, progress_message_id=None):
+    job_id, total = create_mass_job(kind, admin_id, f_count, progress_message_id)
+    if not job_id:
+        return None
+    threading.Thread(target=run_mass_job, args=(job_id,), daemon=True).start()
+    return job_id
+
+def resume_mass_jobs():
+    jobs = db_execute("SELECT id, kind FROM mass_jobs WHERE status = 'running'", fetchall=True) or []
+    for job in jobs:
+        logging.info(f"Продолжаю незавершенное задание #{job['id']} ({job['kind']}).")
+        threading.Thread(target=run_mass_job, args=(job['id'],), daemon=True).start()
+
+# -------------------- РАССЫЛКА ПО ДОЧЕРНИМ БОТАМ --------------------
+# Каждый бот шлет своим пользователям через собственный токен со своим ведром токенов,
+# несколько ботов идут параллельно. Пользователи читаются из БД бота пачками по user_id,
+# курсор сохраняется в bots_broadcast_progress каждые BOTS_BROADCAST_CHECKPOINT_EVERY
+# получателей.
+
+BROADCAST_MEDIA_METHODS = {
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'animation': 'send_animation',
+    'document': 'send_document',
+    'audio': 'send_audio',
+    'voice': 'send_voice',
+    'sticker': 'send_sticker',
+}
+
+active_bots_broadcast_jobs = set()
+active_bots_broadcast_jobs_lock = threading.Lock()
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду (на токен бота, ключ API и т.п.)."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _try_take(self):
+        """Берет токен и возвращает 0 либо возвращает, сколько ждать до следующего."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._try_take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._try_take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """После 429 ведро уходит в минус ровно на retry_after секунд."""
+        with self.lock:
+            self.tokens = -float(seconds) * self.rate
+            self.updated = time.monotonic()
+
+def classify_send_error(exc):
+    """Возвращает (вид ошибки, retry_after): blocked, deleted, flood, retry или failed."""
+    if isinstance(exc, telebot.apihelper.ApiTelegramException):
+        code = exc.error_code
+        description = str(exc.description or '').lower()
+        if code == 429:
+            parameters = (exc.result_json or {}).get('parameters') or {}
+            return 'flood', parameters.get('retry_after') or 5
+        if code == 403:
+            return 'blocked', None
+        if code == 400 and any(marker in description for marker in ('chat not found', 'user not found', 'deactivated')):
+            return 'deleted', None
+        if code >= 500:
+            return 'retry', None
+        return 'failed', None
+    # Сетевые ошибки requests и прочее — пробуем еще раз
+    return 'retry', None
+
+def build_broadcast_payload(message):
+    """Снимает контент сообщения в словарь, который можно отправить чужим токеном."""
+    content_type = message.content_type
+    if content_type == 'text':
+        return {'type': 'text', 'text': message.html_text}
+    if content_type not in BROADCAST_MEDIA_METHODS:
+        return None
+    media = message.photo[-1] if content_type == 'photo' else getattr(message, content_type)
+    return {
+        'type': content_type,
+        'file_id': media.file_id,
+        'file_name': getattr(media, 'file_name', None),
+        'caption': message.html_caption,
+    }
+
+class ChildBotSender:
+    """Отправка контента рассылки от имени дочернего бота.
+
+    file_id конструктора чужому боту недоступен, поэтому медиа загружается байтами
+    один раз, а дальше переиспользуется file_id, который вернул Telegram этому боту.
+    """
+
+    def __init__(self, token, payload, media_bytes, reply_markup):
+        self.client = telebot.TeleBot(token, threaded=False)
+        self.payload = payload
+        self.media_bytes = media_bytes
+        self.reply_markup = reply_markup
+        self.file_id = None
+
+    def send(self, chat_id):
+        content_type = self.payload['type']
+        if content_type == 'text':
+            self.client.send_message(chat_id, self.payload['text'], parse_mode="HTML", reply_markup=self.reply_markup)
+            return
+        media = self.file_id
+        if media is None:
+            media = io.BytesIO(self.media_bytes)
+            media.name = self.payload.get('file_name') or content_type
+        kwargs = {'reply_markup': self.reply_markup}
+        if content_type != 'sticker' and self.payload.get('caption'):
+            kwargs['caption'] = self.payload['caption']
+            kwargs['parse_mode'] = "HTML"
+        sent = getattr(self.client, BROADCAST_MEDIA_METHODS[content_type])(chat_id, media, **kwargs)
+        if self.file_id is None:
+            sent_media = getattr(sent, content_type, None)
+            if content_type == 'photo' and sent_media:
+                sent_media = sent_media[-1]
+            self.file_id = getattr(sent_media, 'file_id', None)
+
+def deliver_with_retries(sender, bucket, chat_id):
+    attempt = 0
+    while attempt < BOTS_BROADCAST_MAX_ATTEMPTS:
+        bucket.acquire()
+        try:
+            sender.send(chat_id)
+            return 'sent'
+        except Exception as e:
+            kind, retry_after = classify_send_error(e)
+            if kind in ('blocked', 'deleted'):
+                return 'blocked'
+            if kind == 'flood':
+                # Ожидание по 429 не считаем попыткой
+                bucket.pause(retry_after)
+                continue
+            if kind == 'failed':
+                return 'failed'
+            attempt += 1
+            time.sleep(2 ** attempt)
+    return 'failed'
+
+def create_bots_broadcast_job(admin_id, bot_ids, payload, reply_markup, progress_message_id):
+    now_ts = int(time.time())
+    markup_json = reply_markup.to_json() if reply_markup else None
+    with db_lock:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO bots_broadcast_jobs (admin_id, status, payload, reply_markup, progress_message_id, created_at, updated_at) "
+            "VALUES (?, 'running', ?, ?, ?, ?, ?)",
+            (admin_id, json.dumps(payload, ensure_ascii=False), markup_json, progress_message_id, now_ts, now_ts)
+        )
+        job_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO bots_broadcast_progress (job_id, bot_id) VALUES (?, ?)", [(job_id, bid) for bid in bot_ids])
+        conn.commit()
+    return job_id
+
+def has_running_bots_broadcast():
+    return db_execute("SELECT 1 FROM bots_broadcast_jobs WHERE status = 'running' LIMIT 1", fetchone=True) is not None
+
+def broadcast_to_child_bot(job_id, bot_id, payload, media_bytes, reply_markup, totals, on_progress):
+    info = db_execute("SELECT bot_token, bot_type FROM bots WHERE id = ?", (bot_id,), fetchone=True)
+    db_filename = get_child_bot_db_path(bot_id, info['bot_type']) if info else None
+    if not info or not info['bot_token'] or not os.path.exists(db_filename):
+        db_execute("UPDATE bots_broadcast_progress SET done = 1, error = ? WHERE job_id = ? AND bot_id = ?",
+                   ("нет токена или БД", job_id, bot_id), commit=True)
+        return False
+    progress_row = db_execute("SELECT last_user_id FROM bots_broadcast_progress WHERE job_id = ? AND bot_id = ?", (job_id, bot_id), fetchone=True)
+    last_user_id = progress_row['last_user_id'] or 0
+    sender = ChildBotSender(info['bot_token'], payload, media_bytes, reply_markup)
+    bucket = TokenBucket(BOTS_BROADCAST_RATE_PER_SECOND)
+    child_conn = sqlite3.connect(f'file:{db_filename}?mode=ro', uri=True)
+    try:
+        while True:
+            chunk = [r[0] for r in child_conn.execute(
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last_user_id, BOTS_BROADCAST_CHUNK_SIZE)
+            ).fetchall()]
+            if not chunk:
+                break
+            for start in range(0, len(chunk), BOTS_BROADCAST_CHECKPOINT_EVERY):
+                batch = chunk[start:start + BOTS_BROADCAST_CHECKPOINT_EVERY]
+                batch_counts = {'sent': 0, 'blocked': 0, 'failed': 0}
+                for user_id in batch:
+                    outcome = deliver_with_retries(sender, bucket, user_id)
+                    batch_counts[outcome] += 1
+                    with totals['lock']:
+                        totals[outcome] += 1
+                    on_progress()
+                last_user_id = batch[-1]
+                db_execute(
+                    "UPDATE bots_broadcast_progress SET last_user_id = ?, sent = sent + ?, blocked = blocked + ?, failed = failed + ? "
+                    "WHERE job_id = ? AND bot_id = ?",
+                    (last_user_id, batch_counts['sent'], batch_counts['blocked'], batch_counts['failed'], job_id, bot_id),
+                    commit=True
+                )
+    finally:
+        child_conn.close()
+    db_execute("UPDATE bots_broadcast_progress SET done = 1 WHERE job_id = ? AND bot_id = ?", (job_id, bot_id), commit=True)
+    return True
+
+def run_bots_broadcast_job(job_id):
+    with active_bots_broadcast_jobs_lock:
+        if job_id in active_bots_broadcast_jobs:
+            return
+        active_bots_broadcast_jobs.add(job_id)
+    job = None
+    progress = None
+    try:
+        job = row_to_dict(db_execute("SELECT * FROM bots_broadcast_jobs WHERE id = ?", (job_id,), fetchone=True))
+        if not job or job['status'] != 'running':
+            return
+        payload = json.loads(job['payload'])
+        reply_markup = types.InlineKeyboardMarkup.de_json(job['reply_markup']) if job['reply_markup'] else None
+        media_bytes = None
+        if payload['type'] != 'text':
+            file_info = bot.get_file(payload['file_id'])
+            media_bytes = bot.download_file(file_info.file_path)
+
+        done_before = db_execute(
+            "SELECT COALESCE(SUM(sent), 0) AS sent, COALESCE(SUM(blocked), 0) AS blocked, COALESCE(SUM(failed), 0) AS failed "
+            "FROM bots_broadcast_progress WHERE job_id = ?", (job_id,), fetchone=True
+        )
+        totals = {'sent': done_before['sent'], 'blocked': done_before['blocked'], 'failed': done_before['failed'], 'lock': threading.Lock()}
+        pending = [r['bot_id'] for r in db_execute(
+            "SELECT bot_id FROM bots_broadcast_progress WHERE job_id = ? AND done = 0", (job_id,), fetchall=True
+        ) or []]
+        total_bots = db_execute("SELECT COUNT(*) FROM bots_broadcast_progress WHERE job_id = ?", (job_id,), fetchone=True)[0]
+        finished_bots = {'count': total_bots - len(pending)}
+        progress = ThrottledProgressMessage(
+            job['admin_id'], job['progress_message_id'],
+            lambda message_id: db_execute("UPDATE bots_broadcast_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id), commit=True)
+        )
+        started_at = time.time()
+
+        def report(force=False):
+            progress.update(
+                f"🚀 Рассылка по ботам... Ботов: {finished_bots['count']}/{total_bots}\n"
+                f"📬 Доставлено: {totals['sent']} | 🚫 Недоступны: {totals['blocked']} | 👎 Ошибок: {totals['failed']}",
+                force=force
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=BOTS_BROADCAST_WORKERS) as executor:
+            futures = {
+                executor.submit(broadcast_to_child_bot, job_id, bid, payload, media_bytes, reply_markup, totals, report): bid
+                for bid in pending
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    bid = futures[future]
+                    logging.error(f"Ошибка рассылки в боте {bid} (задание #{job_id}): {e}")
+                    db_execute("UPDATE bots_broadcast_progress SET error = ? WHERE job_id = ? AND bot_id = ?", (str(e), job_id, bid), commit=True)
+                finished_bots['count'] += 1
+                report()
+
+        db_execute("UPDATE bots_broadcast_jobs SET status = 'done', updated_at = ? WHERE id = ?", (int(time.time()), job_id), commit=True)
+        progress.update(
+            f"✅ Готово. Ботов обработано: {finished_bots['count']}/{total_bots}. Время: {time.time() - started_at:.1f} сек.\n"
+            f"📬 Доставлено: {totals['sent']} | 🚫 Недоступны: {totals['blocked']} | 👎 Ошибок: {totals['failed']}",
+            force=True,
+            reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_back"))
+        )
+    except Exception as e:
+        fail_job('bots_broadcast_jobs', job_id, job, progress, f"❌ Рассылка по ботам #{job_id} прервана: {e}")
+    finally:
+        with active_bots_broadcast_jobs_lock:
+            active_bots_broadcast_jobs.discard(job_id)
+
+def resume_bots_broadcast_jobs():
+    jobs = db_execute("SELECT id FROM bots_broadcast_jobs WHERE status = 'running'", fetchall=True) or []
+    for job in jobs:
+        logging.info(f"Продолжаю рассылку по ботам #{job['id']} с сохраненных курсоров.")
+        threading.Thread(target=run_bots_broadcast_job, args=(job['id'],), daemon=True).start()
+
+# -------------------- РАССЫЛКА ПО ПОЛЬЗОВАТЕЛЯМ КОНСТРУКТОРА --------------------
+# Задание хранится в broadcast_jobs с курсором по user_id. Пачка пользователей уходит
+# пулом потоков с общим ведром токенов (429 ставит на паузу весь пул на retry_after),
+# итоги пачки в broadcast_deliveries, курсор и отметки заблокировавших пишутся одной
+# транзакцией. После перезапуска задание продолжается с курсора: повторно может уйти
+# только недописанная пачка.
+
+active_broadcast_jobs = set()
+active_broadcast_jobs_lock = threading.Lock()
+
+class CopyMessageSender:
+    """Копия сообщения из чата админа — отправитель для deliver_with_retries."""
+
+    def __init__(self, from_chat_id, message_id, reply_markup):
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.reply_markup = reply_markup
+
+    def send(self, chat_id):
+        bot.copy_message(chat_id, self.from_chat_id, self.message_id, reply_markup=self.reply_markup)
+
+def create_broadcast_job(admin_id, source_message_id, reply_markup, progress_message_id):
+    now_ts = int(time.time())
+    total = db_execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL", fetchone=True)[0]
+    return db_execute(
+        "INSERT INTO broadcast_jobs (admin_id, status, source_message_id, reply_markup, progress_message_id, total, created_at, updated_at) "
+        "VALUES (?, 'running', ?, ?, ?, ?, ?, ?)",
+        (admin_id, source_message_id, reply_markup.to_json() if reply_markup else None, progress_message_id, total, now_ts, now_ts),
+        commit=True
+    )
+
+def has_running_broadcast():
+    return db_execute("SELECT 1 FROM broadcast_jobs WHERE status = 'running' LIMIT 1", fetchone=True) is not None
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds} сек"
+
+def format_broadcast_stats(job_id, counts, total, rate):
+    done = counts['sent'] + counts['blocked'] + counts['failed']
+    remaining = max(0, total - done)
+    eta = format_duration(remaining / rate) if rate > 0 else "—"
+    return (
+        f"🚀 Рассылка #{job_id}... Обработано {done}/{max(total, done)}\n"
+        f"📬 Доставлено: {counts['sent']} | 🚫 Заблокировали: {counts['blocked']} | 👎 Ошибок: {counts['failed']}\n"
+        f"⚡ Скорость: {rate:.1f} сообщ./сек | ⏳ Осталось: ~{eta}"
+    )
+
+def prune_broadcast_deliveries():
+    cutoff = int(time.time()) - BROADCAST_DELIVERIES_RETENTION_SECONDS
+    db_execute(
+        "DELETE FROM broadcast_deliveries WHERE job_id IN (SELECT id FROM broadcast_jobs WHERE status != 'running' AND finished_at < ?)",
+        (cutoff,), commit=True
+    )
+
+def save_broadcast_chunk(job_id, chunk, outcomes):
+    now_ts = int(time.time())
+    chunk_counts = {'sent': 0, 'blocked': 0, 'failed': 0}
+    for outcome in outcomes:
+        chunk_counts[outcome] += 1
+    with db_lock:
+        conn.executemany(
+            "INSERT OR REPLACE INTO broadcast_deliveries (job_id, user_id, status, updated_at) VALUES (?, ?, ?, ?)",
+            [(job_id, user_id, outcome, now_ts) for user_id, outcome in zip(chunk, outcomes)]
+        )
+        conn.executemany(
+            "UPDATE users SET blocked_at = ? WHERE user_id = ?",
+            [(now_ts, user_id) for user_id, outcome in zip(chunk, outcomes) if outcome == 'blocked']
+        )
+        conn.execute(
+            "UPDATE broadcast_jobs SET cursor = ?, sent = sent + ?, blocked = blocked + ?, failed = failed + ?, updated_at = ? WHERE id = ?",
+            (chunk[-1], chunk_counts['sent'], chunk_counts['blocked'], chunk_counts['failed'], now_ts, job_id)
+        )
+        conn.commit()
+    return chunk_counts
+
+def run_broadcast_job(job_id):
+    with active_broadcast_jobs_lock:
+        if job_id in active_broadcast_jobs:
+            return
+        active_broadcast_jobs.add(job_id)
+    job = None
+    progress = None
+    try:
+        job = row_to_dict(db_execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,), fetchone=True))
+        if not job or job['status'] != 'running':
+            return
+        prune_broadcast_deliveries()
+        reply_markup = types.InlineKeyboardMarkup.de_json(job['reply_markup']) if job['reply_markup'] else None
+        sender = CopyMessageSender(job['admin_id'], job['source_message_id'], reply_markup)
+        bucket = TokenBucket(BROADCAST_RATE_PER_SECOND)
+        progress = ThrottledProgressMessage(
+            job['admin_id'], job['progress_message_id'],
+            lambda message_id: db_execute("UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id), commit=True)
+        )
+        stop_markup = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⏹ Остановить", callback_data=f"admin_broadcast_stop_{job_id}"))
+        counts = {'sent': job['sent'], 'blocked': job['blocked'], 'failed': job['failed']}
+        last_user_id = job['cursor']
+        run_started = time.time()
+        run_processed = 0
+        status = 'running'
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=BROADCAST_WORKERS) as executor:
+            while True:
+                # Остановка из админки проверяется между пачками
+                status = db_execute("SELECT status FROM broadcast_jobs WHERE id = ?", (job_id,), fetchone=True)['status']
+                if status != 'running':
+                    break
+                chunk = [r['user_id'] for r in db_execute(
+                    "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?",
+                    (last_user_id, BROADCAST_CHUNK_SIZE), fetchall=True
+                ) or []]
+                if not chunk:
+                    break
+                outcomes = list(executor.map(lambda user_id: deliver_with_retries(sender, bucket, user_id), chunk))
+                for outcome, value in save_broadcast_chunk(job_id, chunk, outcomes).items():
+                    counts[outcome] += value
+                last_user_id = chunk[-1]
+                run_processed += len(chunk)
+                rate = run_processed / max(time.time() - run_started, 0.001)
+                progress.update(format_broadcast_stats(job_id, counts, job['total'], rate), reply_markup=stop_markup)
+
+        elapsed = time.time() - run_started
+        if status == 'running':
+            db_execute("UPDATE broadcast_jobs SET status = 'done', finished_at = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                       (int(time.time()), int(time.time()), job_id), commit=True)
+            header = f"✅ Рассылка #{job_id} завершена за {format_duration(elapsed)}."
+        else:
+            db_execute("UPDATE broadcast_jobs SET finished_at = ? WHERE id = ?", (int(time.time()), job_id), commit=True)
+            header = f"⏹ Рассылка #{job_id} остановлена."
+        done = counts['sent'] + counts['blocked'] + counts['failed']
+        progress.update(
+            f"{header}\n\n"
+            f"📬 Обработано пользователей: {done}\n"
+            f"👍 Успешно отправлено: {counts['sent']}\n"
+            f"🚫 Заблокировали бота: {counts['blocked']}\n"
+            f"👎 Ошибок: {counts['failed']}\n"
+            f"⚡ Средняя скорость: {run_processed / max(elapsed, 0.001):.1f} сообщ./сек",
+            force=True,
+            reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
+        )
+    except Exception as e:
+        fail_job('broadcast_jobs', job_id, job, progress, f"❌ Рассылка #{job_id} прервана: {e}")
+    finally:
+        with active_broadcast_jobs_lock:
+            active_broadcast_jobs.discard(job_id)
+
+def resume_broadcast_jobs():
+    jobs = db_execute("SELECT id FROM broadcast_jobs WHERE status = 'running'", fetchall=True) or []
+    for job in jobs:
+        logging.info(f"Продолжаю рассылку #{job['id']} с сохраненного курсора.")
+        threading.Thread(target=run_broadcast_job, args=(job['id'],), daemon=True).start()
+
+# -------------------- СВЕРКА ПЛАТЕЖЕЙ CRYPTO PAY --------------------
+# Ожидающие счета проверяются страницами по окну invoice_id. Все переходы страницы
+# применяются одной транзакцией; ключ идемпотентности в crypto_payment_applications
+# гарантирует, что оплата не будет выдана дважды (фон, вебхук и кнопка «Проверить»).
+# Уведомления уходят через очередь отправки, а не из цикла сверки.
+
+# (префикс payload, тип покупки, тип создаваемого бота, название для админа)
+CRYPTO_PURCHASE_KINDS = [
+    ('vip_', 'vip', None, None),
+    ('cashlait_new_', 'new_bot', 'cashlait', 'CashLait'),
+    ('dicelite_new_', 'new_bot', 'dicelite', 'DiceLite'),
+    ('creator_new_', 'new_bot', 'creator', 'Креатора'),
+    ('creator_', 'bot_for_owner', 'creator', 'Креатора'),
+]
+
+CRYPTO_PURCHASE_OWNER_TEXTS = {
+    'cashlait': "✅ Оплата прошла успешно! CashLait бот #{bot_id} создан! Теперь он в списке ваших ботов.",
+    'dicelite': "✅ Оплата прошла успешно! DiceLite бот #{bot_id} создан! Теперь он в списке ваших ботов.",
+    'creator': "✅ Оплата прошла успешно! Бот Креатор #{bot_id} создан!\n\nОжидайте выдачи бота! Вам напишет админ!",
+}
+
+notification_queue = queue.Queue()
+
+def enqueue_notification(chat_id, text, parse_mode=None):
+    notification_queue.put((chat_id, text, parse_mode))
+
+def notification_sender_worker():
+    bucket = TokenBucket(BOTS_BROADCAST_RATE_PER_SECOND)
+    while True:
+        chat_id, text, parse_mode = notification_queue.get()
+        attempt = 0
+        while attempt < BOTS_BROADCAST_MAX_ATTEMPTS:
+            bucket.acquire()
+            try:
+                bot.send_message(chat_id, text, parse_mode=parse_mode)
+                break
+            except Exception as e:
+                kind, retry_after = classify_send_error(e)
+                if kind == 'flood':
+                    bucket.pause(retry_after)
+                    continue
+                if kind != 'retry':
+                    logging.warning(f"Не удалось отправить уведомление {chat_id}: {e}")
+                    break
+                attempt += 1
+                time.sleep(2 ** attempt)
+        notification_queue.task_done()
+
+def register_crypto_invoice(invoice_id, bot_id, user_id, amount):
+    db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status, created_at) VALUES (?, ?, ?, ?, 'pending', ?)",
+               (invoice_id, bot_id, user_id, amount, int(time.time())), commit=True)
+
+def resolve_crypto_purchase(payload):
+    for prefix, kind, bot_type, title in CRYPTO_PURCHASE_KINDS:
+        if (payload or '').startswith(prefix):
+            return kind, bot_type, title
+    return None, None, None
+
+def apply_paid_invoices(invoices, notify_owner=True, background=True):
+    """Применяет оплаченные счета одной транзакцией.
+
+    Возвращает {invoice_id: {'kind', 'bot_id', 'applied_now'}}. Уже примененный счет
+    не применяется повторно — возвращается его прежний результат. Счета, оплаченные
+    до появления ключей идемпотентности (status = 'paid' без ключа), тоже не
+    применяются: ключ для них дописывается задним числом.
+    После коммита для ботов с новым VIP публикуется снимок конфигурации.
+    """
+    invoices = [inv for inv in invoices if inv is not None]
+    if not invoices:
+        return {}
+    ids = [inv.invoice_id for inv in invoices]
+    placeholders = ",".join("?" * len(ids))
+    results = {}
+    notifications = []
+    vip_bot_ids = []
+    now_ts = int(time.time())
+    with db_lock:
+        cursor = conn.cursor()
+        try:
+            payments = {row[0]: row for row in cursor.execute(
+                f"SELECT invoice_id, bot_id, user_id, status FROM crypto_payments WHERE invoice_id IN ({placeholders})", ids
+            ).fetchall()}
+            owner_ids = {row[0]: row[1] for row in cursor.execute(
+                f"SELECT id, owner_id FROM bots WHERE id IN (SELECT bot_id FROM crypto_payments WHERE invoice_id IN ({placeholders}))", ids
+            ).fetchall()}
+            for invoice in invoices:
+                payment = payments.get(invoice.invoice_id)
+                if payment is None:
+                    continue
+                _, payment_bot_id, payment_user_id, payment_status = payment
+                kind, bot_type, title = resolve_crypto_purchase(invoice.payload)
+                if kind is None:
+                    logging.warning(f"Счет #{invoice.invoice_id} оплачен с неизвестным payload: {invoice.payload}")
+                    continue
+                key = f"crypto:{invoice.invoice_id}:{invoice.payload}"
+                cursor.execute(
+                    "INSERT OR IGNORE INTO crypto_payment_applications (idempotency_key, invoice_id, kind, applied_at) VALUES (?, ?, ?, ?)",
+                    (key, invoice.invoice_id, kind, now_ts)
+                )
+                if cursor.rowcount == 0:
+                    previous = cursor.execute("SELECT result_bot_id FROM crypto_payment_applications WHERE idempotency_key = ?", (key,)).fetchone()
+                    results[invoice.invoice_id] = {'kind': kind, 'bot_id': previous[0], 'applied_now': False}
+                    continue
+                if payment_status == 'paid':
+                    # Применен старым кодом без ключа: ключ записан выше, покупку не повторяем
+                    legacy_bot_id = payment_bot_id if kind == 'vip' else None
+                    cursor.execute("UPDATE crypto_payment_applications SET result_bot_id = ? WHERE idempotency_key = ?", (legacy_bot_id, key))
+                    results[invoice.invoice_id] = {'kind': kind, 'bot_id': legacy_bot_id, 'applied_now': False}
+                    continue
+                if kind == 'vip':
+                    # config_version растет в той же транзакции, снимок публикуется после коммита
+                    cursor.execute("UPDATE bots SET vip_status = ?, config_version = config_version + 1 WHERE id = ?", (True, payment_bot_id))
+                    vip_bot_ids.append(payment_bot_id)
+                    result_bot_id = payment_bot_id
+                    owner_id = owner_ids.get(payment_bot_id, payment_user_id)
+                    owner_text = f"✅ VIP-статус для вашего бота #{payment_bot_id} успешно активирован!"
+                else:
+                    owner_id = payment_user_id if kind == 'new_bot' else owner_ids.get(payment_bot_id, payment_user_id)
+                    cursor.execute("INSERT INTO bots (owner_id, admins, bot_type, created_at) VALUES (?, ?, ?, ?)",
+                                   (owner_id, json.dumps([owner_id]), bot_type, now_ts))
+                    result_bot_id = cursor.lastrowid
+                    owner_text = CRYPTO_PURCHASE_OWNER_TEXTS[bot_type].format(bot_id=result_bot_id)
+                cursor.execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice.invoice_id,))
+                cursor.execute("UPDATE crypto_payment_applications SET result_bot_id = ? WHERE idempotency_key = ?", (result_bot_id, key))
+                results[invoice.invoice_id] = {'kind': kind, 'bot_id': result_bot_id, 'applied_now': True}
+                notifications.append((invoice.invoice_id, owner_id, owner_text, title, result_bot_id))
+            conn.commit()
+            bot_info_cache.invalidate()
+        except Exception:
+            conn.rollback()
+            raise
+
+    for vip_bot_id in vip_bot_ids:
+        # Запущенный бот снимает подпись конструктора (CREATOR_BRANDING) без перезапуска
+        publish_bot_config(vip_bot_id, bump=False)
+    if notifications:
+        buyer_ids = list({n[1] for n in notifications})
+        usernames = {row['user_id']: row['username'] for row in db_execute(
+            f"SELECT user_id, username FROM users WHERE user_id IN ({','.join('?' * len(buyer_ids))})", buyer_ids, fetchall=True
+        ) or []}
+    for invoice_id, owner_id, owner_text, title, result_bot_id in notifications:
+        logging.info(f"Оплата счета #{invoice_id} применена: {results[invoice_id]['kind']}, бот #{result_bot_id}")
+        if notify_owner:
+            enqueue_notification(owner_id, owner_text)
+        if title:
+            enqueue_notification(
+                ADMIN_ID,
+                f"🛒 Покупка {title}{' (фон)' if background else ''}: пользователь <code>{owner_id}</code> "
+                f"(@{escape(usernames.get(owner_id) or 'N/A')}) оплатил счет #{invoice_id}. Создан бот #{result_bot_id}.",
+                parse_mode="HTML"
+            )
+    return results
+
+def expire_crypto_invoices(invoice_ids):
+    if invoice_ids:
+        db_execute(f"UPDATE crypto_payments SET status = 'expired' WHERE status = 'pending' AND invoice_id IN ({','.join('?' * len(invoice_ids))})",
+                   list(invoice_ids), commit=True)
+
+async def reconcile_crypto_payments():
+    """Один проход сверки по всем ожидающим счетам страницами по CRYPTO_RECONCILE_PAGE_SIZE."""
+    now_ts = int(time.time())
+    # Старым записям без даты отсчет срока начинаем с текущего прохода
+    db_execute("UPDATE crypto_payments SET created_at = ? WHERE status = 'pending' AND created_at IS NULL", (now_ts,), commit=True)
+    last_invoice_id = 0
+    stats = {'paid': 0, 'expired': 0}
+    while True:
+        page = db_execute(
+            "SELECT invoice_id, created_at FROM crypto_payments WHERE status = 'pending' AND invoice_id > ? ORDER BY invoice_id LIMIT ?",
+            (last_invoice_id, CRYPTO_RECONCILE_PAGE_SIZE), fetchall=True
+        ) or []
+        if not page:
+            break
+        last_invoice_id = page[-1]['invoice_id']
+        created = {row['invoice_id']: row['created_at'] for row in page}
+        checked = await crypto_pay_service.call_async('get_invoices', invoice_ids=list(created), count=len(created))
+        if checked is None:
+            checked = []
+        elif not isinstance(checked, list):
+            checked = [checked]
+        paid = [inv for inv in checked if inv.status == 'paid']
+        expired = {inv.invoice_id for inv in checked if inv.status == 'expired'}
+        for inv in checked:
+            if inv.status == 'active' and now_ts - created.get(inv.invoice_id, now_ts) > CRYPTO_INVOICE_EXPIRE_SECONDS:
+                # Удаляем счет в Crypto Pay, чтобы его нельзя было оплатить после истечения
+                try:
+                    if await crypto_pay_service.call_async('delete_invoice', inv.invoice_id):
+                        expired.add(inv.invoice_id)
+                except Exception as e:
+                    logging.warning(f"Не удалось удалить просроченный счет #{inv.invoice_id}: {e}")
+        if paid:
+            applied = apply_paid_invoices(paid)
+            stats['paid'] += sum(1 for r in applied.values() if r['applied_now'])
+        expire_crypto_invoices(expired)
+        stats['expired'] += len(expired)
+        if len(page) < CRYPTO_RECONCILE_PAGE_SIZE:
+            break
+    if stats['paid'] or stats['expired']:
+        logging.info(f"Сверка Crypto Pay: применено оплат {stats['paid']}, истекло счетов {stats['expired']}.")
+    return stats
+
+async def crypto_pay_webhook_handler(request):
+    """Прием invoice_paid от Crypto Pay. Подпись проверяется токеном текущего клиента."""
+    body_text = await request.text()
+    local_crypto = get_crypto_client()
+    signature = request.headers.get('Crypto-Pay-Api-Signature', '')
+    if not local_crypto or not local_crypto.check_signature(body_text, signature):
+        return web.Response(status=401, text="bad signature")
+    try:
+        update = json.loads(body_text)
+        if update.get('update_type') == 'invoice_paid':
+            # Из счета нужны только id, статус и payload — полную модель не валидируем
+            invoice = update.get('payload') or {}
+            paid = [SimpleNamespace(
+                invoice_id=int(invoice['invoice_id']), status=invoice.get('status'), payload=invoice.get('payload')
+            )]
+            # Транзакция под db_lock и уведомления блокируют — не держим ими цикл вебхуков и сверки
+            await asyncio.get_running_loop().run_in_executor(None, apply_paid_invoices, paid)
+    except Exception as e:
+        logging.error(f"Ошибка обработки вебхука Crypto Pay: {e}", exc_info=True)
+        return web.Response(status=500, text="error")
+    return web.Response(text="OK")
+
+async def start_crypto_pay_webhook():
+    app = web.Application()
+    app.router.add_post(CRYPTO_PAY_WEBHOOK_PATH, crypto_pay_webhook_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, CRYPTO_PAY_WEBHOOK_HOST, CRYPTO_PAY_WEBHOOK_PORT).start()
+    logging.info(f"Вебхук Crypto Pay слушает http://{CRYPTO_PAY_WEBHOOK_HOST}:{CRYPTO_PAY_WEBHOOK_PORT}{CRYPTO_PAY_WEBHOOK_PATH}")
+    return runner
+
+
+# -------------------- СТАТИСТИКА: ДНЕВНЫЕ СВОДКИ --------------------
+# Экраны статистики читают только stats_daily и не считают ничего вживую.
+# Производные метрики (созданные боты, оплаты) пересчитываются из исходных
+# таблиц за день целиком; срезы (боты, пользователи) пишутся только для текущего
+# дня; исходы проверки холда добавляются инкрементально в транзакции
+# run_hold_checker и пересчетом не затрагиваются. День — по UTC.
+# Оплаты берутся из crypto_payment_applications; оплаченные до появления этой
+# таблицы счета (status = 'paid' без строки применения) считаются по дате счета
+# crypto_payments.created_at с измерением 'unknown' — payload у них не сохранен.
+# Старые счета без created_at восстановить нельзя.
+
+STATS_DERIVED_METRICS = ('bots_created', 'payments', 'payments_amount')
+STATS_GAUGE_METRICS = ('bots_total', 'bots_running', 'users_total', 'child_users')
+
+def stats_day(ts=None):
+    return datetime.utcfromtimestamp(time.time() if ts is None else ts).strftime('%Y-%m-%d')
+
+def stats_day_bounds(day):
+    start = int((datetime.strptime(day, '%Y-%m-%d') - datetime(1970, 1, 1)).total_seconds())
+    return start, start + 86400
+
+def stats_days_between(first_day, last_day):
+    days = []
+    current = datetime.strptime(first_day, '%Y-%m-%d')
+    last = datetime.strptime(last_day, '%Y-%m-%d')
+    while current <= last:
+        days.append(current.strftime('%Y-%m-%d'))
+        current += timedelta(days=1)
+    return days
+
+def crypto_payload_type(payload):
+    """Тип покупки для статистики: префикс payload из CRYPTO_PURCHASE_KINDS без '_'."""
+    for prefix, _, _, _ in CRYPTO_PURCHASE_KINDS:
+        if (payload or '').startswith(prefix):
+            return prefix.rstrip('_')
+    return 'unknown'
+
+def collect_stats_rows(cursor, day, with_gauges):
+    """Строки (metric, dimension, value) за день из исходных таблиц."""
+    start, end = stats_day_bounds(day)
+    rows = [('bots_created', bot_type or 'ref', count) for bot_type, count in cursor.execute(
+        "SELECT bot_type, COUNT(*) FROM bots WHERE created_at >= ? AND created_at < ? GROUP BY bot_type", (start, end)
+    ).fetchall()]
+    payments = {}
+    applied = cursor.execute(
+        "SELECT a.idempotency_key, p.amount FROM crypto_payment_applications a "
+        "LEFT JOIN crypto_payments p ON p.invoice_id = a.invoice_id WHERE a.applied_at >= ? AND a.applied_at < ?",
+        (start, end)
+    ).fetchall()
+    legacy = cursor.execute(
+        "SELECT NULL, p.amount FROM crypto_payments p WHERE p.status = 'paid' AND p.created_at >= ? AND p.created_at < ? "
+        "AND NOT EXISTS (SELECT 1 FROM crypto_payment_applications a WHERE a.invoice_id = p.invoice_id)",
+        (start, end)
+    ).fetchall()
+    for key, amount in applied + legacy:
+        # Ключ идемпотентности: crypto:<invoice_id>:<payload>; у старых оплат ключа нет
+        payload_type = crypto_payload_type(key.split(':', 2)[-1] if key else None)
+        count, total = payments.get(payload_type, (0, 0.0))
+        payments[payload_type] = (count + 1, total + (amount or 0))
+    for payload_type, (count, total) in payments.items():
+        rows.append(('payments', payload_type, count))
+        rows.append(('payments_amount', payload_type, total))
+    if with_gauges:
+        rows.append(('bots_total', '', cursor.execute("SELECT COUNT(*) FROM bots").fetchone()[0]))
+        rows.append(('bots_running', '', cursor.execute("SELECT COUNT(*) FROM bots WHERE status = 'running'").fetchone()[0]))
+        rows.append(('users_total', '', cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0]))
+        rows.extend(('child_users', bot_type or 'ref', total) for bot_type, total in cursor.execute(
+            "SELECT b.bot_type, SUM(c.user_count) FROM bot_user_counts c JOIN bots b ON b.id = c.bot_id GROUP BY b.bot_type"
+        ).fetchall())
+    return rows
+
+def rollup_stats_day(day):
+    """Перезаписывает сводку дня одной транзакцией. Срезы обновляются, только если день текущий."""
+    with_gauges = day == stats_day()
+    metrics = STATS_DERIVED_METRICS + (STATS_GAUGE_METRICS if with_gauges else ())
+    now_ts = int(time.time())
+    with db_lock:
+        try:
+            cursor = conn.cursor()
+            rows = collect_stats_rows(cursor, day, with_gauges)
+            placeholders = ','.join('?' * len(metrics))
+            cursor.execute(f"DELETE FROM stats_daily WHERE day = ? AND metric IN ({placeholders})", (day, *metrics))
+            cursor.executemany(
+                "INSERT INTO stats_daily (day, metric, dimension, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(day, metric, dimension, value, now_ts) for metric, dimension, value in rows]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def add_stats_increments(cursor, increments, day=None):
+    """Прибавляет (metric, dimension, delta) к счетчикам дня в транзакции вызывающего, без коммита."""
+    day = day or stats_day()
+    now_ts = int(time.time())
+    cursor.executemany(
+        "INSERT INTO stats_daily (day, metric, dimension, value, updated_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(day, metric, dimension) DO UPDATE SET value = value + excluded.value, updated_at = excluded.updated_at",
+        [(day, metric, dimension, delta, now_ts) for metric, dimension, delta in increments if delta]
+    )
 
-def stop_bot_process(bot_id):
-    bot_info = get_bot_by_id(bot_id)
-    if not bot_info or not bot_info['pid']:
-        update_bot_process_info(bot_id, 'stopped', None, None)
-        return False, "Процесс не найден."
-    if bot_info['status'] != 'running': return False, "Бот уже остановлен."
+def run_stats_rollup():
+    """Проход воркера: закрывает дни, наступившие с прошлого закрытия, и обновляет текущий."""
+    today = stats_day()
+    yesterday = stats_day(time.time() - 86400)
+    last_closed = get_setting('stats_rollup_closed_day')
+    if last_closed is None or last_closed < yesterday:
+        first_day = yesterday if last_closed is None else stats_days_between(last_closed, yesterday)[1]
+        for day in stats_days_between(first_day, yesterday):
+            rollup_stats_day(day)
+        set_setting('stats_rollup_closed_day', yesterday)
+    rollup_stats_day(today)
+
+def recompute_stats_daily(since_day=None):
+    """Бэкфилл производных метрик с since_day (по умолчанию с первой даты в bots/оплатах) по сегодня.
+    Возвращает число пересчитанных дней."""
+    if since_day is None:
+        first_ts = db_execute(
+            "SELECT MIN(ts) FROM (SELECT MIN(created_at) AS ts FROM bots UNION ALL SELECT MIN(applied_at) FROM crypto_payment_applications "
+            "UNION ALL SELECT MIN(created_at) FROM crypto_payments WHERE status = 'paid')",
+            fetchone=True
+        )[0]
+        since_day = stats_day(first_ts) if first_ts else stats_day()
+    days = stats_days_between(since_day, stats_day())
+    for day in days:
+        rollup_stats_day(day)
+    set_setting('stats_rollup_closed_day', stats_day(time.time() - 86400))
+    return len(days)
+
+def stats_rollup_worker():
+    logging.info("Воркер дневных сводок статистики запущен.")
+    while True:
+        try:
+            run_stats_rollup()
+        except Exception as e:
+            logging.error(f"Ошибка в воркере дневных сводок статистики: {e}", exc_info=True)
+        time.sleep(STATS_ROLLUP_INTERVAL_SECONDS)
+
+def get_stats_gauges():
+    """Последний записанный срез: {metric: {dimension: value}}. Пусто, если сводок еще нет."""
+    row = db_execute("SELECT MAX(day) FROM stats_daily WHERE metric = 'bots_total'", fetchone=True)
+    if not row or row[0] is None:
+        return {}
+    gauges = {}
+    placeholders = ','.join('?' * len(STATS_GAUGE_METRICS))
+    for r in db_execute(f"SELECT metric, dimension, value FROM stats_daily WHERE day = ? AND metric IN ({placeholders})",
+                        (row[0], *STATS_GAUGE_METRICS), fetchall=True) or []:
+        gauges.setdefault(r['metric'], {})[r['dimension']] = r['value']
+    return gauges
+
+def sum_stats(since_day):
+    """Суммы производных и инкрементальных метрик с since_day: {metric: {dimension: value}}."""
+    placeholders = ','.join('?' * len(STATS_GAUGE_METRICS))
+    totals = {}
+    for r in db_execute(
+        f"SELECT metric, dimension, SUM(value) AS value FROM stats_daily WHERE day >= ? AND metric NOT IN ({placeholders}) "
+        "GROUP BY metric, dimension", (since_day, *STATS_GAUGE_METRICS), fetchall=True
+    ) or []:
+        totals.setdefault(r['metric'], {})[r['dimension']] = r['value']
+    return totals
+
+def format_stats_breakdown(values, fmt="{:g}"):
+    if not values:
+        return "—"
+    return ", ".join(f"{dimension}: {fmt.format(value)}" for dimension, value in sorted(values.items()))
+
+def render_admin_stats(days=STATS_ADMIN_DAYS):
+    """Текст и клавиатура экрана статистики. Строится только из stats_daily."""
+    gauges = get_stats_gauges()
+    lines = ["<b>📈 Статистика конструктора</b>", ""]
+    if gauges:
+        lines.append("<b>Сейчас</b>")
+        lines.append(f" L 👥 Пользователей: <b>{gauges.get('users_total', {}).get('', 0):g}</b>")
+        lines.append(f" L 🤖 Ботов: <b>{gauges.get('bots_total', {}).get('', 0):g}</b>, запущено: <b>{gauges.get('bots_running', {}).get('', 0):g}</b>")
+        lines.append(f" L 👤 Пользователей в ботах: {format_stats_breakdown(gauges.get('child_users'))}")
+    else:
+        lines.append("Сводок пока нет — нажмите «Пересчитать».")
+    for title, since_day in (("Сегодня", stats_day()), (f"За {days} дн.", stats_day(time.time() - 86400 * (days - 1)))):
+        totals = sum_stats(since_day)
+        lines.append("")
+        lines.append(f"<b>{title}</b>")
+        lines.append(f" L 🆕 Создано ботов: {format_stats_breakdown(totals.get('bots_created'))}")
+        lines.append(f" L 💳 Оплат: {format_stats_breakdown(totals.get('payments'))}")
+        lines.append(f" L 💰 Сумма оплат: {format_stats_breakdown(totals.get('payments_amount'), '{:.2f}')}")
+        lines.append(f" L ⏳ Холд Flyer: {format_stats_breakdown(totals.get('hold_checks'))}")
+    updated_at = db_execute("SELECT MAX(updated_at) FROM stats_daily", fetchone=True)[0]
+    lines.append("")
+    lines.append("<i>Оплаты до учета применений — по дате счета, тип unknown; счета без даты не учитываются.</i>")
+    if updated_at:
+        lines.append(f"<i>Обновлено: {datetime.utcfromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M')} UTC</i>")
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(types.InlineKeyboardButton("🔁 Пересчитать", callback_data="admin_stats_recompute"))
+    markup.add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
+    return "\n".join(lines), markup
+
+
+# =================================================================================
+# --------------------------- ЕДИНЫЙ ВХОД ВЕБХУКОВ ---------------------------------
+# =================================================================================
+
+def get_webhook_secret_key():
+    key = os.getenv('WEBHOOK_SECRET_KEY') or get_setting('webhook_secret_key')
+    if not key:
+        key = secrets.token_hex(32)
+        set_setting('webhook_secret_key', key)
+    return key
+
+
+class WebhookRoute:
+    """Очередь обновлений одного бота. Выданные, но не подтвержденные обновления
+    лежат в inflight и отдаются повторно, пока получатель не пришлет offset дальше."""
+
+    def __init__(self, bot_id, secret):
+        self.bot_id = bot_id
+        self.secret = secret
+        self.queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.inflight = []
+        self.received = 0
+        self.rejected = 0
+        self.delivered = 0
+
+    def ack(self, offset):
+        if offset:
+            self.inflight = [update for update in self.inflight if update.get('update_id', 0) >= offset]
+
+    async def next_batch(self, timeout):
+        if self.inflight:
+            return self.inflight
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while len(batch) < WEBHOOK_PULL_BATCH_SIZE and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        self.inflight = batch
+        self.delivered += len(batch)
+        return batch
+
+
+class WebhookIngress:
+    """Один HTTP-сервер на все токены: POST {WEBHOOK_PATH_PREFIX}/<secret> от Telegram
+    кладет обновление в ограниченную очередь бота. Переполненная очередь отвечает 503 —
+    Telegram повторит доставку позже, тормозя только этого бота.
+
+    Тенанты хостов забирают свою очередь через GET .../<secret>/pull (аналог getUpdates
+    с offset), обновления самого конструктора разбираются в этом процессе.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.secrets_by_bot = {}
+        self.lock = threading.Lock()
+        self.runner = None
+
+    @property
+    def running(self):
+        return self.runner is not None
+
+    def secret_for(self, bot_id, token):
+        digest = hmac.new(get_webhook_secret_key().encode(), f"{bot_id}:{token}".encode(), hashlib.sha256)
+        return digest.hexdigest()[:32]
+
+    def register(self, bot_id, token):
+        secret = self.secret_for(bot_id, token)
+        with self.lock:
+            # Перезапуск с тем же токеном сохраняет очередь: обновления, пришедшие пока
+            # тенант лежал, достанутся новому экземпляру
+            if secret in self.routes:
+                return self.routes[secret]
+            route = WebhookRoute(bot_id, secret)
+            old_secret = self.secrets_by_bot.pop(bot_id, None)
+            if old_secret:
+                self.routes.pop(old_secret, None)
+            self.routes[route.secret] = route
+            self.secrets_by_bot[bot_id] = route.secret
+        return route
+
+    def unregister(self, bot_id):
+        with self.lock:
+            secret = self.secrets_by_bot.pop(bot_id, None)
+            if secret:
+                self.routes.pop(secret, None)
+        return secret is not None
+
+    def pull_url(self, route):
+        return f"http://{WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH_PREFIX}/{route.secret}/pull"
+
+    def _authorized_route(self, request):
+        route = self.routes.get(request.match_info['secret'])
+        if route is None:
+            return None, web.Response(status=404)
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), route.secret):
+            return None, web.Response(status=401)
+        return route, None
+
+    async def handle_update(self, request):
+        route, error = self._authorized_route(request)
+        if error is not None:
+            return error
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if route.queue.full():
+            route.rejected += 1
+            return web.Response(status=503)
+        route.queue.put_nowait(update)
+        route.received += 1
+        if WEBHOOK_RECORD_PATH:
+            try:
+                with open(WEBHOOK_RECORD_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'bot_id': route.bot_id, 'update': update}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logging.warning(f"Не удалось записать обновление в {WEBHOOK_RECORD_PATH}: {e}")
+        return web.Response(text='ok')
+
+    async def handle_pull(self, request):
+        route, error = self._authorized_route(request)
+        if error is not None:
+            return error
+        try:
+            offset = int(request.query.get('offset', 0))
+            timeout = min(float(request.query.get('timeout', WEBHOOK_PULL_TIMEOUT_SECONDS)), WEBHOOK_PULL_TIMEOUT_SECONDS)
+        except ValueError:
+            return web.Response(status=400)
+        route.ack(offset)
+        return web.json_response(await route.next_batch(timeout))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH_PREFIX + '/{secret}', self.handle_update)
+        app.router.add_get(WEBHOOK_PATH_PREFIX + '/{secret}/pull', self.handle_pull)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT).start()
+        self.runner = runner
+        logging.info(f"Вход вебхуков слушает http://{WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH_PREFIX}")
+
+    @property
+    def reachable(self):
+        """Вход получит обновления: есть внешний адрес для Telegram или явный офлайн-режим."""
+        return bool(WEBHOOK_PUBLIC_URL) or WEBHOOK_OFFLINE
+
+    def set_webhook(self, token, route):
+        """Направляет Telegram на вход. Без WEBHOOK_PUBLIC_URL (офлайн-режим) ничего не делает."""
+        if not WEBHOOK_PUBLIC_URL:
+            return
+        telebot.apihelper.set_webhook(
+            token, url=f"{WEBHOOK_PUBLIC_URL}{WEBHOOK_PATH_PREFIX}/{route.secret}", secret_token=route.secret
+        )
+
+    def attach_tenant(self, bot_id, token):
+        """Регистрирует тенанта и возвращает env для pull-режима или None (остается polling)."""
+        if not self.running or not self.reachable:
+            return None
+        route = self.register(bot_id, token)
+        try:
+            self.set_webhook(token, route)
+        except Exception as e:
+            self.unregister(bot_id)
+            logging.warning(f"setWebhook для бота #{bot_id} не удался, бот остается на polling: {e}")
+            return None
+        return {'WEBHOOK_PULL_URL': self.pull_url(route), 'WEBHOOK_SECRET': route.secret}
+
+    def detach(self, bot_id, token):
+        """Снимает маршрут и вебхук, чтобы следующий запуск (в т.ч. на polling) получил
+        накопленные в Telegram обновления."""
+        self.unregister(bot_id)
+        if WEBHOOK_PUBLIC_URL and token:
+            try:
+                telebot.apihelper.delete_webhook(token)
+            except Exception as e:
+                logging.warning(f"deleteWebhook для бота #{bot_id} не удался: {e}")
+
+    async def consume_local(self, route, local_bot):
+        """Разбор очереди бота, живущего в этом процессе (сам конструктор)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await route.next_batch(WEBHOOK_PULL_TIMEOUT_SECONDS)
+            if not batch:
+                continue
+            try:
+                updates = [types.Update.de_json(update) for update in batch]
+                await loop.run_in_executor(None, local_bot.process_new_updates, updates)
+            except Exception as e:
+                logging.error(f"Ошибка обработки обновлений бота #{route.bot_id}: {e}", exc_info=True)
+            route.ack(max(update.get('update_id', 0) for update in batch) + 1)
+
+
+webhook_ingress = WebhookIngress()
+
+def run_constructor_webhook():
+    """Запускает вход и переводит конструктор на вебхук. False — остаемся на polling."""
+    if not webhook_ingress.reachable:
+        # Иначе вход молча ждал бы обновлений, которые Telegram никуда не отправит
+        logging.error("WEBHOOK_MODE включен, но WEBHOOK_PUBLIC_URL не задан (и нет WEBHOOK_OFFLINE=1) — используется polling.")
+        return False
     try:
-        p = psutil.Process(bot_info['pid'])
-        p.kill()
-        update_bot_process_info(bot_id, 'stopped', None, None)
-        return True, "Бот успешно остановлен."
-    except psutil.NoSuchProcess:
-        update_bot_process_info(bot_id, 'stopped', None, None)
-        return False, "Процесс не найден, статус сброшен."
+        run_async_task(webhook_ingress.start())
+        route = webhook_ingress.register(0, CREATOR_BOT_TOKEN)
+        webhook_ingress.set_webhook(CREATOR_BOT_TOKEN, route)
     except Exception as e:
-        update_bot_process_info(bot_id, 'stopped', None, None)
-        return False, f"Ошибка остановки: {e}"
+        logging.error(f"Не удалось включить вебхук конструктора, используется polling: {e}")
+        webhook_ingress.unregister(0)
+        return False
+    if not WEBHOOK_PUBLIC_URL:
+        logging.info(f"Офлайн-режим вебхука, локальный путь конструктора: {WEBHOOK_PATH_PREFIX}/{route.secret}")
+    asyncio.run_coroutine_threadsafe(webhook_ingress.consume_local(route, bot), async_loop)
+    return True
 
-def get_process_resources(pid):
-    try:
-        process = psutil.Process(pid)
-        ram_usage = process.memory_info().rss / (1024 * 1024)
-        cpu_usage = process.cpu_percent(interval=0.1)
-        return {"ram": ram_usage, "cpu": cpu_usage}
-    except psutil.NoSuchProcess:
-        return {"ram": 0, "cpu": 0}
+
+def get_bot_resources(bot_id):
+    """Последний поминутный замер из телеметрии. Для тенанта — замер его хоста."""
+    source_id = bot_id
+    host = bot_host_pool.host_of(bot_id)
+    if host is not None:
+        source_id = -host.host_id
+    row = db_execute(
+        "SELECT rss_mb, cpu_percent, open_fds, threads, ts FROM bot_resource_samples "
+        "WHERE resolution = '1m' AND bot_id = ? ORDER BY ts DESC LIMIT 1",
+        (source_id,), fetchone=True
+    )
+    db_size = db_execute(
+        "SELECT db_size_bytes FROM bot_resource_samples WHERE resolution = '1m' AND bot_id = ? ORDER BY ts DESC LIMIT 1",
+        (bot_id,), fetchone=True
+    )
+    if not row or time.time() - row['ts'] > RESOURCE_SAMPLE_INTERVAL_SECONDS * 3:
+        return {"ram": 0, "cpu": 0, "fds": None, "threads": None, "db_size": db_size['db_size_bytes'] if db_size else None, "shared": host is not None}
+    return {
+        "ram": row['rss_mb'] or 0,
+        "cpu": row['cpu_percent'] or 0,
+        "fds": row['open_fds'],
+        "threads": row['threads'],
+        "db_size": db_size['db_size_bytes'] if db_size else None,
+        "shared": host is not None,
+    }
 
 def format_uptime(seconds):
     if not seconds: return "не запущен"
@@ -1197,6 +4429,7 @@ def create_admin_menu():
                types.InlineKeyboardButton("⚙️ Настройки дохода", callback_data="admin_op_manage"))
     markup.add(types.InlineKeyboardButton("🤖 Все боты", callback_data="admin_bots_all"),
                types.InlineKeyboardButton("₽ Настройки VIP", callback_data="admin_vip_manage"))
+    markup.add(types.InlineKeyboardButton("📈 Статистика", callback_data="admin_stats_show"))
     markup.add(types.InlineKeyboardButton("💼 CashLait", callback_data="admin_cashlait_manage"))
     markup.add(types.InlineKeyboardButton("🎲 DiceLite", callback_data="admin_dicelite_manage"))
     markup.add(types.InlineKeyboardButton("💸 Выдать баланс", callback_data="admin_balance_add_start"),
@@ -2150,7 +5383,8 @@ def process_state_input(message):
             'message_id': prompt_message_id,
             'target_bot_ids': target_bot_ids,
             'preview_message_id': preview_id,
-            'reply_markup': preview_markup
+            'reply_markup': preview_markup,
+            'payload': build_broadcast_payload(message)
         })
         return
 
@@ -2199,7 +5433,8 @@ def process_state_input(message):
             'message_id': state.get('message_id'),
             'target_bot_ids': target_bot_ids,
             'preview_message_id': preview_id,
-            'reply_markup': button_markup
+            'reply_markup': button_markup,
+            'payload': state.get('payload')
         })
         # Clean up prompt and input message if possible
         try:
@@ -2222,13 +5457,10 @@ def process_state_input(message):
             new_token = message.text.strip()
             # Persist to settings and update globals
             set_setting('crypto_pay_token', new_token)
-            global CRYPTO_PAY_TOKEN, crypto_pay
+            global CRYPTO_PAY_TOKEN
             CRYPTO_PAY_TOKEN = new_token
-            try:
-                crypto_pay = AioCryptoPay(token=CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
-            except Exception as e:
-                logging.error(f"Ошибка инициализации Crypto Pay: {e}")
-                crypto_pay = None
+            # Клиент с новым токеном создаст сервис Crypto Pay, старый закроется
+            get_crypto_client()
 
             # Ensure background payment checker is running (start/restart)
             try:
@@ -2515,11 +5747,21 @@ def process_state_input(message):
 
     if action == 'awaiting_bot_id_for_logs':
         try:
-            bot_id_to_get_logs = int(message.text)
-            log_path = f"logs/bot_{bot_id_to_get_logs}.log"
-            
-            with open(log_path, "rb") as log_file:
-                bot.send_document(user_id, log_file, caption=f"📄 Логи для бота #{bot_id_to_get_logs}")
+            bot_id_to_get_logs, since, until, needle = parse_log_query(message.text)
+            source = f"bot_{bot_id_to_get_logs}"
+            if since is None and until is None and needle is None:
+                log_document = export_log_document(source)
+                if log_document is None:
+                    raise FileNotFoundError(source)
+                caption = f"📄 Логи для бота #{bot_id_to_get_logs}"
+            else:
+                log_document = search_log_document(source, since=since, until=until, needle=needle)
+                if log_document is None:
+                    bot.send_message(user_id, f"🔎 В логах бота #{bot_id_to_get_logs} ничего не найдено по запросу. Уточните период или текст.")
+                    bot.delete_message(user_id, message.message_id)
+                    return
+                caption = f"🔎 Логи для бота #{bot_id_to_get_logs}: {message.text.split(maxsplit=1)[1]}"[:1024]
+            bot.send_document(user_id, log_document, caption=caption)
             
             bot.delete_message(user_id, state['message_id'])
             bot.delete_message(user_id, message.message_id)
@@ -2527,7 +5769,7 @@ def process_state_input(message):
             bot.send_message(user_id, get_custom_text('admin_menu_heading'), reply_markup=create_admin_menu())
 
         except (ValueError, TypeError):
-            bot.send_message(user_id, "❌ Ошибка. Введите корректный числовой ID бота.")
+            bot.send_message(user_id, "❌ Ошибка. Введите числовой ID бота, затем при необходимости период (6h или 2025-01-31T10:00..2025-01-31T12:00) и текст.")
             bot.delete_message(user_id, message.message_id)
         except FileNotFoundError:
             bot.send_message(user_id, f"❌ Лог-файл для бота #{message.text} не найден. Возможно, бот еще не запускался или ID неверный.")
@@ -2669,8 +5911,7 @@ def process_state_input(message):
                 max_val = float(max_val_str)
                 if min_val < 0 or max_val < 0 or min_val > max_val:
                     raise ValueError
-                update_bot_setting(bot_id, 'click_reward_min', min_val)
-                update_bot_setting(bot_id, 'click_reward_max', max_val)
+                update_bot_settings(bot_id, {'click_reward_min': min_val, 'click_reward_max': max_val})
                 new_value_raw = None 
             except (ValueError, IndexError):
                 error_text = "<b>❌ Ошибка!</b> Введите два положительных числа через |, например <code>0.001|0.005</code>"
@@ -2682,9 +5923,9 @@ def process_state_input(message):
             try:
                 test_bot = telebot.TeleBot(new_value_raw, threaded=False)
                 test_bot_info = test_bot.get_me()
-                update_bot_setting(bot_id, 'bot_username', test_bot_info.username)
-                update_bot_setting(bot_id, 'bot_token', new_value_raw)
-                if bot_info['status'] == 'unconfigured': update_bot_setting(bot_id, 'status', 'stopped')
+                token_changes = {'bot_username': test_bot_info.username, 'bot_token': new_value_raw}
+                if bot_info['status'] == 'unconfigured': token_changes['status'] = 'stopped'
+                update_bot_settings(bot_id, token_changes)
             except Exception: error_text = "<b>❌ Ошибка!</b> Токен недействителен."
         
         elif setting in ['ref_reward_1', 'ref_reward_2', 'withdrawal_limit', 
@@ -2818,14 +6059,11 @@ def process_state_input(message):
         new_key = message.text.strip()
         bot_info = get_bot_by_id(bot_id)
         if bot_info['bot_type'] == 'ref':
-            update_bot_setting(bot_id, 'flyer_api_key', new_key)
-            update_bot_setting(bot_id, 'flyer_op_enabled', True if new_key else False)
+            update_bot_settings(bot_id, {'flyer_api_key': new_key, 'flyer_op_enabled': bool(new_key)})
         elif bot_info['bot_type'] == 'stars':
-            update_bot_setting(bot_id, 'stars_flyer_api_key', new_key)
-            update_bot_setting(bot_id, 'stars_op_enabled', True if new_key else False)
+            update_bot_settings(bot_id, {'stars_flyer_api_key': new_key, 'stars_op_enabled': bool(new_key)})
         elif bot_info['bot_type'] == 'cashlait':
-            update_bot_setting(bot_id, 'cashlait_flyer_api_key', new_key)
-            update_bot_setting(bot_id, 'flyer_op_enabled', True if new_key else False)
+            update_bot_settings(bot_id, {'cashlait_flyer_api_key': new_key, 'flyer_op_enabled': bool(new_key)})
         
 
         bot.delete_message(user_id, message.message_id)
@@ -2856,29 +6094,24 @@ def process_state_input(message):
         bot_info = get_bot_by_id(bot_id)
 
         if bot_info['bot_type'] == 'ref':
-            update_bot_setting(bot_id, 'flyer_op_enabled', True)
-            update_bot_setting(bot_id, 'flyer_api_key', api_key)
+            update_bot_settings(bot_id, {'flyer_op_enabled': True, 'flyer_api_key': api_key})
         elif bot_info['bot_type'] == 'stars':
-            update_bot_setting(bot_id, 'stars_op_enabled', True)
-            update_bot_setting(bot_id, 'stars_flyer_api_key', api_key)
+            update_bot_settings(bot_id, {'stars_op_enabled': True, 'stars_flyer_api_key': api_key})
         elif bot_info['bot_type'] == 'clicker':
-            update_bot_setting(bot_id, 'clicker_op_enabled', True)
-            update_bot_setting(bot_id, 'clicker_flyer_api_key', api_key)
+            update_bot_settings(bot_id, {'clicker_op_enabled': True, 'clicker_flyer_api_key': api_key})
         elif bot_info['bot_type'] == 'anonchat':
-            update_bot_setting(bot_id, 'anonchat_flyer_api_key', api_key)
+            update_bot_settings(bot_id, {'anonchat_flyer_api_key': api_key})
         elif bot_info['bot_type'] == 'cashlait':
-            update_bot_setting(bot_id, 'cashlait_flyer_api_key', api_key)
-            update_bot_setting(bot_id, 'flyer_op_enabled', True)
+            update_bot_settings(bot_id, {'cashlait_flyer_api_key': api_key, 'flyer_op_enabled': True})
         
-
-        stop_bot_process(bot_id)
-        time.sleep(1)
-        start_bot_process(bot_id)
+        # apply_bot_config может ждать подтверждения бота до BOT_CONFIG_ACK_TIMEOUT_SECONDS
+        bot.send_message(user_id, f"⏳ Ключ сохранен, применяю настройки бота #{bot_id}...")
+        applied_note = "настройки применены без перезапуска" if apply_bot_config(bot_id) else "бот перезапущен"
         
-        bot.send_message(target_user_id, f"✅ Ваша заявка на подключение Flyer для бота #{bot_id} была *одобрена*! Система активирована, бот перезапущен.")
+        bot.send_message(target_user_id, f"✅ Ваша заявка на подключение Flyer для бота #{bot_id} была *одобрена*! Система активирована, {applied_note}.")
         bot.edit_message_text(state['original_text'] + "\n\n<b>Статус: ✅ ОДОБРЕНО И КЛЮЧ УСТАНОВЛЕН</b>", ADMIN_ID, state['message_id'], parse_mode="HTML")
         if user_id in user_states: del user_states[user_id]
-        bot.send_message(user_id, "Ключ успешно установлен, бот перезапущен.", reply_markup=create_main_menu(user_id))
+        bot.send_message(user_id, f"Ключ успешно установлен, {applied_note}.", reply_markup=create_main_menu(user_id))
         return
         
     if action == 'admin_change_setting':
@@ -3667,45 +6900,8 @@ def handle_admin_callbacks(call):
             filter_count = int(call.data.split('_')[4])
             bot.edit_message_text("🚀 Запускаю процесс массового перезапуска в фоновом режиме...", user_id, call.message.message_id)
             
-            def mass_restart_thread(admin_id, f_count):
-                all_bots = db_execute("SELECT id, bot_type, status FROM bots WHERE status = 'running'", fetchall=True)
-                restarted_count = 0
-                failed_count = 0
-                
-                bots_to_restart = []
-                if f_count <= 0:
-                    bots_to_restart = all_bots
-                else:
-                    for b in all_bots:
-                        user_c = get_child_bot_user_count(b['id'], b['bot_type'])
-                        if user_c >= f_count:
-                            bots_to_restart.append(b)
-                
-                total_to_restart = len(bots_to_restart)
-                if total_to_restart == 0:
-                    bot.send_message(admin_id, "✅ Ботов, подходящих под фильтр, не найдено.")
-                    return
-
-                for i, bot_info in enumerate(bots_to_restart):
-                    try:
-                        stop_bot_process(bot_info['id'])
-                        time.sleep(0.5)
-                        start_bot_process(bot_info['id'])
-                        restarted_count += 1
-                    except Exception as e:
-                        logging.error(f"Ошибка при перезапуске бота {bot_info['id']}: {e}")
-                        failed_count += 1
-                    time.sleep(0.5)
-                    if (i + 1) % 10 == 0:
-                         try:
-                             bot.send_message(admin_id, f"🔄 Перезапущено {i+1}/{total_to_restart} ботов...")
-                         except: pass
-
-                bot.send_message(admin_id, f"✅ Массовый перезапуск завершен!\n\n"
-                                           f"👍 Успешно: {restarted_count}\n"
-                                           f"👎 С ошибками: {failed_count}")
-
-            threading.Thread(target=mass_restart_thread, args=(user_id, filter_count), daemon=True).start()
+            if not start_mass_job('restart', user_id, filter_count, call.message.message_id):
+                bot.edit_message_text("✅ Ботов, подходящих под фильтр, не найдено.", user_id, call.message.message_id)
         return
 
     # New: Mass start by filter
@@ -3725,47 +6921,8 @@ def handle_admin_callbacks(call):
             filter_count = int(call.data.split('_')[4])
             bot.edit_message_text("🚀 Запускаю процесс массового запуска в фоновом режиме...", user_id, call.message.message_id)
 
-            def mass_start_thread(admin_id, f_count):
-                all_bots = db_execute("SELECT id, bot_type, status FROM bots WHERE status != 'running'", fetchall=True)
-                started_count = 0
-                failed_count = 0
-
-                bots_to_start = []
-                if f_count <= 0:
-                    bots_to_start = all_bots
-                else:
-                    for b in all_bots:
-                        user_c = get_child_bot_user_count(b['id'], b['bot_type'])
-                        if user_c >= f_count:
-                            bots_to_start.append(b)
-
-                total_to_start = len(bots_to_start)
-                if total_to_start == 0:
-                    bot.send_message(admin_id, "✅ Ботов, подходящих под фильтр, не найдено.")
-                    return
-
-                for i, bot_info in enumerate(bots_to_start):
-                    try:
-                        success, start_message = start_bot_process(bot_info['id'])
-                        if success:
-                            started_count += 1
-                        else:
-                            failed_count += 1
-                    except Exception as e:
-                        logging.error(f"Ошибка при запуске бота {bot_info['id']}: {e}")
-                        failed_count += 1
-                    time.sleep(0.5)
-                    if (i + 1) % 10 == 0:
-                        try:
-                            bot.send_message(admin_id, f"▶️ Запущено {i+1}/{total_to_start} ботов...")
-                        except:
-                            pass
-
-                bot.send_message(admin_id, f"✅ Массовый запуск завершен!\n\n"
-                                       f"👍 Успешно: {started_count}\n"
-                                       f"👎 С ошибками: {failed_count}")
-
-            threading.Thread(target=mass_start_thread, args=(user_id, filter_count), daemon=True).start()
+            if not start_mass_job('start', user_id, filter_count, call.message.message_id):
+                bot.edit_message_text("✅ Ботов, подходящих под фильтр, не найдено.", user_id, call.message.message_id)
         return
 
     if call.data.startswith("admin_limit_"):
@@ -3777,15 +6934,16 @@ def handle_admin_callbacks(call):
             new_limit = int(parts[4])
             update_bot_setting(bot_id, 'flyer_limit', new_limit)
             bot_info = get_bot_by_id(bot_id)
+            # apply_bot_config ждет подтверждения бота до BOT_CONFIG_ACK_TIMEOUT_SECONDS — отвечаем на callback заранее
+            bot.answer_callback_query(call.id, f"✅ Лимит для бота #{bot_id} изменен, применяю...")
             
-            stop_bot_process(bot_id)
-            time.sleep(1)
-            start_bot_process(bot_id)
+            hot_applied = apply_bot_config(bot_id)
             
-            bot.answer_callback_query(call.id, f"✅ Лимит для бота #{bot_id} изменен и бот перезапущен.", show_alert=True)
-            bot.edit_message_text(call.message.html_text + f"\n\n<b>Статус: ✅ ОДОБРЕНО (лимит {new_limit})</b>", ADMIN_ID, call.message.message_id, parse_mode="HTML")
+            status_note = "применен без перезапуска" if hot_applied else "бот перезапущен"
+            bot.edit_message_text(call.message.html_text + f"\n\n<b>Статус: ✅ ОДОБРЕНО (лимит {new_limit}, {status_note})</b>", ADMIN_ID, call.message.message_id, parse_mode="HTML")
             try:
-                bot.send_message(bot_info['owner_id'], f"✅ Администратор одобрил смену лимита Flyer для вашего бота #{bot_id} на <b>{new_limit}</b>. Бот был автоматически перезапущен.", parse_mode="HTML")
+                applied_note = "Настройка применена без перезапуска." if hot_applied else "Бот был автоматически перезапущен."
+                bot.send_message(bot_info['owner_id'], f"✅ Администратор одобрил смену лимита Flyer для вашего бота #{bot_id} на <b>{new_limit}</b>. {applied_note}", parse_mode="HTML")
             except Exception as e:
                 logging.warning(f"Не удалось уведомить владельца {bot_info['owner_id']} о смене лимита: {e}")
             return
@@ -3844,7 +7002,11 @@ def handle_admin_callbacks(call):
     elif action == "get" and parts[2] == "logs" and parts[3] == "start":
         cancel_markup = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
         msg = bot.edit_message_text(
-            "<b>Введите ID бота, логи которого вы хотите получить:</b>", 
+            "<b>Введите ID бота, логи которого вы хотите получить:</b>\n\n"
+            "Только ID — последние записи лога.\n"
+            "<code>ID 6h</code> — за последние 6 часов (также <code>30m</code>, <code>2d</code>).\n"
+            "<code>ID 2025-01-31T10:00..2025-01-31T12:00</code> — за интервал.\n"
+            "<code>ID 6h текст</code> или <code>ID текст</code> — только строки с этим текстом.", 
             ADMIN_ID, 
             call.message.message_id,
             reply_markup=cancel_markup,
@@ -3863,40 +7025,29 @@ def handle_admin_callbacks(call):
             bot.delete_message(ADMIN_ID, call.message.message_id)
             bot.send_message(ADMIN_ID, "Рассылка отменена.", reply_markup=create_main_menu(ADMIN_ID))
         elif sub_action == "confirm":
+            if has_running_broadcast():
+                bot.answer_callback_query(call.id, "❌ Уже идет рассылка. Дождитесь завершения или остановите ее.", show_alert=True)
+                return
             message_to_send = bot.send_message(ADMIN_ID, "🚀 Рассылка запущена...")
             try: bot.delete_message(ADMIN_ID, call.message.message_id)
             except: pass
             preview_message_id = int(parts[3])
-            def run_broadcast_thread():
-                users_to_send = db_execute("SELECT user_id FROM users", fetchall=True)
-                success_count, fail_count, total_users = 0, 0, len(users_to_send)
-                start_time = time.time()
-                try:
-                    copied_message = bot.copy_message(ADMIN_ID, ADMIN_ID, preview_message_id)
-                    reply_markup_to_send = copied_message.reply_markup
-                    bot.delete_message(ADMIN_ID, copied_message.message_id)
-                except Exception: reply_markup_to_send = None
-                for i, user in enumerate(users_to_send):
-                    try:
-                        bot.copy_message(user['user_id'], ADMIN_ID, preview_message_id, reply_markup=reply_markup_to_send)
-                        success_count += 1
-                    except Exception: fail_count += 1
-                    time.sleep(0.05) 
-                    if (i + 1) % 20 == 0:
-                        try: bot.edit_message_text(f"🚀 Рассылка... Отправлено {i+1}/{total_users}", ADMIN_ID, message_to_send.message_id)
-                        except telebot.apihelper.ApiTelegramException: pass
-                end_time = time.time()
-                final_text = (f"✅ Рассылка завершена за {end_time - start_time:.2f} сек.\n\n"
-                              f"📬 Всего пользователей: {total_users}\n"
-                              f"👍 Успешно отправлено: {success_count}\n"
-                              f"👎 Ошибок: {fail_count}")
-                final_markup = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_back"))
-                bot.edit_message_text(final_text, ADMIN_ID, message_to_send.message_id, reply_markup=final_markup)
-            threading.Thread(target=run_broadcast_thread, daemon=True).start()
+            # Инлайн-кнопку превью сохраняем в задании, чтобы она пережила перезапуск
+            try:
+                copied_message = bot.copy_message(ADMIN_ID, ADMIN_ID, preview_message_id)
+                reply_markup_to_send = copied_message.reply_markup
+                bot.delete_message(ADMIN_ID, copied_message.message_id)
+            except Exception: reply_markup_to_send = None
+            job_id = create_broadcast_job(ADMIN_ID, preview_message_id, reply_markup_to_send, message_to_send.message_id)
+            threading.Thread(target=run_broadcast_job, args=(job_id,), daemon=True).start()
+        elif sub_action == "stop":
+            job_id = int(parts[3])
+            db_execute("UPDATE broadcast_jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'running'",
+                       (int(time.time()), job_id), commit=True)
+            bot.answer_callback_query(call.id, "Рассылка будет остановлена после текущей пачки.")
 
     elif call.data == "admin_broadcast_bots_confirm":
-        global bots_broadcast_running
-        if bots_broadcast_running:
+        if has_running_bots_broadcast():
             bot.answer_callback_query(call.id, "❌ Уже идет рассылка по ботам. Дождитесь завершения.", show_alert=True)
             return
         state = user_states.get(ADMIN_ID, {})
@@ -3905,63 +7056,15 @@ def handle_admin_callbacks(call):
             bot.answer_callback_query(call.id)
             bot.send_message(ADMIN_ID, "❌ Не выбраны боты для рассылки.")
             return
-        # lock and run
-        bots_broadcast_running = True
+        payload = state.get('payload')
+        if not payload:
+            bot.answer_callback_query(call.id)
+            bot.send_message(ADMIN_ID, "❌ Этот тип контента нельзя разослать через ботов. Отправьте текст или медиа.")
+            return
         bot.answer_callback_query(call.id)
-        progress_msg = bot.send_message(ADMIN_ID, "🚀 Запускаю рассылку по выбранным ботам (очередью)...")
-        preview_msg_id = state.get('preview_message_id')
-        reply_markup_to_send = state.get('reply_markup')
-
-        def run_bots_broadcast(ids, preview_id, reply_markup):
-            global bots_broadcast_running
-            total_bots = len(ids)
-            ok, fail = 0, 0
-            start_ts = time.time()
-            for idx, bid in enumerate(ids):
-                try:
-                    # Each child bot should have its own DB; we broadcast to its users table if exists
-                    bot_type_row = db_execute("SELECT bot_type FROM bots WHERE id = ?", (bid,), fetchone=True)
-                    if not bot_type_row:
-                        fail += 1
-                        continue
-                    btype = bot_type_row['bot_type']
-                    db_file = f"dbs/bot_{bid}_data.db" if btype == 'ref' else f"dbs/bot_{bid}_stars_data.db"
-                    if not os.path.exists(db_file):
-                        fail += 1
-                        continue
-                    try:
-                        child_conn = sqlite3.connect(db_file)
-                        child_conn.row_factory = sqlite3.Row
-                        users_rows = child_conn.cursor().execute("SELECT user_id FROM users").fetchall()
-                        child_conn.close()
-                    except Exception:
-                        fail += 1
-                        continue
-                    sent, skipped = 0, 0
-                    for ur in users_rows:
-                        try:
-                            bot.copy_message(ur['user_id'], ADMIN_ID, preview_id, reply_markup=reply_markup)
-                            sent += 1
-                        except Exception:
-                            skipped += 1
-                        time.sleep(0.03)
-                    ok += 1
-                except Exception:
-                    fail += 1
-                if (idx + 1) % 1 == 0:
-                    try:
-                        bot.edit_message_text(f"🚀 Рассылка по ботам... {idx+1}/{total_bots}", ADMIN_ID, progress_msg.message_id)
-                    except Exception:
-                        pass
-            dur = time.time() - start_ts
-            bots_broadcast_running = False
-            try:
-                bot.edit_message_text(f"✅ Готово. Ботов обработано: {ok}/{total_bots}. Ошибок: {fail}. Время: {dur:.1f} сек.", ADMIN_ID, progress_msg.message_id,
-                                      reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")))
-            except Exception:
-                pass
-
-        threading.Thread(target=run_bots_broadcast, args=(target_bot_ids, preview_msg_id, reply_markup_to_send), daemon=True).start()
+        progress_msg = bot.send_message(ADMIN_ID, "🚀 Запускаю рассылку по выбранным ботам...")
+        job_id = create_bots_broadcast_job(ADMIN_ID, target_bot_ids, payload, state.get('reply_markup'), progress_msg.message_id)
+        threading.Thread(target=run_bots_broadcast_job, args=(job_id,), daemon=True).start()
 
     elif action == "lists":
         sub_action = parts[2]
@@ -3975,12 +7078,13 @@ def handle_admin_callbacks(call):
             bot.edit_message_text("📂 Выберите список для просмотра:", ADMIN_ID, call.message.message_id, reply_markup=markup)
         elif sub_action == "op":
             bots_list = db_execute(
-                "SELECT id, bot_username, owner_id, bot_type FROM bots "
-                "WHERE flyer_op_enabled = 1 OR stars_op_enabled = 1 OR clicker_op_enabled = 1 "
-                "OR (anonchat_flyer_api_key IS NOT NULL AND TRIM(anonchat_flyer_api_key) != '')",
+                "SELECT b.id, b.bot_username, b.owner_id, b.bot_type, COALESCE(c.user_count, 0) AS user_count "
+                "FROM bots b LEFT JOIN bot_user_counts c ON c.bot_id = b.id "
+                "WHERE b.flyer_op_enabled = 1 OR b.stars_op_enabled = 1 OR b.clicker_op_enabled = 1 "
+                "OR (b.anonchat_flyer_api_key IS NOT NULL AND TRIM(b.anonchat_flyer_api_key) != '')",
                 fetchall=True
             )
-            text = "<b>🤖 Боты с подключенным Flyer ОП:</b>\n\n" + ('\n'.join([f"- ID: <code>{b['id']}</code> (@{escape(b['bot_username'] or 'N/A')}) | Владелец: <code>{b['owner_id']}</code> | 👥 {get_child_bot_user_count(b['id'], b['bot_type'])}" for b in bots_list]) or "Список пуст.")
+            text = "<b>🤖 Боты с подключенным Flyer ОП:</b>\n\n" + ('\n'.join([f"- ID: <code>{b['id']}</code> (@{escape(b['bot_username'] or 'N/A')}) | Владелец: <code>{b['owner_id']}</code> | 👥 {b['user_count']}" for b in bots_list]) or "Список пуст.")
             markup = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад к спискам", callback_data="admin_lists_menu"))
             bot.edit_message_text(text, ADMIN_ID, call.message.message_id, parse_mode="HTML", reply_markup=markup)
         # Удален подраздел "creator" (Пользователи конструктора)
@@ -4009,7 +7113,11 @@ def handle_admin_callbacks(call):
             offset = page * BOTS_PER_PAGE
             
             total_bots_count = db_execute("SELECT COUNT(*) FROM bots", fetchone=True)[0]
-            all_bots = db_execute("SELECT id, bot_username, status, bot_type FROM bots ORDER BY id DESC LIMIT ? OFFSET ?", (BOTS_PER_PAGE, offset), fetchall=True)
+            all_bots = db_execute(
+                "SELECT b.id, b.bot_username, b.status, b.bot_type, COALESCE(c.user_count, 0) AS user_count "
+                "FROM bots b LEFT JOIN bot_user_counts c ON c.bot_id = b.id ORDER BY b.id DESC LIMIT ? OFFSET ?",
+                (BOTS_PER_PAGE, offset), fetchall=True
+            )
             
             text = f"<b>📋 Список всех ботов (Страница {page + 1}):</b>\n\n"
             if not all_bots:
@@ -4018,7 +7126,7 @@ def handle_admin_callbacks(call):
                 status_icons = {'running': '🟢', 'stopped': '🔴', 'unconfigured': '⚠️'}
                 for b in all_bots:
                     icon = status_icons.get(b['status'], '❓')
-                    user_count = get_child_bot_user_count(b['id'], b['bot_type'])
+                    user_count = b['user_count']
                     username = escape(b['bot_username'] or 'Без имени')
                     text += f"{icon} ID: <code>{b['id']}</code> | @{username} | 👥 {user_count}\n"
 
@@ -4049,13 +7157,15 @@ def handle_admin_callbacks(call):
         elif sub_action == "removekey":
             bot_info = get_bot_by_id(bot_id)
             if bot_info['bot_type'] == 'ref':
-                update_bot_setting(bot_id, 'flyer_api_key', None); update_bot_setting(bot_id, 'flyer_op_enabled', False)
+                update_bot_settings(bot_id, {'flyer_api_key': None, 'flyer_op_enabled': False})
             elif bot_info['bot_type'] == 'stars':
-                update_bot_setting(bot_id, 'stars_flyer_api_key', None); update_bot_setting(bot_id, 'stars_op_enabled', False)
+                update_bot_settings(bot_id, {'stars_flyer_api_key': None, 'stars_op_enabled': False})
             elif bot_info['bot_type'] == 'clicker':
-                update_bot_setting(bot_id, 'clicker_flyer_api_key', None); update_bot_setting(bot_id, 'clicker_op_enabled', False)
+                update_bot_settings(bot_id, {'clicker_flyer_api_key': None, 'clicker_op_enabled': False})
             elif bot_info['bot_type'] == 'anonchat':
-                update_bot_setting(bot_id, 'anonchat_flyer_api_key', None)
+                update_bot_settings(bot_id, {'anonchat_flyer_api_key': None})
+            elif bot_info['bot_type'] == 'cashlait':
+                update_bot_settings(bot_id, {'cashlait_flyer_api_key': None, 'flyer_op_enabled': False})
             bot.answer_callback_query(call.id, "✅ Ключ Flyer для бота удален! Перезапустите бота, чтобы применить.", show_alert=True)
             show_admin_bot_info(call.from_user.id, call.message.message_id, bot_id)
         elif sub_action == "restart":
@@ -4120,6 +7230,18 @@ def handle_admin_callbacks(call):
             return
         return
 
+    elif action == "stats":
+        if parts[2] == "recompute":
+            bot.edit_message_text("⏳ Пересчитываю дневные сводки...", ADMIN_ID, call.message.message_id)
+            try:
+                days = recompute_stats_daily()
+                logging.info(f"Сводки статистики пересчитаны за {days} дн.")
+            except Exception as e:
+                logging.error(f"Не удалось пересчитать сводки статистики: {e}", exc_info=True)
+                bot.send_message(ADMIN_ID, f"❌ Пересчет сводок не удался: {e}")
+        text, markup = render_admin_stats()
+        bot.edit_message_text(text, ADMIN_ID, call.message.message_id, parse_mode="HTML", reply_markup=markup)
+
     elif action == "wd":
         wd_action = parts[2]
         if wd_action == "list":
@@ -4178,7 +7300,7 @@ def show_admin_bot_info(user_id, message_id, bot_id):
     owner_username = escape(owner_info['username'] or "N/A") if owner_info else "N/A"
     bot_username_value = bot_info['bot_username'] or "N/A"
     bot_username = escape(bot_username_value)
-    user_count = get_child_bot_user_count(bot_id, bot_info['bot_type'])
+    user_count = get_cached_bot_user_count(bot_id, bot_info['bot_type'])
     
     flyer_key = None
     flyer_enabled = False
@@ -4225,24 +7347,72 @@ def show_admin_bot_info(user_id, message_id, bot_id):
     try: bot.edit_message_text(text, user_id, message_id, parse_mode="HTML", reply_markup=markup)
     except telebot.apihelper.ApiTelegramException: pass
 
+FLYER_KEY_COLUMNS = {
+    'ref': 'flyer_api_key',
+    'stars': 'stars_flyer_api_key',
+    'clicker': 'clicker_flyer_api_key',
+    'anonchat': 'anonchat_flyer_api_key',
+}
+
 def get_bot_flyer_key_for_check(bot_id):
-    bot_info = db_execute(
-        "SELECT bot_type, flyer_api_key, stars_flyer_api_key, clicker_flyer_api_key, anonchat_flyer_api_key FROM bots WHERE id = ?",
-        (bot_id,),
-        fetchone=True
-    )
-    if not bot_info:
-        return None
-    key_map = {
-        'ref': 'flyer_api_key',
-        'stars': 'stars_flyer_api_key',
-        'clicker': 'clicker_flyer_api_key',
-        'anonchat': 'anonchat_flyer_api_key',
-    }
-    column = key_map.get(bot_info['bot_type'])
-    if column:
-        return bot_info[column]
-    return None
+    return get_flyer_keys_for_bots([bot_id]).get(bot_id)
+
+def get_flyer_keys_for_bots(bot_ids):
+    """Flyer-ключи для пачки ботов одним запросом: {bot_id: key}."""
+    bot_ids = list(bot_ids)
+    if not bot_ids:
+        return {}
+    rows = db_execute(
+        f"SELECT id, bot_type, flyer_api_key, stars_flyer_api_key, clicker_flyer_api_key, anonchat_flyer_api_key FROM bots "
+        f"WHERE id IN ({','.join('?' * len(bot_ids))})",
+        bot_ids,
+        fetchall=True
+    ) or []
+    keys = {}
+    for row in rows:
+        column = FLYER_KEY_COLUMNS.get(row['bot_type'])
+        if column and row[column]:
+            keys[row['id']] = row[column]
+    return keys
+
+class FlyerClientPool:
+    """Долгоживущие клиенты Flyer по ключу API, у каждого ключа свой семафор и лимит запросов."""
+
+    def __init__(self, concurrency, rate):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.entries = {}  # key -> {'client', 'semaphore', 'bucket', 'used_at'}
+
+    def get(self, api_key):
+        entry = self.entries.get(api_key)
+        if entry is None:
+            entry = {
+                'client': Flyer(key=api_key),
+                'semaphore': asyncio.Semaphore(self.concurrency),
+                'bucket': TokenBucket(self.rate),
+            }
+            self.entries[api_key] = entry
+        entry['used_at'] = time.time()
+        return entry
+
+    async def check_task(self, api_key, signature):
+        entry = self.get(api_key)
+        async with entry['semaphore']:
+            await entry['bucket'].acquire_async()
+            return await entry['client'].check_task(signature=signature)
+
+    async def evict_idle(self, idle_seconds):
+        now = time.time()
+        for api_key, entry in list(self.entries.items()):
+            if now - entry['used_at'] < idle_seconds:
+                continue
+            del self.entries[api_key]
+            close = getattr(entry['client'], 'close', None)
+            if close:
+                try:
+                    await close()
+                except Exception:
+                    pass
 
 def run_hold_checker():
     if not FLYER_IMPORTED_FOR_CHECKER:
@@ -4250,31 +7420,57 @@ def run_hold_checker():
         return
         
     logging.info("[HOLD_CHECKER] Воркер проверки холда запущен.")
-    
-    async def check_task_async(flyer_client, task):
+    flyer_pool = FlyerClientPool(FLYER_CHECK_CONCURRENCY_PER_KEY, FLYER_CHECK_RATE_PER_SECOND)
+
+    async def check_task_async(api_key, task):
+        """Возвращает статус задачи от Flyer или None, если проверить не удалось."""
         try:
-            status = await flyer_client.check_task(signature=task['task_signature'])
+            status = await flyer_pool.check_task(api_key, task['task_signature'])
             logging.info(f"[HOLD_CHECKER] Проверка задачи {task['id']} ({task['task_signature']}). Статус от Flyer: {status}")
-            
-            if status == 'complete':
-                with db_lock:
-                    conn.execute("UPDATE users SET balance = balance + ?, frozen_balance = frozen_balance - ? WHERE user_id = ?",
-                                 (task['amount'], task['amount'], task['owner_id']))
-                    conn.execute("DELETE FROM pending_flyer_rewards WHERE id = ?", (task['id'],))
-                    conn.commit()
-                logging.info(f"[HOLD_CHECKER] Успех! ID:{task['id']}. Статус 'complete'. {task['amount']} руб. переведено владельцу {task['owner_id']}.")
-            elif status in ('abort', 'incomplete'):
-                with db_lock:
-                    conn.execute("UPDATE users SET frozen_balance = frozen_balance - ? WHERE user_id = ?", 
-                                 (task['amount'], task['owner_id']))
-                    conn.execute("DELETE FROM pending_flyer_rewards WHERE id = ?", (task['id'],))
-                    conn.commit()
-                logging.warning(f"[HOLD_CHECKER] Отмена! ID:{task['id']}. Статус '{status}'. Холд {task['amount']} руб. для {task['owner_id']} аннулирован.")
-        
+            return status
         except FlyerAPIError as e:
             logging.error(f"[HOLD_CHECKER] Ошибка API Flyer при проверке задачи {task['id']}: {e}")
         except Exception as e:
             logging.error(f"[HOLD_CHECKER] Необработанная ошибка при асинхронной проверке задачи {task['id']}: {e}")
+        return None
+
+    def apply_hold_results(results):
+        """Применяет итоги прохода одной транзакцией. results — список (task, status)."""
+        completed, cancelled, failed = [], [], []
+        now = datetime.utcnow()
+        for task, status in results:
+            if status == 'complete':
+                completed.append(task)
+            elif status in ('abort', 'incomplete'):
+                cancelled.append(task)
+            elif status is None:
+                # Ошибка проверки: следующий раз не раньше чем через экспоненциальную задержку
+                error_count = (task['error_count'] or 0) + 1
+                delay = min(FLYER_CHECK_ERROR_BASE_DELAY * 2 ** (error_count - 1), FLYER_CHECK_ERROR_MAX_DELAY)
+                failed.append((error_count, (now + timedelta(seconds=delay)).isoformat(), task['id']))
+        if not (completed or cancelled or failed):
+            return
+        with db_lock:
+            try:
+                conn.executemany("UPDATE users SET balance = balance + ?, frozen_balance = frozen_balance - ? WHERE user_id = ?",
+                                 [(t['amount'], t['amount'], t['owner_id']) for t in completed])
+                conn.executemany("UPDATE users SET frozen_balance = frozen_balance - ? WHERE user_id = ?",
+                                 [(t['amount'], t['owner_id']) for t in cancelled])
+                conn.executemany("DELETE FROM pending_flyer_rewards WHERE id = ?", [(t['id'],) for t in completed + cancelled])
+                conn.executemany("UPDATE pending_flyer_rewards SET error_count = ?, check_after_timestamp = ? WHERE id = ?", failed)
+                add_stats_increments(conn, [('hold_checks', 'complete', len(completed)),
+                                            ('hold_checks', 'cancelled', len(cancelled)),
+                                            ('hold_checks', 'error', len(failed))])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        for task in completed:
+            logging.info(f"[HOLD_CHECKER] Успех! ID:{task['id']}. Статус 'complete'. {task['amount']} руб. переведено владельцу {task['owner_id']}.")
+        for task in cancelled:
+            logging.warning(f"[HOLD_CHECKER] Отмена! ID:{task['id']}. Холд {task['amount']} руб. для {task['owner_id']} аннулирован.")
+        if failed:
+            logging.warning(f"[HOLD_CHECKER] {len(failed)} задач не удалось проверить, повтор отложен.")
 
     async def main_check_loop():
         while True:
@@ -4284,138 +7480,249 @@ def run_hold_checker():
 
                 if pending_tasks:
                     logging.info(f"[HOLD_CHECKER] Найдено {len(pending_tasks)} задач для проверки.")
-                    tasks_by_bot = {}
+                    api_keys = get_flyer_keys_for_bots({task['bot_id'] for task in pending_tasks})
+                    checks = []
+                    results = []
                     for task in pending_tasks:
-                        tasks_by_bot.setdefault(task['bot_id'], []).append(task)
-
-                    for bot_id, tasks in tasks_by_bot.items():
-                        api_key = get_bot_flyer_key_for_check(bot_id)
+                        api_key = api_keys.get(task['bot_id'])
                         if not api_key:
-                            logging.warning(f"[HOLD_CHECKER] Не найден Flyer API ключ для бота {bot_id}. Пропускаем {len(tasks)} задач.")
+                            # Без ключа проверить нельзя — считаем ошибкой, чтобы не дергать задачу каждый проход
+                            results.append((task, None))
                             continue
-                        
-                        try:
-                            flyer_client = Flyer(key=api_key)
-                            async_tasks = [check_task_async(flyer_client, task) for task in tasks]
-                            await asyncio.gather(*async_tasks)
-                            await flyer_client.close()
-                        except Exception as e:
-                            logging.error(f"[HOLD_CHECKER] Критическая ошибка при обработке пачки задач для бота {bot_id}: {e}")
-                
+                        checks.append((task, check_task_async(api_key, task)))
+                    missing_keys = {task['bot_id'] for task, _ in results}
+                    if missing_keys:
+                        logging.warning(f"[HOLD_CHECKER] Не найден Flyer API ключ для ботов {sorted(missing_keys)}. Их задачи отложены.")
+                    statuses = await asyncio.gather(*(coro for _, coro in checks))
+                    results.extend(zip((task for task, _ in checks), statuses))
+                    apply_hold_results(results)
+                await flyer_pool.evict_idle(FLYER_CLIENT_IDLE_SECONDS)
+
             except Exception as e:
                 logging.critical(f"[HOLD_CHECKER] Критическая ошибка во внешнем цикле воркера: {e}", exc_info=True)
             
-            await asyncio.sleep(300)
+            await asyncio.sleep(HOLD_CHECK_INTERVAL_SECONDS)
 
     asyncio.run_coroutine_threadsafe(main_check_loop(), async_loop)
  # -------------------- НАЧАЛО БЛОКА МОНИТОРИНГА ПАМЯТИ --------------------
 
 
-# Глобальный словарь для хранения предыдущих значений памяти {pid: memory_mb}
-# Он нужен, чтобы сравнивать "было" и "стало".
+# Один проход psutil по конструктору и всем дочерним процессам раз в минуту.
+# Замеры ложатся в кольцевые буферы bot_resource_samples (1 мин / 1 ч / 1 сут):
+# номер ячейки — (время // шаг) % число ячеек, поэтому таблица не растет.
+# Грубые разрешения хранят среднее по всем замерам своего интервала.
+
+# Объекты psutil.Process живут между проходами: cpu_percent(interval=None)
+# считает загрузку относительно предыдущего вызова на том же объекте и не блокирует.
+sampled_processes = {}
 previous_memory_usage = {}
-memory_lock = threading.Lock() # Для безопасной работы с переменной из потока
+resource_leak_alerts = {}
+
+RESOURCE_SAMPLE_UPSERT_SQL = '''
+    INSERT INTO bot_resource_samples
+        (resolution, bot_id, slot, bucket, ts, samples, pid, rss_mb, cpu_percent, open_fds, threads, db_size_bytes)
+    VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(resolution, bot_id, slot) DO UPDATE SET
+        samples = CASE WHEN bucket = excluded.bucket THEN samples + 1 ELSE 1 END,
+        rss_mb = CASE WHEN bucket = excluded.bucket THEN (rss_mb * samples + excluded.rss_mb) / (samples + 1) ELSE excluded.rss_mb END,
+        cpu_percent = CASE WHEN bucket = excluded.bucket THEN (cpu_percent * samples + excluded.cpu_percent) / (samples + 1) ELSE excluded.cpu_percent END,
+        open_fds = excluded.open_fds,
+        threads = excluded.threads,
+        db_size_bytes = excluded.db_size_bytes,
+        pid = excluded.pid,
+        bucket = excluded.bucket,
+        ts = excluded.ts
+'''
+
+def get_file_size_with_wal(path):
+    total = None
+    for candidate in (path, f"{path}-wal"):
+        try:
+            total = (total or 0) + os.path.getsize(candidate)
+        except OSError:
+            continue
+    return total
 
-def memory_monitor_worker():
-    """
-    Эта функция работает в фоне, в бесконечном цикле.
-    Каждые 5 минут она собирает данные о памяти и записывает их в файл.
+def identify_process_source(proc, main_pid):
+    """Возвращает bot_id процесса: 0 — конструктор, -N — хост ботов #N, None — чужой процесс.
+
+    start_bot_process запускает ботов как [python, script, str(bot_id)], хосты — как
+    [python, bot_host.py, str(host_id)]. Дети зиготы наследуют ее argv, их знает сама зигота.
     """
+    if proc.pid == main_pid:
+        return 0
+    zygote_bot_id = bot_zygote.bot_of(proc.pid)
+    if zygote_bot_id is not None:
+        return zygote_bot_id
+    try:
+        cmdline = proc.cmdline()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+    if len(cmdline) < 3 or not cmdline[-1].isdigit():
+        return None
+    if os.path.basename(cmdline[-2]) == BOT_HOST_SCRIPT_NAME:
+        return -int(cmdline[-1])
+    return int(cmdline[-1])
+
+def collect_resource_samples():
+    """Один неблокирующий проход по процессам. Возвращает {bot_id: замер}."""
+    main_process = sampled_processes.get(os.getpid()) or psutil.Process(os.getpid())
+    current = {main_process.pid: main_process}
+    for child in main_process.children(recursive=True):
+        current[child.pid] = sampled_processes.get(child.pid) or child
+    sampled_processes.clear()
+    sampled_processes.update(current)
+
+    samples = {}
+    for proc in current.values():
+        source_id = identify_process_source(proc, main_process.pid)
+        if source_id is None:
+            continue
+        try:
+            with proc.oneshot():
+                sample = {
+                    'pid': proc.pid,
+                    'rss_mb': proc.memory_info().rss / (1024 * 1024),
+                    'cpu_percent': proc.cpu_percent(interval=None),
+                    'threads': proc.num_threads(),
+                    'open_fds': proc.num_fds() if hasattr(proc, 'num_fds') else proc.num_handles(),
+                    'db_size_bytes': None,
+                }
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        samples[source_id] = sample
+
+    samples[0]['db_size_bytes'] = get_file_size_with_wal(DB_NAME)
+    # Размер БД пишем по каждому запущенному боту, включая тенантов хостов
+    running_bots = db_execute("SELECT id, bot_type FROM bots WHERE status = 'running'", fetchall=True) or []
+    for row in running_bots:
+        db_size = get_file_size_with_wal(get_child_bot_db_path(row['id'], row['bot_type']))
+        if row['id'] in samples:
+            samples[row['id']]['db_size_bytes'] = db_size
+        elif db_size is not None:
+            samples[row['id']] = {'pid': None, 'rss_mb': None, 'cpu_percent': None, 'threads': None, 'open_fds': None, 'db_size_bytes': db_size}
+    return samples
+
+def store_resource_samples(samples, now_ts):
+    rows = []
+    for resolution, (step, capacity) in RESOURCE_RETENTION.items():
+        bucket = now_ts // step
+        for source_id, sample in samples.items():
+            rows.append((
+                resolution, source_id, bucket % capacity, bucket, now_ts, sample['pid'],
+                sample['rss_mb'], sample['cpu_percent'], sample['open_fds'], sample['threads'], sample['db_size_bytes']
+            ))
+    with db_lock:
+        conn.executemany(RESOURCE_SAMPLE_UPSERT_SQL, rows)
+        conn.commit()
+
+def check_resource_leaks(now_ts):
+    """Ищет ботов, у которых RSS растет каждый час быстрее RESOURCE_LEAK_ALERT_MB_PER_HOUR."""
+    step = RESOURCE_RETENTION['1h'][0]
+    since_ts = now_ts - step * (RESOURCE_LEAK_WINDOW_HOURS + 1)
+    rows = db_execute(
+        "SELECT bot_id, bucket, rss_mb FROM bot_resource_samples "
+        "WHERE resolution = '1h' AND ts >= ? AND rss_mb IS NOT NULL ORDER BY bot_id, bucket",
+        (since_ts,), fetchall=True
+    ) or []
+    series = {}
+    for row in rows:
+        series.setdefault(row['bot_id'], []).append(row['rss_mb'])
+    for source_id, values in series.items():
+        if len(values) < RESOURCE_LEAK_WINDOW_HOURS:
+            continue
+        values = values[-RESOURCE_LEAK_WINDOW_HOURS:]
+        growth = [b - a for a, b in zip(values, values[1:])]
+        if not growth or min(growth) < RESOURCE_LEAK_ALERT_MB_PER_HOUR:
+            continue
+        if now_ts - resource_leak_alerts.get(source_id, 0) < RESOURCE_LEAK_ALERT_COOLDOWN_SECONDS:
+            continue
+        resource_leak_alerts[source_id] = now_ts
+        if source_id == 0:
+            source_name = "Конструктор"
+        elif source_id < 0:
+            source_name = f"Хост ботов #{-source_id}"
+        else:
+            source_name = f"Бот #{source_id}"
+        per_hour = sum(growth) / len(growth)
+        logging.warning(f"{source_name}: RSS растет на {per_hour:.1f} МБ/ч ({values[0]:.1f} → {values[-1]:.1f} МБ).")
+        try:
+            bot.send_message(ADMIN_ID, f"⚠️ {source_name}: память растет на {per_hour:.1f} МБ/ч последние {RESOURCE_LEAK_WINDOW_HOURS} ч. ({values[0]:.1f} → {values[-1]:.1f} МБ). Возможна утечка.")
+        except Exception as e:
+            logging.warning(f"Не удалось отправить оповещение об утечке памяти: {e}")
+
+def write_memory_report(samples):
     global previous_memory_usage
-    
+    report_lines = [f"🧠 Отчет по памяти от {time.strftime('%Y-%m-%d %H:%M:%S')}", "=" * 40]
+    total_current_mem = 0
+    total_delta = 0
+    children = []
+    for source_id, sample in sorted(samples.items()):
+        if sample['rss_mb'] is None:
+            continue
+        mem = sample['rss_mb']
+        delta = mem - previous_memory_usage.get(sample['pid'], 0)
+        total_current_mem += mem
+        total_delta += delta
+        sign = '+' if delta >= 0 else ''
+        if source_id == 0:
+            report_lines.append(f"🔵 Главный бот (PID {sample['pid']}):")
+            report_lines.append(f"   - Текущее: {mem:.2f} МБ (Изменение: {sign}{delta:.2f} МБ)")
+        else:
+            label = f"хост {-source_id}" if source_id < 0 else str(source_id)
+            children.append(f"   - ID: {label:<5} (PID {sample['pid']}): {mem:.2f} МБ ({sign}{delta:.2f} МБ)")
+    if children:
+        report_lines.append(f"\n🤖 Дочерние процессы ({len(children)} шт.):")
+        report_lines.extend(children)
+    total_sign = '+' if total_delta >= 0 else ''
+    report_lines.append("=" * 40)
+    report_lines.append(f"📊 ИТОГО:")
+    report_lines.append(f"   - Текущее потребление: {total_current_mem:.2f} МБ")
+    report_lines.append(f"   - Суммарное изменение: {total_sign}{total_delta:.2f} МБ за {RESOURCE_SAMPLE_INTERVAL_SECONDS // 60} мин.")
+    crypto_stats = crypto_pay_service.stats()
+    report_lines.append(f"\n💳 Crypto Pay:")
+    report_lines.append(f"   - Очередь: {crypto_stats['queued']}, выполняется: {crypto_stats['inflight']}")
+    report_lines.append(f"   - Задержка p50/p95: {crypto_stats['latency_p50'] * 1000:.0f}/{crypto_stats['latency_p95'] * 1000:.0f} мс, "
+                        f"ожидание в очереди p95: {crypto_stats['queue_wait_p95'] * 1000:.0f} мс")
+    report_lines.append(f"   - Успешно: {crypto_stats['ok']}, ошибок: {crypto_stats['error']}, "
+                        f"таймаутов: {crypto_stats['timeout']}, отклонено: {crypto_stats['rejected']}")
+    with open('memory_usage_report.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(report_lines))
+    previous_memory_usage = {sample['pid']: sample['rss_mb'] for sample in samples.values() if sample['pid']}
+
+def memory_monitor_worker():
+    """Фоновый сборщик телеметрии: замер, запись в кольцевые буферы, проверка утечек, отчет в файл."""
     while True:
         try:
-            # --- Сбор текущих данных ---
-            main_process = psutil.Process(os.getpid())
-            current_processes = [main_process] + main_process.children(recursive=True)
-            
-            # Словарь для хранения данных этого замера: {pid: (mem_mb, delta_mb, bot_id_str)}
-            current_usage_data = {}
-            
-            # Блокируем доступ к общей переменной, чтобы безопасно ее прочитать
-            with memory_lock:
-                for proc in current_processes:
-                    try:
-                        mem_mb = proc.memory_info().rss / 1024 / 1024
-                        # Получаем старое значение, если его нет - считаем 0
-                        prev_mem_mb = previous_memory_usage.get(proc.pid, 0)
-                        delta_mb = mem_mb - prev_mem_mb
-                        
-                        # Пытаемся определить ID дочернего бота
-                        bot_id_str = '???'
-                        if proc.pid != main_process.pid:
-                            cmd_line = " ".join(proc.cmdline())
-                            if '--bot-id' in cmd_line:
-                                bot_id_str = cmd_line.split('--bot-id')[-1].strip()
-
-                        current_usage_data[proc.pid] = (mem_mb, delta_mb, bot_id_str)
-                    except psutil.NoSuchProcess:
-                        # Процесс мог умереть, пока мы его проверяли
-                        continue
-            
-            # --- Формирование отчета ---
-            report_lines = []
-            report_lines.append(f"🧠 Отчет по памяти от {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            report_lines.append("=" * 40)
-            
-            total_current_mem = 0
-            total_delta = 0
-            
-            # Отчет по главному процессу
-            if main_process.pid in current_usage_data:
-                mem, delta, _ = current_usage_data[main_process.pid]
-                total_current_mem += mem
-                total_delta += delta
-                sign = '+' if delta >= 0 else ''
-                report_lines.append(f"🔵 Главный бот (PID {main_process.pid}):")
-                report_lines.append(f"   - Текущее: {mem:.2f} МБ (Изменение: {sign}{delta:.2f} МБ)")
-
-            # Отчет по дочерним ботам
-            children_count = len(current_usage_data) - 1
-            if children_count > 0:
-                report_lines.append(f"\n🤖 Дочерние боты ({children_count} шт.):")
-                for pid, (mem, delta, bot_id) in current_usage_data.items():
-                    if pid == main_process.pid: continue
-                    total_current_mem += mem
-                    total_delta += delta
-                    sign = '+' if delta >= 0 else ''
-                    report_lines.append(f"   - ID: {bot_id:<5} (PID {pid}): {mem:.2f} МБ ({sign}{delta:.2f} МБ)")
-
-            # --- Итоговая сводка ---
-            total_sign = '+' if total_delta >= 0 else ''
-            report_lines.append("=" * 40)
-            report_lines.append(f"📊 ИТОГО:")
-            report_lines.append(f"   - Текущее потребление: {total_current_mem:.2f} МБ")
-            report_lines.append(f"   - Суммарное изменение: {total_sign}{total_delta:.2f} МБ за 5 мин.")
-            
-            # --- Запись в файл ---
-            with open('memory_usage_report.txt', 'w', encoding='utf-8') as f:
-                f.write('\n'.join(report_lines))
-            
-            # --- Обновление "предыдущего" состояния для следующего замера ---
-            with memory_lock:
-                previous_memory_usage = {pid: data[0] for pid, data in current_usage_data.items()}
-
+            now_ts = int(time.time())
+            samples = collect_resource_samples()
+            store_resource_samples(samples, now_ts)
+            check_resource_leaks(now_ts)
+            write_memory_report(samples)
         except Exception as e:
-            # Если что-то пошло не так, записываем ошибку в тот же файл
-            with open('memory_usage_report.txt', 'w', encoding='utf-8') as f:
-                f.write(f"Произошла ошибка в мониторинге памяти: {e}")
-        
-        # Ждем 5 минут (300 секунд) до следующей проверки
-        time.sleep(300)
+            logging.error(f"Ошибка в сборщике телеметрии ресурсов: {e}", exc_info=True)
+            try:
+                with open('memory_usage_report.txt', 'w', encoding='utf-8') as f:
+                    f.write(f"Произошла ошибка в мониторинге памяти: {e}")
+            except OSError:
+                pass
+        time.sleep(RESOURCE_SAMPLE_INTERVAL_SECONDS)
 
 def start_memory_monitor():
     """Запускает фоновый поток для мониторинга памяти."""
     monitor_thread = threading.Thread(target=memory_monitor_worker, daemon=True)
     monitor_thread.start()
-    # Эта строка появится в твоих логах при запуске, чтобы ты знал, что все работает
-    print("✅ Фоновый мониторинг памяти запущен. Файл 'memory_usage_report.txt' будет обновляться каждые 5 минут.")
+    print(f"✅ Фоновый мониторинг ресурсов запущен. Замеры каждые {RESOURCE_SAMPLE_INTERVAL_SECONDS} сек. пишутся в bot_resource_samples.")
 
 # -------------------- КОНЕЦ БЛОКА МОНИТОРИНГА ПАМЯТИ --------------------
 
 if __name__ == '__main__':
     # <-- Этот код имеет отступ в 4 пробела
-    init_db()
+    try:
+        init_db()
+    except RuntimeError as e:
+        logging.critical(f"Запуск остановлен: {e}")
+        sys.exit(1)
     
     # Load MAX_BOTS_PER_USER from settings
     try:
@@ -4435,21 +7742,24 @@ if __name__ == '__main__':
                 saved_token = None
             if saved_token:
                 CRYPTO_PAY_TOKEN = saved_token
-                try:
-                    crypto_pay = AioCryptoPay(token=CRYPTO_PAY_TOKEN, network=Networks.MAIN_NET)
-                except Exception as e:
-                    logging.error(f"Ошибка инициализации Crypto Pay при старте: {e}")
-                    crypto_pay = None
     except Exception as e:
         logging.warning(f"Не удалось загрузить сохраненный токен Crypto Pay: {e}")
     logging.info("Запускаем фоновый event loop для asyncio...")
     loop_thread.start()
+    crypto_pay_service.start()
     start_memory_monitor()
+    threading.Thread(target=log_rotation_worker, daemon=True).start()
     cleanup_thread = threading.Thread(target=cleanup_stale_states, daemon=True)
     cleanup_thread.start()
     logging.info("Запущен воркер для очистки зависших состояний.")
 
     threading.Thread(target=run_hold_checker, daemon=True).start()
+    threading.Thread(target=bot_user_counts_worker, daemon=True).start()
+    threading.Thread(target=stats_rollup_worker, daemon=True).start()
+    rebuild_bot_catalogue()
+    resume_mass_jobs()
+    resume_bots_broadcast_jobs()
+    resume_broadcast_jobs()
 
     def run_payment_checker():
         # <-- Этот код имеет отступ в 8 пробелов
@@ -4459,118 +7769,38 @@ if __name__ == '__main__':
                 logging.warning("Проверка платежей Crypto Pay не запущена: API не инициализирован.")
                 return
 
+            interval = CRYPTO_RECONCILE_INTERVAL_SECONDS
+            if CRYPTO_PAY_WEBHOOK_PORT:
+                try:
+                    await start_crypto_pay_webhook()
+                    interval = CRYPTO_RECONCILE_FALLBACK_INTERVAL_SECONDS
+                except Exception as e:
+                    logging.error(f"Не удалось запустить вебхук Crypto Pay, остается только опрос: {e}")
+
             while True:
                 try:
-                    pending_invoices = db_execute("SELECT invoice_id, bot_id FROM crypto_payments WHERE status = 'pending'", fetchall=True)
-                    if pending_invoices:
-                        invoice_ids = [str(inv['invoice_id']) for inv in pending_invoices]
-                        checked_invoices = await local_crypto.get_invoices(invoice_ids=",".join(invoice_ids))
-                        
-                        for invoice in checked_invoices:
-                            if invoice.status == 'paid':
-                                payment_info = db_execute("SELECT bot_id, user_id FROM crypto_payments WHERE invoice_id = ?", (invoice.invoice_id,), fetchone=True)
-                                if payment_info:
-                                    bot_id_to_update = payment_info['bot_id']
-                                    # Проверяем, это VIP или Креатор по payload
-                                    if invoice.payload.startswith('vip_'):
-                                        owner_id_vip = get_bot_by_id(bot_id_to_update)['owner_id'] if bot_id_to_update else payment_info['user_id']
-                                        update_bot_setting(bot_id_to_update, 'vip_status', True)
-                                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice.invoice_id,), commit=True)
-                                        logging.info(f"VIP статус для бота {bot_id_to_update} активирован после оплаты счета #{invoice.invoice_id}")
-                                        try:
-                                            bot.send_message(owner_id_vip, f"✅ VIP-статус для вашего бота #{bot_id_to_update} успешно активирован!")
-                                        except Exception as e:
-                                            logging.error(f"Не удалось уведомить владельца {owner_id_vip} о VIP: {e}")
-                                    elif invoice.payload.startswith('cashlait_new_'):
-                                        # Оплата CashLait без bot_id: создаем бота для оплатившего пользователя
-                                        owner_id_new = payment_info['user_id']
-                                        cashlait_bot_id = create_bot_in_db(owner_id_new, 'cashlait')
-                                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice.invoice_id,), commit=True)
-                                        logging.info(f"Бот CashLait {cashlait_bot_id} создан после оплаты счета #{invoice.invoice_id} (новая покупка)")
-                                        try:
-                                            bot.send_message(owner_id_new, f"✅ Оплата прошла успешно! CashLait бот #{cashlait_bot_id} создан! Теперь он в списке ваших ботов.")
-                                        except Exception as e:
-                                            logging.error(f"Не удалось уведомить покупателя {owner_id_new} о создании CashLait: {e}")
-                                        # Уведомляем администратора о покупке
-                                        try:
-                                            buyer = get_user(owner_id_new)
-                                            bot.send_message(ADMIN_ID, f"🛒 Покупка CashLait (фон): пользователь <code>{owner_id_new}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice.invoice_id}. Создан бот #{cashlait_bot_id}.", parse_mode="HTML")
-                                        except Exception as e:
-                                            logging.warning(f"Не удалось уведомить админа о фоновой покупке CashLait: {e}")
-                                    elif invoice.payload.startswith('creator_new_'):
-                                        # Оплата Креатора без bot_id: создаем бота для оплатившего пользователя
-                                        owner_id_new = payment_info['user_id']
-                                        creator_bot_id = create_bot_in_db(owner_id_new, 'creator')
-                                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice.invoice_id,), commit=True)
-                                        logging.info(f"Бот Креатор {creator_bot_id} создан после оплаты счета #{invoice.invoice_id} (новая покупка)")
-                                        try:
-                                            bot.send_message(owner_id_new, f"✅ Оплата прошла успешно! Бот Креатор #{creator_bot_id} создан!\n\nОжидайте выдачи бота! Вам напишет админ!")
-                                        except Exception as e:
-                                            logging.error(f"Не удалось уведомить покупателя {owner_id_new} о создании Креатора: {e}")
-                                        # Уведомляем администратора о покупке
-                                        try:
-                                            buyer = get_user(owner_id_new)
-                                            bot.send_message(ADMIN_ID, f"🛒 Покупка Креатора (фон): пользователь <code>{owner_id_new}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice.invoice_id}. Создан бот #{creator_bot_id}.", parse_mode="HTML")
-                                        except Exception as e:
-                                            logging.warning(f"Не удалось уведомить админа о фоновой покупке Креатора: {e}")
-                                    elif invoice.payload.startswith('creator_'):
-                                        # Оплата Креатора, привязанная к существующему боту (из меню бота)
-                                        owner_id_existing = get_bot_by_id(bot_id_to_update)['owner_id']
-                                        creator_bot_id = create_bot_in_db(owner_id_existing, 'creator')
-                                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice.invoice_id,), commit=True)
-                                        logging.info(f"Бот Креатор {creator_bot_id} создан после оплаты счета #{invoice.invoice_id}")
-                                        try:
-                                            bot.send_message(owner_id_existing, f"✅ Оплата прошла успешно! Бот Креатор #{creator_bot_id} создан!\n\nОжидайте выдачи бота! Вам напишет админ!")
-                                        except Exception as e:
-                                            logging.error(f"Не удалось уведомить владельца {owner_id_existing} о создании Креатора: {e}")
-                                        # Уведомляем администратора
-                                        try:
-                                            buyer = get_user(owner_id_existing)
-                                            bot.send_message(ADMIN_ID, f"🛒 Покупка Креатора (фон): пользователь <code>{owner_id_existing}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice.invoice_id}. Создан бот #{creator_bot_id}.", parse_mode="HTML")
-                                        except Exception as e:
-                                            logging.warning(f"Не удалось уведомить админа о фоновой покупке Креатора (existing): {e}")
+                    await reconcile_crypto_payments()
                 except Exception as e:
                     logging.error(f"Ошибка в фоновой проверке платежей: {e}")
                 
-                await asyncio.sleep(120)
+                await asyncio.sleep(interval)
         
         asyncio.run_coroutine_threadsafe(check_payments_periodically(), async_loop)
 
+    threading.Thread(target=notification_sender_worker, daemon=True).start()
     payment_thread = threading.Thread(target=run_payment_checker, daemon=True)
     payment_thread.start()
     logging.info("Фоновая проверка Crypto Pay платежей запущена.")
 
-    def cleanup_zombie_processes():
-        """Проверяет и сбрасывает зомби-процессы каждые 5 минут"""
-        # <-- Этот код имеет отступ в 8 пробелов
-        logging.info("🧹 Воркер очистки зомби-процессов запущен.")
-        while True:
-            # <-- Этот код имеет отступ в 12 пробелов
-            try:
-                running_bots = db_execute(
-                    "SELECT id, pid FROM bots WHERE status = 'running' AND pid IS NOT NULL",
-                    fetchall=True
-                )
-                cleaned_count = 0
-                for bot_data in running_bots:
-                    if not psutil.pid_exists(bot_data['pid']):
-                        logging.warning(f"Найден 'зомби' процесс для бота ID: {bot_data['id']} (PID: {bot_data['pid']}). Сбрасываю статус.")
-                        update_bot_process_info(bot_data['id'], 'stopped', None, None)
-                        cleaned_count += 1
-                if cleaned_count > 0:
-                    logging.info(f"Очистка завершена. Исправлено {cleaned_count} 'зомби' записей.")
-            except Exception as e:
-                logging.error(f"Ошибка в воркере очистки зомби-процессов: {e}")
-            
-            time.sleep(300) # Проверка каждые 5 минут
-
-    zombie_cleaner_thread = threading.Thread(target=cleanup_zombie_processes, daemon=True)
-    zombie_cleaner_thread.start()
+    bot_supervisor.install_signal_handler()
+    supervisor_thread = threading.Thread(target=bot_supervisor.run, daemon=True)
+    supervisor_thread.start()
 
 
     @bot.message_handler(commands=['start'])
     def handle_start(message):
         get_user(message.from_user.id, message.from_user.username)
+        mark_user_reachable(message.from_user.id)
         welcome = get_custom_text('creator_welcome')
         wm_enabled_raw = get_setting('creator_watermark_enabled')
         try:
@@ -4588,6 +7818,7 @@ if __name__ == '__main__':
     @bot.message_handler(func=lambda message: True, content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'sticker', 'animation'])
     def handle_text_buttons(message):
         user_id = message.from_user.id
+        mark_user_reachable(user_id)
         if user_id in user_states and message.text != '❌ Отмена':
             del user_states[user_id]
         
@@ -4744,26 +7975,26 @@ if __name__ == '__main__':
                 min_users = int(float(get_setting('bots_list_min_users') or 30))
             except Exception:
                 min_users = 30
-            listed = build_public_bots_list(min_users)
-            if not listed:
+            rendered = render_public_bots_page(0)
+            if not rendered:
                 bot.send_message(user_id, f"Список пуст. Нет ботов с ≥ {min_users} пользователями.")
                 return
-            lines = []
-            for bid, uname, btype, cnt, link in listed[:50]:
-                type_icon = "💸" if btype == 'ref' else ("⭐" if btype == 'stars' else "🖱")
-                username_show = f"@{uname}" if uname != 'Без имени' else 'Без имени'
-                link_show = link if link != '—' else '—'
-                lines.append(f"{type_icon} ID: <code>{bid}</code> | {username_show} | 👥 {cnt} | 🔗 {link_show}")
-            text = "<b>📋 Списки ботов</b>\n\n" + "\n".join(lines)
-            bot.send_message(user_id, text, parse_mode="HTML")
+            text, markup = rendered
+            bot.send_message(user_id, text, parse_mode="HTML", reply_markup=markup)
         elif message.text == main_buttons['my_bots']:
             bot.send_message(user_id, get_custom_text('my_bots_intro'), parse_mode="HTML", reply_markup=create_my_bots_menu(user_id))
         elif message.text == main_buttons['wallet']:
             handle_personal_cabinet(message)
         elif message.text == main_buttons['about']:
-            total_users = db_execute("SELECT COUNT(*) FROM users", fetchone=True)[0]
-            total_bots_created = db_execute("SELECT COUNT(*) FROM bots", fetchone=True)[0]
-            running_bots = db_execute("SELECT COUNT(*) FROM bots WHERE status = 'running'", fetchone=True)[0]
+            gauges = get_stats_gauges()
+            if gauges:
+                total_users = int(gauges.get('users_total', {}).get('', 0))
+                total_bots_created = int(gauges.get('bots_total', {}).get('', 0))
+                running_bots = int(gauges.get('bots_running', {}).get('', 0))
+            else:
+                total_users = db_execute("SELECT COUNT(*) FROM users", fetchone=True)[0]
+                total_bots_created = db_execute("SELECT COUNT(*) FROM bots", fetchone=True)[0]
+                running_bots = db_execute("SELECT COUNT(*) FROM bots WHERE status = 'running'", fetchone=True)[0]
 
             text = (
                 "📊 <b>Статистика проекта</b> ❞\n"
@@ -4798,6 +8029,7 @@ if __name__ == '__main__':
         except: pass
         
         user_id = call.from_user.id
+        mark_user_reachable(user_id)
         try:
             # Handle watermark toggle callback (admin only)
             if call.data == 'wm_toggle' and is_admin(user_id):
@@ -4823,6 +8055,24 @@ if __name__ == '__main__':
                     pass
                 return
 
+            # Страницы публичного '📋 Списки ботов'
+            if call.data.startswith('botslist_page_'):
+                bot.answer_callback_query(call.id)
+                try:
+                    page = max(0, int(call.data.rsplit('_', 1)[1]))
+                except ValueError:
+                    return
+                rendered = render_public_bots_page(page)
+                if not rendered:
+                    bot.edit_message_text("Список пуст.", user_id, call.message.message_id)
+                    return
+                text, markup = rendered
+                try:
+                    bot.edit_message_text(text, user_id, call.message.message_id, parse_mode="HTML", reply_markup=markup)
+                except Exception:
+                    pass
+                return
+
             # Handle bots list feature toggle (admin only)
             if call.data == 'bl_toggle' and is_admin(user_id):
                 bl_enabled_raw = get_setting('bots_list_feature_enabled')
@@ -4900,12 +8150,11 @@ if __name__ == '__main__':
                         bot.answer_callback_query(call.id, "⏳ Создаю счет...")
                         vip_price = float(get_setting('vip_price') or 120.0)
                         
-                        async def create_invoice_async():
+                        def create_invoice():
                             try:
-                                invoice = await local_crypto.create_invoice(asset='USDT', amount=vip_price, fiat='RUB', payload=f"vip_{bot_id}")
+                                invoice = crypto_pay_call('create_invoice', asset='USDT', amount=vip_price, fiat='RUB', payload=f"vip_{bot_id}")
                                 if invoice:
-                                    db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status) VALUES (?, ?, ?, ?, 'pending')",
-                                               (invoice.invoice_id, bot_id, user_id, vip_price), commit=True)
+                                    register_crypto_invoice(invoice.invoice_id, bot_id, user_id, vip_price)
                                     markup = types.InlineKeyboardMarkup(row_width=1)
                                     markup.add(types.InlineKeyboardButton("💳 Оплатить счет", url=invoice.bot_invoice_url))
                                     markup.add(types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"vip_{bot_id}_check_{invoice.invoice_id}"))
@@ -4915,7 +8164,7 @@ if __name__ == '__main__':
                                 logging.error(f"Ошибка создания счета CryptoPay: {e}")
                                 bot.answer_callback_query(call.id, "❌ Не удалось создать счет. Попробуйте позже.", show_alert=True)
                         
-                        run_async_task(create_invoice_async())
+                        create_invoice()
 
                 elif action == 'other':
                     admin_info = bot.get_chat(ADMIN_ID)
@@ -4927,21 +8176,24 @@ if __name__ == '__main__':
                     invoice_id_to_check = int(parts[3])
                     bot.answer_callback_query(call.id, "Проверяю статус платежа...")
                     
-                    async def check_single_invoice():
+                    def check_single_invoice():
                         local_crypto = get_crypto_client()
                         if not local_crypto:
                             bot.answer_callback_query(call.id, "❌ Crypto Pay недоступен сейчас.", show_alert=True)
                             return
-                        invoices = await local_crypto.get_invoices(invoice_ids=str(invoice_id_to_check))
+                        try:
+                            invoices = crypto_pay_call('get_invoices', invoice_ids=str(invoice_id_to_check))
+                        except CryptoPayUnavailable as e:
+                            bot.send_message(user_id, f"⏳ {e}")
+                            return
                         if invoices and invoices[0].status == 'paid':
-                            update_bot_setting(bot_id, 'vip_status', True)
-                            db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice_id_to_check,), commit=True)
+                            apply_paid_invoices(invoices[:1], notify_owner=False, background=False)
                             bot.edit_message_text(f"✅ Оплата прошла успешно! VIP-статус для бота #{bot_id} активирован.", user_id, call.message.message_id,
                                                   reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ В меню бота", callback_data=f"actions_{bot_id}")))
                         else:
                             bot.answer_callback_query(call.id, "❌ Платеж еще не прошел или счет истек.", show_alert=True)
                     
-                    run_async_task(check_single_invoice())
+                    check_single_invoice()
                 return
             
             if call.data.startswith('buy_creator_'):
@@ -4978,13 +8230,12 @@ if __name__ == '__main__':
                         return
                     bot.answer_callback_query(call.id, "⏳ Создаю счет...")
                     creator_price = float(get_setting('creator_price') or 500.0)
-                    async def create_creatornew_invoice_async():
+                    def create_creatornew_invoice():
                         try:
                             payload = f"creator_new_{user_id}"
-                            invoice = await local_crypto.create_invoice(asset='USDT', amount=creator_price, fiat='RUB', payload=payload)
+                            invoice = crypto_pay_call('create_invoice', asset='USDT', amount=creator_price, fiat='RUB', payload=payload)
                             if invoice:
-                                db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status) VALUES (?, ?, ?, ?, 'pending')",
-                                           (invoice.invoice_id, 0, user_id, creator_price), commit=True)
+                                register_crypto_invoice(invoice.invoice_id, 0, user_id, creator_price)
                                 markup = types.InlineKeyboardMarkup(row_width=1)
                                 markup.add(types.InlineKeyboardButton("💳 Оплатить счет", url=invoice.bot_invoice_url))
                                 markup.add(types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"creatornew_check_{invoice.invoice_id}"))
@@ -4993,7 +8244,7 @@ if __name__ == '__main__':
                         except Exception as e:
                             logging.error(f"Ошибка создания счета CryptoPay для Креатора (new): {e}")
                             bot.answer_callback_query(call.id, "❌ Не удалось создать счет. Попробуйте позже.", show_alert=True)
-                    run_async_task(create_creatornew_invoice_async())
+                    create_creatornew_invoice()
                     return
                 elif action == 'other' and parts[2] == 'payment':
                     admin_info = bot.get_chat(ADMIN_ID)
@@ -5004,83 +8255,85 @@ if __name__ == '__main__':
                 elif action == 'check':
                     invoice_id_to_check = int(parts[2])
                     bot.answer_callback_query(call.id, "Проверяю статус платежа...")
-                    async def check_creatornew_invoice():
+                    def check_creatornew_invoice():
                         local_crypto = get_crypto_client()
                         if not local_crypto:
                             bot.answer_callback_query(call.id, "❌ Crypto Pay недоступен сейчас.", show_alert=True)
                             return
-                        invoices = await local_crypto.get_invoices(invoice_ids=str(invoice_id_to_check))
+                        try:
+                            invoices = crypto_pay_call('get_invoices', invoice_ids=str(invoice_id_to_check))
+                        except CryptoPayUnavailable as e:
+                            bot.send_message(user_id, f"⏳ {e}")
+                            return
                         if invoices and invoices[0].status == 'paid':
-                            creator_bot_id = create_bot_in_db(user_id, 'creator')
-                            db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice_id_to_check,), commit=True)
+                            result = apply_paid_invoices(invoices[:1], notify_owner=False, background=False).get(invoice_id_to_check)
+                            if not result:
+                                bot.answer_callback_query(call.id, "❌ Счет не найден. Обратитесь к администратору.", show_alert=True)
+                                return
+                            creator_bot_id = result['bot_id']
                             bot.edit_message_text(f"✅ Оплата прошла успешно! Бот Креатор #{creator_bot_id} создан!\n\nОжидайте выдачи бота! Вам напишет админ!", user_id, call.message.message_id,
                                                   reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ В меню ботов", callback_data="back_to_bots_list")))
-                            try:
-                                buyer = get_user(user_id)
-                                bot.send_message(ADMIN_ID, f"🛒 Покупка Креатора: пользователь <code>{user_id}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice_id_to_check}. Создан бот #{creator_bot_id}.", parse_mode="HTML")
-                            except Exception as e:
-                                logging.warning(f"Не удалось уведомить админа о покупке Креатора: {e}")
                         else:
                             bot.answer_callback_query(call.id, "❌ Платеж еще не прошел или счет истек.", show_alert=True)
-                    run_async_task(check_creatornew_invoice())
+                    check_creatornew_invoice()
                 return
             
             elif call.data.startswith('cashlaitnew_check_'):
                 parts = call.data.split('_')
                 invoice_id_to_check = int(parts[2])
                 bot.answer_callback_query(call.id, "Проверяю статус платежа...")
-                async def check_cashlaitnew_invoice():
+                def check_cashlaitnew_invoice():
                     local_crypto = get_crypto_client()
                     if not local_crypto:
                         bot.answer_callback_query(call.id, "❌ Crypto Pay недоступен сейчас.", show_alert=True)
                         return
-                    invoices = await local_crypto.get_invoices(invoice_ids=str(invoice_id_to_check))
+                    try:
+                        invoices = crypto_pay_call('get_invoices', invoice_ids=str(invoice_id_to_check))
+                    except CryptoPayUnavailable as e:
+                        bot.send_message(user_id, f"⏳ {e}")
+                        return
                     if invoices and invoices[0].status == 'paid':
-                        cashlait_bot_id = create_bot_in_db(user_id, 'cashlait')
-                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice_id_to_check,), commit=True)
+                        result = apply_paid_invoices(invoices[:1], notify_owner=False, background=False).get(invoice_id_to_check)
+                        if not result:
+                            bot.answer_callback_query(call.id, "❌ Счет не найден. Обратитесь к администратору.", show_alert=True)
+                            return
+                        cashlait_bot_id = result['bot_id']
                         bot.edit_message_text(f"✅ Оплата прошла успешно! CashLait бот #{cashlait_bot_id} создан! Теперь он в списке ваших ботов:", user_id, call.message.message_id,
                                               reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ В меню ботов", callback_data="back_to_bots_list")))
-                        try:
-                            buyer = get_user(user_id)
-                            bot.send_message(ADMIN_ID, f"🛒 Покупка CashLait: пользователь <code>{user_id}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice_id_to_check}. Создан бот #{cashlait_bot_id}.", parse_mode="HTML")
-                        except Exception as e:
-                            logging.warning(f"Не удалось уведомить админа о покупке CashLait: {e}")
                     else:
                         bot.answer_callback_query(call.id, "❌ Платеж еще не прошел или счет истек.", show_alert=True)
                 
-                run_async_task(check_cashlaitnew_invoice())
+                check_cashlaitnew_invoice()
                 return
             elif call.data.startswith('dicelitenew_check_'):
                 parts = call.data.split('_')
                 invoice_id_to_check = int(parts[2])
                 bot.answer_callback_query(call.id, "Проверяю статус платежа...")
-                async def check_dicelitenew_invoice():
+                def check_dicelitenew_invoice():
                     local_crypto = get_crypto_client()
                     if not local_crypto:
                         bot.answer_callback_query(call.id, "❌ Crypto Pay недоступен сейчас.", show_alert=True)
                         return
-                    invoices = await local_crypto.get_invoices(invoice_ids=str(invoice_id_to_check))
+                    try:
+                        invoices = crypto_pay_call('get_invoices', invoice_ids=str(invoice_id_to_check))
+                    except CryptoPayUnavailable as e:
+                        bot.send_message(user_id, f"⏳ {e}")
+                        return
                     if invoices and invoices[0].status == 'paid':
-                        dicelite_bot_id = create_bot_in_db(user_id, 'dicelite')
-                        db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice_id_to_check,), commit=True)
+                        result = apply_paid_invoices(invoices[:1], notify_owner=False, background=False).get(invoice_id_to_check)
+                        if not result:
+                            bot.answer_callback_query(call.id, "❌ Счет не найден. Обратитесь к администратору.", show_alert=True)
+                            return
+                        dicelite_bot_id = result['bot_id']
                         bot.edit_message_text(
                             f"✅ Оплата прошла успешно! DiceLite бот #{dicelite_bot_id} создан! Теперь он в списке ваших ботов.",
                             user_id,
                             call.message.message_id,
                             reply_markup=create_my_bots_menu(user_id)
                         )
-                        try:
-                            buyer = get_user(user_id)
-                            bot.send_message(
-                                ADMIN_ID,
-                                f"🛒 Покупка DiceLite: пользователь <code>{user_id}</code> (@{escape(buyer['username'] or 'N/A')}) оплатил счет #{invoice_id_to_check}. Создан бот #{dicelite_bot_id}.",
-                                parse_mode="HTML"
-                            )
-                        except Exception as e:
-                            logging.warning(f"Не удалось уведомить админа о покупке DiceLite: {e}")
                     else:
                         bot.answer_callback_query(call.id, "❌ Платеж еще не прошел или счет истек.", show_alert=True)
-                run_async_task(check_dicelitenew_invoice())
+                check_dicelitenew_invoice()
                 return
 
             if call.data.startswith('creator_'):
@@ -5102,12 +8355,11 @@ if __name__ == '__main__':
                         bot.answer_callback_query(call.id, "⏳ Создаю счет...")
                         creator_price = float(get_setting('creator_price') or 500.0)
                         
-                        async def create_creator_invoice_async():
+                        def create_creator_invoice():
                             try:
-                                invoice = await local_crypto.create_invoice(asset='USDT', amount=creator_price, fiat='RUB', payload=f"creator_{bot_id}")
+                                invoice = crypto_pay_call('create_invoice', asset='USDT', amount=creator_price, fiat='RUB', payload=f"creator_{bot_id}")
                                 if invoice:
-                                    db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status) VALUES (?, ?, ?, ?, 'pending')",
-                                               (invoice.invoice_id, bot_id, user_id, creator_price), commit=True)
+                                    register_crypto_invoice(invoice.invoice_id, bot_id, user_id, creator_price)
                                     markup = types.InlineKeyboardMarkup(row_width=1)
                                     markup.add(types.InlineKeyboardButton("💳 Оплатить счет", url=invoice.bot_invoice_url))
                                     markup.add(types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"creator_{bot_id}_check_{invoice.invoice_id}"))
@@ -5117,7 +8369,7 @@ if __name__ == '__main__':
                                 logging.error(f"Ошибка создания счета CryptoPay для Креатора: {e}")
                                 bot.answer_callback_query(call.id, "❌ Не удалось создать счет. Попробуйте позже.", show_alert=True)
                         
-                        run_async_task(create_creator_invoice_async())
+                        create_creator_invoice()
                         return
                     
                     elif action == 'other':
@@ -5131,22 +8383,29 @@ if __name__ == '__main__':
                         invoice_id_to_check = int(parts[3])
                         bot.answer_callback_query(call.id, "Проверяю статус платежа...")
                         
-                        async def check_creator_invoice():
+                        def check_creator_invoice():
                             local_crypto = get_crypto_client()
                             if not local_crypto:
                                 bot.answer_callback_query(call.id, "❌ Crypto Pay недоступен сейчас.", show_alert=True)
                                 return
-                            invoices = await local_crypto.get_invoices(invoice_ids=str(invoice_id_to_check))
+                            try:
+                                invoices = crypto_pay_call('get_invoices', invoice_ids=str(invoice_id_to_check))
+                            except CryptoPayUnavailable as e:
+                                bot.send_message(user_id, f"⏳ {e}")
+                                return
                             if invoices and invoices[0].status == 'paid':
                                 # Создаем бота Креатор
-                                creator_bot_id = create_bot_in_db(user_id, 'creator')
-                                db_execute("UPDATE crypto_payments SET status = 'paid' WHERE invoice_id = ?", (invoice_id_to_check,), commit=True)
+                                result = apply_paid_invoices(invoices[:1], notify_owner=False, background=False).get(invoice_id_to_check)
+                                if not result:
+                                    bot.answer_callback_query(call.id, "❌ Счет не найден. Обратитесь к администратору.", show_alert=True)
+                                    return
+                                creator_bot_id = result['bot_id']
                                 bot.edit_message_text(f"✅ Оплата прошла успешно! Бот Креатор #{creator_bot_id} создан!\n\nОжидайте выдачи бота! Вам напишет админ!", user_id, call.message.message_id,
                                                       reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ В меню ботов", callback_data="back_to_bots_list")))
                             else:
                                 bot.answer_callback_query(call.id, "❌ Платеж еще не прошел или счет истек.", show_alert=True)
                         
-                        run_async_task(check_creator_invoice())
+                        check_creator_invoice()
                         return
             
             if call.data == "creator_withdraw_start":
@@ -5202,7 +8461,7 @@ if __name__ == '__main__':
                 if action == 'apply':
                     bot_info = get_bot_by_id(bot_id)
                     owner = get_user(bot_info['owner_id'])
-                    user_count = get_child_bot_user_count(bot_id, bot_info['bot_type'])
+                    user_count = get_cached_bot_user_count(bot_id, bot_info['bot_type'])
                     owner_username = f"@{owner['username']}" if owner['username'] else "Не указан"
                     bot_username = f"@{bot_info['bot_username']}" if bot_info['bot_username'] else "Не указан"
                     admin_text = (f"🚨 <b>Заявка на подключение Flyer</b>\n\n"
@@ -5277,13 +8536,12 @@ if __name__ == '__main__':
                     return
                 bot.answer_callback_query(call.id, "⏳ Создаю счет...")
                 cashlait_price = float(get_setting('cashlait_price') or 1.0)
-                async def create_cashlait_invoice_async():
+                def create_cashlait_invoice():
                     try:
                         payload = f"cashlait_new_{user_id}"
-                        invoice = await local_crypto.create_invoice(asset='USDT', amount=cashlait_price, fiat='USD', payload=payload)
+                        invoice = crypto_pay_call('create_invoice', asset='USDT', amount=cashlait_price, fiat='USD', payload=payload)
                         if invoice:
-                            db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status) VALUES (?, ?, ?, ?, 'pending')",
-                                       (invoice.invoice_id, 0, user_id, cashlait_price), commit=True)
+                            register_crypto_invoice(invoice.invoice_id, 0, user_id, cashlait_price)
                             markup = types.InlineKeyboardMarkup(row_width=1)
                             markup.add(types.InlineKeyboardButton("💳 Оплатить счет", url=invoice.bot_invoice_url))
                             markup.add(types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"cashlaitnew_check_{invoice.invoice_id}"))
@@ -5298,7 +8556,7 @@ if __name__ == '__main__':
                     except Exception as e:
                         logging.error(f"Ошибка создания счета CryptoPay для CashLait: {e}")
                         bot.answer_callback_query(call.id, "❌ Не удалось создать счет. Попробуйте позже.", show_alert=True)
-                run_async_task(create_cashlait_invoice_async())
+                create_cashlait_invoice()
                 return
             if call.data == "create_bot_dicelite":
                 if not is_crypto_token_configured():
@@ -5310,13 +8568,12 @@ if __name__ == '__main__':
                     return
                 bot.answer_callback_query(call.id, "⏳ Создаю счет...")
                 dicelite_price = float(get_setting('dicelite_price') or 1.0)
-                async def create_dicelite_invoice_async():
+                def create_dicelite_invoice():
                     try:
                         payload = f"dicelite_new_{user_id}"
-                        invoice = await local_crypto.create_invoice(asset='USDT', amount=dicelite_price, fiat='USD', payload=payload)
+                        invoice = crypto_pay_call('create_invoice', asset='USDT', amount=dicelite_price, fiat='USD', payload=payload)
                         if invoice:
-                            db_execute("INSERT INTO crypto_payments (invoice_id, bot_id, user_id, amount, status) VALUES (?, ?, ?, ?, 'pending')",
-                                       (invoice.invoice_id, 0, user_id, dicelite_price), commit=True)
+                            register_crypto_invoice(invoice.invoice_id, 0, user_id, dicelite_price)
                             markup = types.InlineKeyboardMarkup(row_width=1)
                             markup.add(types.InlineKeyboardButton("💳 Оплатить счет", url=invoice.bot_invoice_url))
                             markup.add(types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"dicelitenew_check_{invoice.invoice_id}"))
@@ -5331,7 +8588,7 @@ if __name__ == '__main__':
                     except Exception as e:
                         logging.error(f"Ошибка создания счета CryptoPay для DiceLite: {e}")
                         bot.answer_callback_query(call.id, "❌ Не удалось создать счет. Попробуйте позже.", show_alert=True)
-                run_async_task(create_dicelite_invoice_async())
+                create_dicelite_invoice()
                 return
             if call.data == "create_bot_exchange":
                 bot.answer_callback_query(call.id, "Бот создается...")
@@ -5358,21 +8615,25 @@ if __name__ == '__main__':
                 }
                 bot_type_name = type_names.get(bot_info['bot_type'], "Неизвестный шаблон")
                 if bot_info['status'] == 'running' and bot_info['pid'] and psutil.pid_exists(bot_info['pid']):
-                    resources = get_process_resources(bot_info['pid'])
+                    resources = get_bot_resources(bot_id)
                     start_time_val = bot_info['start_time']
                     uptime = time.time() - start_time_val if start_time_val else 0
                     status_text = "🟢 Запущен"
                 else:
                     if bot_info['status'] == 'running': update_bot_process_info(bot_id, 'stopped', None, None)
-                    resources = {"ram": 0, "cpu": 0}; uptime = 0
+                    resources = {"ram": 0, "cpu": 0, "fds": None, "threads": None, "db_size": None, "shared": False}; uptime = 0
                     status_text = "🔴 Остановлен" if bot_info['status'] == 'stopped' else "⚠️ Не настроен"
                 text = (f"🤖 <b>Бот:</b> <code>{escape(bot_name)}</code> (ID: <code>{bot_id}</code>)\n"
                         f"🧢 <b>Шаблон:</b> {bot_type_name}\n"
                         f"━━━━━━━━━━━━━━━\n"
                         f"📊 <b>Состояние:</b> {status_text}\n"
-                        f"💾 <b>RAM:</b> {resources['ram']:.2f} МБ\n"
-                        f"⚙️ <b>CPU:</b> {resources['cpu']:.1f}%\n"
-                        f"⏱️ <b>Аптайм:</b> {format_uptime(uptime)}")
+                        f"💾 <b>RAM:</b> {resources['ram']:.2f} МБ{' (общий хост)' if resources['shared'] else ''}\n"
+                        f"⚙️ <b>CPU:</b> {resources['cpu']:.1f}%\n")
+                if resources['threads'] is not None:
+                    text += f"🧵 <b>Потоки / FD:</b> {resources['threads']} / {resources['fds'] if resources['fds'] is not None else '—'}\n"
+                if resources['db_size'] is not None:
+                    text += f"🗄 <b>БД:</b> {resources['db_size'] / (1024 * 1024):.2f} МБ\n"
+                text += f"⏱️ <b>Аптайм:</b> {format_uptime(uptime)}"
                 bot.edit_message_text(text, user_id, call.message.message_id, reply_markup=create_bot_actions_menu(bot_id), parse_mode="HTML")
             
             elif action == 'config':
@@ -5406,9 +8667,9 @@ if __name__ == '__main__':
                 bot.edit_message_text(f"✅ Бот успешно передан пользователю <code>{new_owner_id}</code>.", user_id, call.message.message_id, reply_markup=create_my_bots_menu(user_id), parse_mode="HTML")
 
             elif action == 'logs' and data[2] == 'get':
-                try:
-                    with open(f"logs/bot_{bot_id}.log", "rb") as log_file: bot.send_document(user_id, log_file, caption=f"📄 Логи для бота #{bot_id}")
-                except FileNotFoundError: bot.answer_callback_query(call.id, "❌ Лог-файл не найден.", show_alert=True)
+                log_document = export_log_document(f"bot_{bot_id}")
+                if log_document is None: bot.answer_callback_query(call.id, "❌ Лог-файл не найден.", show_alert=True)
+                else: bot.send_document(user_id, log_document, caption=f"📄 Логи для бота #{bot_id}")
 
             elif action == 'delete' and data[2] == 'confirm':
                 # Подтверждение удаления бота целиком
@@ -5468,26 +8729,15 @@ if __name__ == '__main__':
                  set_user_state(user_id, {'action': 'add_admin', 'bot_id': bot_id, 'message_id': msg.message_id})
                  
             elif action == 'logs':
-                 log_path = f"logs/bot_{bot_id}.log"
-                 if os.path.exists(log_path):
-                     try:
-                         # Create a temp copy to avoid file locking issues on Windows
-                         temp_log = f"logs/temp_read_{bot_id}_{int(time.time())}.log"
-                         try:
-                             import shutil
-                             shutil.copy2(log_path, temp_log)
-                             with open(temp_log, "r", encoding="utf-8") as f:
-                                 lines = f.readlines()
-                                 last_lines = "".join(lines[-30:]) # Read last 30 lines
-                                 if not last_lines.strip(): last_lines = "Лог пуст."
-                         finally:
-                             if os.path.exists(temp_log):
-                                 try: os.remove(temp_log)
-                                 except: pass
-                     except Exception as e:
-                         last_lines = f"Ошибка чтения лога: {e}"
-                 else:
-                     last_lines = "Файл логов не найден. Бот еще не запускался?"
+                 try:
+                     # Только последние 30 строк из хвоста, без чтения файла целиком
+                     last_lines = tail_log(f"bot_{bot_id}", lines=30)
+                     if last_lines is None:
+                         last_lines = "Файл логов не найден. Бот еще не запускался?"
+                     elif not last_lines.strip():
+                         last_lines = "Лог пуст."
+                 except Exception as e:
+                     last_lines = f"Ошибка чтения лога: {e}"
                  
                  try:
                      # Split long messages if needed
@@ -5571,6 +8821,9 @@ if __name__ == '__main__':
             logging.critical(f"Критическая ошибка в callback: {e}", exc_info=True)
     
     logging.info("Бот-конструктор запущен...")
+    if WEBHOOK_MODE_ENABLED and run_constructor_webhook():
+        logging.info("Конструктор получает обновления через вебхук.")
+        threading.Event().wait()
     try:
         bot.infinity_polling(timeout=20, long_polling_timeout=10, skip_pending=True)
     except Exception as e:
@@ -1131,9 +1131,9 @@ class CryptoPayClient:
 
         url = f"{self._base_url}/{method}"
         safe_payload = self._sanitize_mapping(payload)
-        logger.info("Crypto Pay API request: method=%s, url=%s, payload=%s", method, url, safe_payload)
+        logger.debug("Crypto Pay API request: method=%s, url=%s, payload=%s", method, url, safe_payload)
         try:
-            logger.info("Sending POST request to %s...", url)
+            logger.debug("Sending POST request to %s...", url)
             # Explicitly encode JSON with UTF-8 to handle emoji and unicode characters
             json_data = json.dumps(payload or {}, ensure_ascii=False)
             response = self._session.post(
@@ -1145,7 +1145,7 @@ class CryptoPayClient:
                 data=json_data.encode('utf-8'),
                 timeout=self._timeout,
             )
-            logger.info("Got response from Crypto Pay: status=%s", response.status_code)
+            logger.debug("Got response from Crypto Pay: status=%s", response.status_code)
         except requests.RequestException as exc:  # pragma: no cover - network failure paths
             logger.error("Crypto Pay network error: %s", exc, exc_info=True)
             raise CryptoPayError(f"Crypto Pay network error: {exc}") from exc
@@ -1155,12 +1155,12 @@ class CryptoPayClient:
         )
         try:
             data = response.json()
-            logger.info("Parsed JSON response from Crypto Pay")
+            logger.debug("Parsed JSON response from Crypto Pay")
         except ValueError as exc:
             logger.error("Crypto Pay returned non-JSON response: %s", exc, exc_info=True)
             raise CryptoPayError("Crypto Pay returned non-JSON response") from exc
 
-        logger.info("Crypto Pay response data %s: %s", method, self._sanitize_mapping(data))
+        logger.debug("Crypto Pay response data %s: %s", method, self._sanitize_mapping(data))
         if not data.get("ok"):
             error_msg = data.get("error", "Unknown Crypto Pay error")
             logger.error("Crypto Pay API error: %s, full data: %s", error_msg, data)
@@ -1169,7 +1169,7 @@ class CryptoPayClient:
         if result is None:
             logger.error("Crypto Pay response missing 'result' field! Full data: %s", data)
             raise CryptoPayError("Crypto Pay response missing result field")
-        logger.info("Crypto Pay request successful, returning result")
+        logger.debug("Crypto Pay request successful, returning result")
         return result
 
     def create_invoice(self, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -2445,16 +2445,16 @@ class StateManager:
     def set(self, user_id: int, state: str, **payload: Any) -> None:
         with self._lock:
             self._storage[user_id] = PendingState(state=state, payload=payload)
-            logger.info("StateManager.set() - user %s -> state '%s', payload keys: %s", 
+            logger.debug("StateManager.set() - user %s -> state '%s', payload keys: %s", 
                        user_id, state, list(payload.keys()))
 
     def pop(self, user_id: int) -> Optional[PendingState]:
         with self._lock:
             result = self._storage.pop(user_id, None)
             if result:
-                logger.info("StateManager.pop() - user %s had state '%s' (cleared)", user_id, result.state)
+                logger.debug("StateManager.pop() - user %s had state '%s' (cleared)", user_id, result.state)
             else:
-                logger.info("StateManager.pop() - user %s had NO state", user_id)
+                logger.debug("StateManager.pop() - user %s had NO state", user_id)
             return result
 
     def peek(self, user_id: int) -> Optional[PendingState]:
@@ -10189,10 +10189,14 @@ def process_delete_check(message: types.Message, user_state: PendingState) -> No
     states.pop(message.from_user.id)
 
 
-def main() -> None:
+def run_polling() -> None:
     logger.info("Starting Telegram bot")
     bot.infinity_polling(skip_pending=True)
 
 
+def main() -> None:
+    run_polling()
+
+
 if __name__ == "__main__":
     main()
@@ -21,6 +21,9 @@ from telebot.apihelper import ApiTelegramException
 # =================================================================================
 BOT_TOKEN = os.getenv("EXCHANGE_BOT_TOKEN")
 DB_PATH = os.getenv("EXCHANGE_DB", "exchange.db")
+# Versioned config snapshot written by the constructor; watched for hot updates
+BOT_CONFIG_PATH = os.getenv("BOT_CONFIG_PATH")
+CONFIG_WATCH_INTERVAL = 2.0
 # Ссылка на вашего конструктора (используется и для подписи, и для кнопки «Хочу такого же бота»)
 CREATOR_DEFAULT_LINK = "https://t.me/YourCreatorBot"
 # Parse ADMIN_IDS from env
@@ -169,13 +172,71 @@ db = Storage(DB_PATH)
 # Usually Creator bot updates DB on startup? No, Creator passes env var.
 # So if env var is present, we should use it as default or override.
 # Let's update DB if env var differs.
-env_welcome = os.getenv("EXCHANGE_WELCOME_TEXT")
-if env_welcome:
+def apply_env_overrides(source=None):
+    source = os.environ if source is None else source
+    env_welcome = (source.get("EXCHANGE_WELCOME_TEXT") or "").strip()
     current_db_welcome = db.get_setting('welcome_text')
-    # If DB is empty or we want to sync from Creator, update it.
-    # Creator is the source of truth if edited there.
-    if env_welcome != current_db_welcome:
-        db.set_setting('welcome_text', env_welcome)
+    # constructor_welcome_text remembers what Creator sent last time
+    previous_env_welcome = db.get_setting('constructor_welcome_text')
+    if env_welcome:
+        # Creator is the source of truth if edited there.
+        if env_welcome != current_db_welcome:
+            db.set_setting('welcome_text', env_welcome)
+    elif previous_env_welcome and current_db_welcome == previous_env_welcome:
+        # Removed in Creator and not edited in the bot since: fall back to DEFAULT_WELCOME
+        db.set_setting('welcome_text', "")
+    db.set_setting('constructor_welcome_text', env_welcome)
+
+def write_config_ack(version):
+    """Tell Creator which snapshot version is applied (<snapshot>.ack)."""
+    if not BOT_CONFIG_PATH:
+        return
+    ack_path = f"{BOT_CONFIG_PATH}.ack"
+    try:
+        with open(f"{ack_path}.tmp", "w", encoding="utf-8") as f:
+            f.write(str(version))
+        os.replace(f"{ack_path}.tmp", ack_path)
+    except OSError as e:
+        logger.warning(f"Failed to acknowledge config v{version}: {e}")
+
+apply_env_overrides()
+
+applied_config_version = int(os.getenv("BOT_CONFIG_VERSION", "0") or 0)
+write_config_ack(applied_config_version)
+
+def apply_config_snapshot(snapshot):
+    """Apply a constructor config snapshot if it is newer than the applied one."""
+    global applied_config_version
+    version = int(snapshot.get("version") or 0)
+    if version <= applied_config_version:
+        return False
+    apply_env_overrides(snapshot.get("env") or {})
+    applied_config_version = version
+    write_config_ack(version)
+    logger.info(f"Applied constructor config v{version}")
+    return True
+
+def watch_config_snapshot():
+    last_mtime = None
+    while True:
+        time.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            mtime = os.stat(BOT_CONFIG_PATH).st_mtime_ns
+        except OSError:
+            continue
+        if mtime == last_mtime:
+            continue
+        try:
+            with open(BOT_CONFIG_PATH, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read config snapshot: {e}")
+            continue
+        last_mtime = mtime
+        try:
+            apply_config_snapshot(snapshot)
+        except Exception as e:
+            logger.error(f"Failed to apply config snapshot: {e}")
 
 # =================================================================================
 # HELPERS
@@ -746,11 +807,22 @@ def message_processor(message):
             logger.error(f"Failed to forward message from {user_id}: {e}")
             # Don't tell user about error to keep it clean, or maybe a generic "Operator offline" if critical
 
-if __name__ == "__main__":
+def run_polling():
     logger.info("Starting Exchange Bot...")
     while True:
         try:
             bot.polling(non_stop=True, interval=1, timeout=20)
+            # polling returns normally only after bot.stop_polling()
+            break
         except Exception as e:
             logger.error(f"Polling error: {e}")
             time.sleep(5)
+
+def main():
+    # Под хостом снимок конфигурации отслеживает сам хост, здесь — только для отдельного процесса
+    if BOT_CONFIG_PATH:
+        threading.Thread(target=watch_config_snapshot, daemon=True).start()
+    run_polling()
+
+if __name__ == "__main__":
+    main()
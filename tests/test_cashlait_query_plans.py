@@ -0,0 +1,238 @@
+"""
+Регрессия планов запросов CashLait Storage.
+
+Каждый горячий метод Storage вызывается на временной БД, все выполненные им
+SQL-операторы перехватываются через trace callback и прогоняются через
+EXPLAIN QUERY PLAN. Строка плана "SCAN <таблица>" означает полный проход
+таблицы — тест падает с текстом запроса и планом.
+
+Каждый публичный метод Storage обязан быть либо в HOT_QUERIES, либо в
+FULL_TABLE_AGGREGATES (осознанные проходы по всей таблице для статистики админки),
+иначе падает test_every_storage_method_is_checked.
+
+Скрипт бота при импорте создает TeleBot и ходит в Telegram, поэтому из него
+исполняется только класс Storage и то, на что он ссылается (константы,
+now_utc, dec, WatchOutcome).
+"""
+
+import __future__
+import ast
+import sqlite3
+import sys
+import types
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+CASHLAIT_SCRIPT = Path(__file__).resolve().parents[1] / "cashlait_bot (7).py"
+
+
+def load_storage_module():
+    source = CASHLAIT_SCRIPT.read_text(encoding="utf-8-sig")
+    tree = ast.parse(source)
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = node
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            definitions[node.target.id] = node
+
+    needed, pending = set(), ["Storage"]
+    while pending:
+        name = pending.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        for child in ast.walk(definitions[name]):
+            if isinstance(child, ast.Name) and child.id in definitions:
+                pending.append(child.id)
+
+    def run(node):
+        # Отдельно скомпилированный узел не наследует from __future__ import annotations скрипта
+        code = compile(
+            ast.Module(body=[node], type_ignores=[]),
+            str(CASHLAIT_SCRIPT),
+            "exec",
+            flags=__future__.annotations.compiler_flag,
+            dont_inherit=True,
+        )
+        exec(code, module.__dict__)
+
+    module = types.ModuleType("cashlait_storage_under_test")
+    module.__file__ = str(CASHLAIT_SCRIPT)
+    sys.modules[module.__name__] = module
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                run(node)
+            except ImportError:
+                # telebot/requests Storage нужны только в аннотациях, а они не вычисляются
+                continue
+        elif any(definitions.get(name) is node for name in needed):
+            run(node)
+    return module
+
+
+cashlait = load_storage_module()
+
+NOW = datetime(2026, 1, 1, tzinfo=UTC)
+
+TG_USER = types.SimpleNamespace(id=1, username="user1", first_name="User", language_code="ru")
+
+
+def release_due_watch(db):
+    watch = db.get_due_subscription_watches(NOW + timedelta(days=5))[0]
+    db.apply_watch_outcomes([cashlait.WatchOutcome(watch=watch, action="release", checked_at=NOW)])
+
+
+HOT_QUERIES = {
+    "ensure_user": lambda db: db.ensure_user(TG_USER),
+    "get_user": lambda db: db.get_user(1),
+    "set_referrer_if_empty": lambda db: db.set_referrer_if_empty(1, 3),
+    "update_user_balance": lambda db: db.update_user_balance(1, delta_balance=Decimal("1"), inc_completed=1),
+    "add_task_log": lambda db: db.add_task_log(1, "flyer:sig", "flyer", "main", Decimal("0.1")),
+    "save_tasks": lambda db: db.save_tasks(1, "main", [{"signature": "flyer:new", "source": "flyer"}]),
+    "get_pending_task": lambda db: db.get_pending_task(1),
+    "delete_pending_task": lambda db: db.delete_pending_task(1),
+    "add_subscription_watch": lambda db: db.add_subscription_watch(
+        user_id=2, signature="flyer:sig2", source="flyer", reward=Decimal("0.1"), expires_at=NOW
+    ),
+    "apply_watch_outcomes": release_due_watch,
+    "set_setting": lambda db: db.set_setting("currency_symbol", "$"),
+    "create_withdraw_request": lambda db: db.create_withdraw_request(1, Decimal("1"), check_id="c1", check_url=None),
+    "create_deposit_request": lambda db: db.create_deposit_request(
+        1, Decimal("1"), Decimal("1"), invoice_id="inv-2", invoice_url=None
+    ),
+    "update_deposit_status": lambda db: db.update_deposit_status("inv-1", "paid"),
+    "add_referral_bonus": lambda db: db.add_referral_bonus(1, 2, 1, Decimal("0.1")),
+    "add_required_channel": lambda db: db.add_required_channel("Канал", "-1002", "https://t.me/c2", "global"),
+    "remove_required_channel": lambda db: db.remove_required_channel(1),
+    "add_custom_task": lambda db: db.add_custom_task(
+        placement="main", title="t", description="d", button_text="b", url="https://t.me/x", channel_id=None,
+        reward=Decimal("0.1"),
+    ),
+    "add_promo_task": lambda db: db.add_promo_task(
+        creator_id=1, signature="promo:2", title="t", description="d", url="https://t.me/x", button_text="b",
+        completions=5, cost_per_completion=Decimal("0.1"), total_cost=Decimal("0.5"), channel_id=-1003,
+        channel_username=None, channel_link="https://t.me/x",
+    ),
+    "increment_promo_completion": lambda db: db.increment_promo_completion("promo:1"),
+    "deactivate_promo_task": lambda db: db.deactivate_promo_task(1, 1),
+    "deactivate_custom_task": lambda db: db.deactivate_custom_task(1),
+    "has_task_completion": lambda db: db.has_task_completion(1, "flyer:sig", "main"),
+    "list_pending_tasks": lambda db: db.list_pending_tasks(1, "main"),
+    "load_tasks": lambda db: db.load_tasks(1, "main"),
+    "pending_task_signatures": lambda db: db.pending_task_signatures([1, 2, 3], "main"),
+    "remove_pending_tasks_by_signature": lambda db: db.remove_pending_tasks_by_signature("flyer:sig"),
+    "referral_counts": lambda db: db.referral_counts(1),
+    "get_due_subscription_watches": lambda db: db.get_due_subscription_watches(NOW),
+    "get_due_subscription_watches_after": lambda db: db.get_due_subscription_watches(NOW, after=(NOW.isoformat(), 5)),
+    "get_due_subscription_watches_user": lambda db: db.get_due_subscription_watches(NOW, user_id=1),
+    "subscription_watch_backlog": lambda db: db.subscription_watch_backlog(NOW),
+    "list_active_users_after": lambda db: db.list_active_users_after(0, NOW - timedelta(days=7), 500),
+    "get_required_channels": lambda db: db.get_required_channels("global"),
+    "list_custom_tasks": lambda db: db.list_custom_tasks("main"),
+    "list_promo_tasks": lambda db: db.list_promo_tasks(),
+    "get_user_active_promo_tasks": lambda db: db.get_user_active_promo_tasks(1),
+    "get_user_finished_promo_tasks": lambda db: db.get_user_finished_promo_tasks(1),
+    "get_setting": lambda db: db.get_setting("currency_symbol"),
+    "get_deposit_request": lambda db: db.get_deposit_request("inv-1"),
+}
+
+# Сводки админки: проход по всей таблице здесь ожидаем
+FULL_TABLE_AGGREGATES = {
+    "all_user_ids",
+    "count_users",
+    "count_new_users",
+    "total_earned",
+    "total_completed_tasks",
+    "total_withdrawn_amount",
+    "withdrawn_amount_since",
+    "total_topups",
+}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    db = cashlait.Storage(str(tmp_path / "cashlait.db"))
+    for user_id, referrer_id in ((1, None), (2, 1), (3, 2)):
+        db._conn.execute("INSERT INTO users (user_id, referrer_id) VALUES (?, ?)", (user_id, referrer_id))
+    db.add_subscription_watch(
+        user_id=1, signature="flyer:sig", source="flyer", reward=Decimal("0.1"), expires_at=NOW + timedelta(days=3)
+    )
+    db.save_tasks(1, "main", [{"signature": "flyer:sig", "source": "flyer"}])
+    db.create_deposit_request(1, Decimal("1"), Decimal("1"), invoice_id="inv-1", invoice_url=None)
+    db.add_required_channel("Канал", "-1001", "https://t.me/c1", "global")
+    db.add_custom_task(
+        placement="main", title="t", description="d", button_text="b", url="https://t.me/x", channel_id=None,
+        reward=Decimal("0.1"),
+    )
+    db.add_promo_task(
+        creator_id=1, signature="promo:1", title="t", description="d", url="https://t.me/x", button_text="b",
+        completions=5, cost_per_completion=Decimal("0.1"), total_cost=Decimal("0.5"), channel_id=-1001,
+        channel_username=None, channel_link="https://t.me/x",
+    )
+    db._conn.commit()
+    yield db
+    db._conn.close()
+
+
+def traced_statements(db, call):
+    statements = []
+    db._conn.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        db._conn.set_trace_callback(None)
+    return [
+        sql for sql in statements
+        if sql.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE")
+    ]
+
+
+def table_scans(db, sql):
+    plan = [row[3] for row in db._conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    return [detail for detail in plan if detail.startswith("SCAN ")], plan
+
+
+@pytest.mark.parametrize("method", sorted(HOT_QUERIES))
+def test_hot_query_does_not_scan_tables(storage, method):
+    statements = traced_statements(storage, HOT_QUERIES[method])
+    assert statements, f"{method} не выполнил ни одного запроса"
+    for sql in statements:
+        scans, plan = table_scans(storage, sql)
+        assert not scans, f"{method}: полный проход таблицы\n{sql}\n" + "\n".join(plan)
+
+
+def test_every_storage_method_is_checked():
+    public = {
+        name for name, member in vars(cashlait.Storage).items() if callable(member) and not name.startswith("_")
+    }
+    unchecked = public - set(HOT_QUERIES) - FULL_TABLE_AGGREGATES
+    assert not unchecked, f"методы Storage без проверки плана: {sorted(unchecked)}"
+    assert FULL_TABLE_AGGREGATES <= public, f"нет таких методов Storage: {sorted(FULL_TABLE_AGGREGATES - public)}"
+
+
+def test_migration_creates_storage_indexes(storage):
+    existing = {row["name"] for row in storage._conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(cashlait.STORAGE_INDEXES) <= existing
+
+
+def test_migration_adds_indexes_to_existing_database(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    cashlait.Storage(path)._conn.close()
+    conn = sqlite3.connect(path)
+    for name in cashlait.STORAGE_INDEXES:
+        conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+    conn.close()
+    db = cashlait.Storage(path)
+    existing = {row["name"] for row in db._conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    db._conn.close()
+    assert set(cashlait.STORAGE_INDEXES) <= existing
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Офлайн-прогон записанных обновлений через единый вход вебхуков конструктора.
+
+Конструктор в режиме WEBHOOK_MODE=1 WEBHOOK_OFFLINE=1 без WEBHOOK_PUBLIC_URL не
+трогает Telegram, а только слушает локальный вход. Этот скрипт играет роль Telegram: по одному
+POST на обновление с заголовком секрета, как это делает настоящий setWebhook.
+
+Файл — JSONL: либо сами объекты Update, либо записи {"bot_id": ..., "update": {...}}
+из WEBHOOK_RECORD_PATH (тогда можно отфильтровать один бот через --bot-id).
+
+    python webhook_replay.py updates.jsonl --secret <secret>
+    python webhook_replay.py recorded.jsonl --secret <secret> --bot-id 12 --url http://127.0.0.1:8081/tg
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+
+def read_updates(path, bot_id=None):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'update' in record:
+                if bot_id is not None and record.get('bot_id') != bot_id:
+                    continue
+                record = record['update']
+            yield record
+
+
+def post_update(url, secret, update, timeout):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update, ensure_ascii=False).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон записанных обновлений через вход вебхуков")
+    parser.add_argument('path', help="JSONL с обновлениями")
+    parser.add_argument('--secret', required=True, help="секрет маршрута бота (часть пути после /tg/)")
+    parser.add_argument('--url', default='http://127.0.0.1:8081/tg', help="адрес входа без секрета")
+    parser.add_argument('--bot-id', type=int, default=None, help="взять из записи только этот бот")
+    parser.add_argument('--delay', type=float, default=0.0, help="пауза между обновлениями, сек")
+    parser.add_argument('--retry-503', type=int, default=5, help="повторы при переполненной очереди, как у Telegram")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    url = f"{args.url.rstrip('/')}/{args.secret}"
+    statuses = Counter()
+    for update in read_updates(args.path, args.bot_id):
+        status = post_update(url, args.secret, update, args.timeout)
+        retries = 0
+        while status == 503 and retries < args.retry_503:
+            retries += 1
+            time.sleep(min(2 ** retries, 30))
+            status = post_update(url, args.secret, update, args.timeout)
+        statuses[status] += 1
+        if args.delay:
+            time.sleep(args.delay)
+    print(json.dumps(dict(statuses)))
+    return 0 if set(statuses) <= {200} else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())